@@ -5,6 +5,7 @@ import requests
 import logging
 import sys
 from datetime import datetime
+from retry_utils import get_all
 
 # Configure logging
 logging.basicConfig(
@@ -19,6 +20,8 @@ logger = logging.getLogger("ai-fix-agent")
 API_URL = os.getenv("API_URL", "http://backend:8000/api/v1")
 API_KEY = os.getenv("NETGUARD_API_KEY")
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai").lower() # openai, gemini, anthropic
+# Incidents younger than this may still be collecting correlated alerts
+INCIDENT_SETTLE_SECONDS = int(os.getenv("INCIDENT_SETTLE_SECONDS", "30"))
 
 # Determine LLM Key based on provider
 LLM_API_KEY = os.getenv("LLM_API_KEY")
@@ -37,11 +40,18 @@ def get_headers():
 import google.generativeai as genai
 import openai
 
-def ask_llm(alert, device_info):
+def ask_llm(alert, device_info, incident=None):
     """
     Constructs a prompt and queries the LLM for a remediation strategy.
     Returns a dict with 'action', 'reasoning', 'command'.
     """
+    incident_context = ""
+    if incident:
+        incident_context = f"""
+    Incident: {incident.get('alert_count', 1)} correlated alert(s) at this site. {incident.get('summary') or ''}
+    Root cause hypothesis: {incident.get('root_cause') or 'unknown'}
+    The alert below is the root-cause candidate; fix it rather than each affected device.
+    """
     if not LLM_API_KEY:
         logger.warning("No LLM API Key provided.")
         return None
@@ -55,7 +65,7 @@ def ask_llm(alert, device_info):
     Rule: {alert['rule_name']}
     Device: {device_info.get('name', 'Unknown')} ({device_info.get('ip_address', 'Unknown')})
     Platform: {device_info.get('platform', 'linux')}
-    
+    {incident_context}
     Valid Actions: REBOOT, RESTART_SERVICE, CLEAR_CACHE, IPSLA_RESET, IGNORE, ESCALATE.
     
     Output strictly valid JSON:
@@ -178,78 +188,94 @@ def report_fix_action(alert_id, action, status, output):
     except Exception as e:
         logger.error(f"Error reporting fix action: {e}")
 
-def update_alert_status(alert_id, status, resolution_summary=None):
+def update_incident_status(incident_id, status, alert_status="resolved", resolution_summary=None):
     """
-    Update the alert status in the backend.
+    Update an incident in the backend. Resolving it also closes all of its alerts.
     """
     try:
         payload = {
             "status": status,
+            "alert_status": alert_status,
             "resolution_summary": resolution_summary
         }
         resp = requests.patch(
-            f"{API_URL}/monitoring/alerts/{alert_id}",
+            f"{API_URL}/monitoring/incidents/{incident_id}",
             json=payload,
             headers=get_headers(),
             timeout=10
         )
         if resp.status_code == 200:
-            logger.info(f"Alert {alert_id} marked as {status}")
+            logger.info(f"Incident {incident_id} marked as {status}")
         else:
-            logger.error(f"Failed to update alert status: {resp.text}")
+            logger.error(f"Failed to update incident status: {resp.text}")
     except Exception as e:
-        logger.error(f"Error updating alert status: {e}")
+        logger.error(f"Error updating incident status: {e}")
+
+def incident_is_settled(incident):
+    """Give correlation time to gather an outage's alerts before acting on it."""
+    created = datetime.fromisoformat(incident['created_at'].replace("Z", ""))
+    return (datetime.utcnow() - created).total_seconds() >= INCIDENT_SETTLE_SECONDS
 
 def run_agent():
     logger.info("Starting AI Fix Agent...")
+    # Incident id -> alert_count when last decided, so a growing incident is re-evaluated
+    handled = {}
     
     while True:
         try:
-             resp = requests.get(
-                 f"{API_URL}/monitoring/alerts",
-                 headers=get_headers(),
-                 timeout=10
-             )
-             if resp.status_code == 200:
-                 alerts = resp.json()
-                 for alert in alerts:
-                     if alert['status'] == 'open' and alert['severity'] == 'critical':
-                         logger.info(f"Processing critical alert {alert['id']}")
-                         
-                         # Fetch detailed device info
-                         dev_resp = requests.get(
-                             f"{API_URL}/inventory/devices",
-                             headers=get_headers(),
-                             timeout=10
-                         )
-                         devices = dev_resp.json() if dev_resp.status_code == 200 else []
-                         device = next((d for d in devices if d['id'] == alert['device_id']), {})
-                         
-                         # Ask AI
-                         decision = ask_llm(alert, device)
+             incidents = get_all(f"{API_URL}/monitoring/incidents", {"status": "open", "severity": "critical", "limit": 200}, get_headers())
+             if incidents is not None:
+                 incidents = [
+                     i for i in incidents
+                     if handled.get(i['id']) != i['alert_count']
+                     and incident_is_settled(i)
+                 ]
+                 devices = []
+                 if incidents:
+                     # Fetch detailed device info once per cycle
+                     dev_resp = requests.get(
+                         f"{API_URL}/inventory/devices",
+                         headers=get_headers(),
+                         timeout=10
+                     )
+                     devices = dev_resp.json() if dev_resp.status_code == 200 else []
+
+                 for incident in incidents:
+                     logger.info(f"Processing critical incident {incident['id']} ({incident['alert_count']} alerts)")
+                     handled[incident['id']] = incident['alert_count']
+
+                     alerts = get_all(f"{API_URL}/monitoring/alerts", {"incident_id": incident['id'], "limit": 500}, get_headers()) or []
+                     if not alerts:
+                         continue
+                     alert = next((a for a in alerts if a['id'] == incident['alert_id']), alerts[0])
+                     device = next((d for d in devices if d['id'] == alert['device_id']), {})
+                     
+                     # Ask AI once for the whole incident
+                     decision = ask_llm(alert, device, incident)
+                     
+                     if decision:
+                         logger.info(f"AI Decision: {decision['action']} ({decision['analysis']})")
                          
-                         if decision:
-                             logger.info(f"AI Decision: {decision['action']} ({decision['analysis']})")
+                         if decision['action'] in ['REBOOT', 'RESTART_SERVICE', 'CLEAR_CACHE', 'IPSLA_RESET']:
+                             success, output = execute_fix(decision['action'], decision.get('command'), device.get('ip_address'))
+                             
+                             status_code = "success" if success else "failed"
+                             report_fix_action(alert['id'], decision['action'], status_code, output or decision['analysis'])
+                             
+                             if success:
+                                 logger.info(f"Fix executed. Marking incident resolved.")
+                                 update_incident_status(incident['id'], "resolved", "auto_fixed", resolution_summary=decision['analysis'])
+                             
+                         elif decision['action'] == 'ESCALATE':
+                             logger.info("AI decided to escalate to human.")
+                             report_fix_action(alert['id'], "ESCALATE", "pending", decision['analysis'])
                              
-                             if decision['action'] in ['REBOOT', 'RESTART_SERVICE', 'CLEAR_CACHE', 'IPSLA_RESET']:
-                                 success, output = execute_fix(decision['action'], decision.get('command'), device.get('ip_address'))
-                                 
-                                 status_code = "success" if success else "failed"
-                                 report_fix_action(alert['id'], decision['action'], status_code, output or decision['analysis'])
-                                 
-                                 if success:
-                                     logger.info(f"Fix executed. Marking alert resolved.")
-                                     update_alert_status(alert['id'], "auto_fixed", resolution_summary=decision['analysis'])
-                                 
-                             elif decision['action'] == 'ESCALATE':
-                                 logger.info("AI decided to escalate to human.")
-                                 report_fix_action(alert['id'], "ESCALATE", "pending", decision['analysis'])
-                                 
-                             else:
-                                 logger.info("AI suggested no action or ignore.")
-                                 report_fix_action(alert['id'], "IGNORE", "skipped", decision['analysis'])
                          else:
-                             logger.warning("AI failed to decide. Falling back to Classic rules.")
+                             logger.info("AI suggested no action or ignore.")
+                             report_fix_action(alert['id'], "IGNORE", "skipped", decision['analysis'])
+                     else:
+                         logger.warning("AI failed to decide. Falling back to Classic rules.")
+                         handled.pop(incident['id'], None)
                              
         except Exception as e:
             logger.exception(f"AI Agent loop error: {e}")
@@ -31,117 +31,67 @@ if not API_KEY:
 def get_headers():
     return {"X-API-Key": API_KEY}
 
-# Mocked analysis
 def analyze_metrics():
-    # In real world: Query TimescaleDB for last 1 min metrics
-    # Here: We will just alert on random devices if we assume we have access to them?
-    # Better: The API should expose "devices with issues".
-    # For MVP: I will just Create Alerts for devices that I know exist.
-    
+    # Rules are evaluated inside the backend: one request checks every rule
+    # against the latest metrics of the whole fleet and opens/resolves alerts.
     try:
-        # Get devices with retry
-        try:
-            resp = requests.get(
-                f"{API_URL}/inventory/devices",
-                headers=get_headers(),
-                timeout=10
+        resp = requests.post(
+            f"{API_URL}/monitoring/rules/evaluate",
+            headers=get_headers(),
+            timeout=30
+        )
+        resp.raise_for_status()
+        result = resp.json()
+        if result.get('opened') or result.get('resolved'):
+            logger.warning(
+                f"Rule evaluation: {result['opened']} alerts opened, "
+                f"{result['resolved']} resolved ({result['evaluated']} checks)"
             )
-            resp.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Failed to fetch devices: {e}")
-            return
-        devices = resp.json()
-        
-        for device in devices:
-            # Query latest status metric
-            try:
-                m_resp = requests.get(
-                    f"{API_URL}/monitoring/metrics/latest?device_id={device['id']}&metric_type=uptime_status&limit=1",
-                    headers=get_headers(),
-                    timeout=10
-                )
-                if m_resp.status_code == 200:
-                    metrics = m_resp.json()
-                    if metrics and len(metrics) > 0:
-                        latest_status = metrics[0]['value']
-                        
-                        # Check if offline
-                        if latest_status == 0.0:
-                             # CHECK IF ALERT ALREADY EXISTS
-                             existing = requests.get(
-                                 f"{API_URL}/monitoring/alerts?device_id={device['id']}",
-                                 headers=get_headers(),
-                                 timeout=10
-                             )
-                             already_alerted = False
-                             if existing.status_code == 200:
-                                 for a in existing.json():
-                                     if a['rule_name'] == 'Device Offline' and a['status'] == 'open':
-                                         already_alerted = True
-                                         break
-                             
-                             if not already_alerted:
-                                 alert_payload = {
-                                     "device_id": device['id'],
-                                     "rule_name": "Device Offline",
-                                     "severity": "critical",
-                                     "message": f"Device {device['name']} is not responding to ping.",
-                                     "status": "open"
-                                 }
-                                 requests.post(
-                                     f"{API_URL}/monitoring/alerts",
-                                     json=alert_payload,
-                                     headers=get_headers(),
-                                     timeout=10
-                                 )
-                                 logger.warning(f"Created alert (OFFLINE) for {device['name']}")
-                             
-            except Exception as e_status:
-                 logger.error(f"Status check failed: {e_status}")
-
-            # CPU Check
-            try:
-                c_resp = requests.get(
-                    f"{API_URL}/monitoring/metrics/latest?device_id={device['id']}&metric_type=cpu_usage&limit=1",
-                    headers=get_headers(),
-                    timeout=10
-                )
-                if c_resp.status_code == 200:
-                    metrics = c_resp.json()
-                    if metrics and len(metrics) > 0:
-                        cpu = metrics[0]['value']
-                        if cpu > 80:
-                             # CHECK IF ALERT ALREADY EXISTS
-                             existing = requests.get(
-                                 f"{API_URL}/monitoring/alerts?device_id={device['id']}",
-                                 headers=get_headers(),
-                                 timeout=10
-                             )
-                             already_alerted = False
-                             if existing.status_code == 200:
-                                 for a in existing.json():
-                                     if a['rule_name'] == 'High CPU' and a['status'] == 'open':
-                                         already_alerted = True
-                                         break
-                             
-                             if not already_alerted:
-                                 alert_payload = {
-                                     "device_id": device['id'],
-                                     "rule_name": "High CPU",
-                                     "severity": "critical",
-                                     "message": f"High CPU usage detected: {cpu}%",
-                                     "status": "open"
-                                 }
-                                 requests.post(f"{API_URL}/monitoring/alerts", json=alert_payload, headers=get_headers())
-                                 logger.warning(f"Created alert (HIGH CPU) for {device['name']}")
-            except Exception as e_cpu:
-                 logger.error(f"CPU check failed: {e_cpu}")
-            except Exception as e_inner:
-                logger.error(f"Error checking device {device['name']}: {e_inner}")
-                  
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Rule evaluation request failed: {e}")
     except Exception as e:
         logger.exception(f"Diagnoser error: {e}")
 
+def detect_anomalies():
+    # Statistical baselines are scored fleet-wide inside the backend in one pass
+    try:
+        resp = requests.post(
+            f"{API_URL}/monitoring/anomalies/evaluate",
+            headers=get_headers(),
+            timeout=30
+        )
+        resp.raise_for_status()
+        result = resp.json()
+        if result.get('opened') or result.get('resolved'):
+            logger.warning(
+                f"Anomaly detection: {result['opened']} alerts opened, "
+                f"{result['resolved']} resolved ({result['series']} series in {result['elapsed_ms']}ms)"
+            )
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Anomaly detection request failed: {e}")
+    except Exception as e:
+        logger.exception(f"Anomaly detection error: {e}")
+
+def correlate_incidents():
+    # Collapse alert storms: group open alerts into one incident per site
+    try:
+        resp = requests.post(
+            f"{API_URL}/monitoring/incidents/correlate",
+            headers=get_headers(),
+            timeout=30
+        )
+        resp.raise_for_status()
+        result = resp.json()
+        if result.get('created') or result.get('resolved'):
+            logger.warning(
+                f"Correlation: {result['correlated']} alerts, {result['created']} incidents opened, "
+                f"{result['updated']} updated, {result['resolved']} resolved"
+            )
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Incident correlation request failed: {e}")
+    except Exception as e:
+        logger.exception(f"Incident correlation error: {e}")
+
 def run_agent():
     logger.info("Starting Diagnoser Agent...")
     # Login removed
@@ -149,6 +99,8 @@ def run_agent():
         
     while True:
         analyze_metrics()
+        detect_anomalies()
+        correlate_incidents()
         logger.info("Diagnosis cycle complete.")
         time.sleep(5)
 
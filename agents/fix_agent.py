@@ -5,6 +5,7 @@ import paramiko
 import logging
 import sys
 from datetime import datetime, timezone
+from retry_utils import get_all
 
 # Configure logging
 logging.basicConfig(
@@ -66,20 +67,17 @@ def run_agent():
     
     while True:
         try:
-             # fetch open alerts
-             resp = requests.get(
-                 f"{API_URL}/monitoring/alerts",
-                 headers=get_headers(),
-                 timeout=10
-             )
-             if resp.status_code == 200:
-                 alerts = resp.json()
-                 for alert in alerts:
-                     if alert['status'] == 'open' and alert['severity'] == 'critical':
+             # Alerts are correlated into incidents; handle each outage once via its root-cause alert
+             incidents = get_all(f"{API_URL}/monitoring/incidents", {"status": "open", "severity": "critical", "limit": 200}, get_headers())
+             if incidents is not None:
+                 for incident in incidents:
+                     alerts = get_all(f"{API_URL}/monitoring/alerts", {"incident_id": incident['id'], "limit": 500}, get_headers()) or []
+                     alert = next((a for a in alerts if a['id'] == incident['alert_id']), None)
+                     if alert and alert['status'] == 'open' and alert['severity'] == 'critical':
                          
                          # Check if it's "High CPU"
                          if "High CPU" in alert['message']:
-                             logger.info(f"Processing High CPU Alert {alert['id']}...")
+                             logger.info(f"Processing High CPU Incident {incident['id']} (root alert {alert['id']})...")
                              
                              # Fetch device info to get IP
                              dev_resp = requests.get(
@@ -102,17 +100,17 @@ def run_agent():
                                      logger.info("Simulating remediation: Restarting high load process...")
                                      time.sleep(2) # Simulate work
                                      
-                                     # Resolve Alert
+                                     # Resolve the incident and every alert it groups
                                      try:
                                          requests.patch(
-                                             f"{API_URL}/monitoring/alerts/{alert['id']}",
-                                             json={"status": "resolved", "resolution_summary": "Auto-fixed by Classic Agent (Uptime Check Passed)"},
+                                             f"{API_URL}/monitoring/incidents/{incident['id']}",
+                                             json={"status": "resolved", "alert_status": "resolved", "resolution_summary": "Auto-fixed by Classic Agent (Uptime Check Passed)"},
                                              headers=get_headers(),
                                              timeout=10
                                          )
-                                         logger.info(f"ALERT FIXED: {alert['message']}")
+                                         logger.info(f"INCIDENT FIXED: {alert['message']}")
                                      except Exception as ex:
-                                         logger.error(f"Failed to update alert status: {ex}")
+                                         logger.error(f"Failed to update incident status: {ex}")
                                  else:
                                      logger.error("Failed to connect via SSH. Cannot fix.")
                              else:
@@ -1,8 +1,10 @@
 """
-Retry utilities for agent API calls with exponential backoff.
+Shared helpers for agent API calls: retries with exponential backoff and
+cursor-paginated list fetches.
 """
 import time
 import logging
+import requests
 from functools import wraps
 from typing import Callable, Any
 
@@ -39,3 +41,17 @@ def retry_with_backoff(max_retries: int = 3, initial_delay: float = 1.0, backoff
             raise last_exception
         return wrapper
     return decorator
+
+def get_all(url: str, params: dict, headers: dict, timeout: float = 10):
+    """GET every page of a list endpoint by following X-Next-Cursor. Returns None if a page fails."""
+    params = dict(params)
+    items = []
+    while True:
+        resp = requests.get(url, params=params, headers=headers, timeout=timeout)
+        if resp.status_code != 200:
+            logger.error(f"GET {url} failed: {resp.status_code} {resp.text}")
+            return None
+        items.extend(resp.json())
+        params["cursor"] = resp.headers.get("X-Next-Cursor")
+        if not params["cursor"]:
+            return items
@@ -0,0 +1,62 @@
+"""Add indexes for server-side alert filtering and keyset pagination
+
+Revision ID: 0006_alert_filter_indexes
+Revises: b10bed5a6f5d
+Create Date: 2026-10-19 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006_alert_filter_indexes'
+down_revision: Union[str, None] = 'b10bed5a6f5d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keyset pagination walks (created_at DESC, id DESC)
+    op.create_index(
+        'idx_alerts_created_id',
+        'alerts',
+        ['created_at', 'id'],
+        unique=False,
+        if_not_exists=True
+    )
+
+    # Status filter (e.g. status=open) ordered by recency
+    op.create_index(
+        'idx_alerts_status_created',
+        'alerts',
+        ['status', 'created_at', 'id'],
+        unique=False,
+        if_not_exists=True
+    )
+
+    # Severity and rule_name filters
+    op.create_index(
+        'idx_alerts_severity_created',
+        'alerts',
+        ['severity', 'created_at'],
+        unique=False,
+        if_not_exists=True
+    )
+    op.create_index(
+        'idx_alerts_rule_created',
+        'alerts',
+        ['rule_name', 'created_at'],
+        unique=False,
+        if_not_exists=True
+    )
+    # device_id filters use idx_alerts_device_status from 0003_add_indexes
+
+
+def downgrade() -> None:
+    op.drop_index('idx_alerts_rule_created', table_name='alerts', if_exists=True)
+    op.drop_index('idx_alerts_severity_created', table_name='alerts', if_exists=True)
+    op.drop_index('idx_alerts_status_created', table_name='alerts', if_exists=True)
+    op.drop_index('idx_alerts_created_id', table_name='alerts', if_exists=True)
@@ -0,0 +1,55 @@
+"""Alert occurrence tracking and open-alert uniqueness
+
+Revision ID: 0007_alert_upsert
+Revises: 0006_alert_filter_indexes
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007_alert_upsert'
+down_revision: Union[str, None] = '0006_alert_filter_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('alerts', sa.Column('occurrence_count', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('alerts', sa.Column('last_seen_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE alerts SET last_seen_at = created_at WHERE last_seen_at IS NULL")
+
+    # Collapse existing duplicate active (open or acknowledged) alerts: keep the newest per (device, rule)
+    # and archive the rest, otherwise the unique index below cannot be built.
+    op.execute("""
+        UPDATE alerts SET status = 'archived'
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY device_id, rule_name
+                    ORDER BY created_at DESC, id DESC
+                ) AS rn
+                FROM alerts
+                WHERE status IN ('open', 'acknowledged')
+            ) ranked
+            WHERE ranked.rn > 1
+        )
+    """)
+
+    op.create_index(
+        'uq_alerts_open_device_rule',
+        'alerts',
+        ['device_id', 'rule_name'],
+        unique=True,
+        postgresql_where=sa.text("status IN ('open', 'acknowledged')")
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('uq_alerts_open_device_rule', table_name='alerts')
+    op.drop_column('alerts', 'last_seen_at')
+    op.drop_column('alerts', 'occurrence_count')
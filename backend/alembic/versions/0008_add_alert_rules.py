@@ -0,0 +1,58 @@
+"""Add alert_rules table for in-database threshold evaluation
+
+Revision ID: 0008_add_alert_rules
+Revises: 0007_alert_upsert
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+import uuid
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = '0008_add_alert_rules'
+down_revision: Union[str, None] = '0007_alert_upsert'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    alert_rules = op.create_table('alert_rules',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('organization_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('metric_type', sa.String(), nullable=False),
+        sa.Column('operator', sa.String(), nullable=False),
+        sa.Column('threshold', sa.Float(), nullable=False),
+        sa.Column('duration_seconds', sa.Integer(), nullable=True),
+        sa.Column('severity', sa.String(), nullable=True),
+        sa.Column('is_enabled', sa.Boolean(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_alert_rules_organization_id'), 'alert_rules', ['organization_id'], unique=False)
+
+    # Global defaults matching the checks the diagnoser agent used to hardcode
+    now = datetime.utcnow()
+    op.bulk_insert(alert_rules, [
+        {
+            'id': uuid.uuid4(), 'organization_id': None, 'name': 'Device Offline',
+            'metric_type': 'status', 'operator': '<', 'threshold': 1.0,
+            'duration_seconds': 0, 'severity': 'critical', 'is_enabled': True, 'created_at': now,
+        },
+        {
+            'id': uuid.uuid4(), 'organization_id': None, 'name': 'High CPU',
+            'metric_type': 'cpu_usage', 'operator': '>', 'threshold': 80.0,
+            'duration_seconds': 0, 'severity': 'critical', 'is_enabled': True, 'created_at': now,
+        },
+    ])
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_alert_rules_organization_id'), table_name='alert_rules')
+    op.drop_table('alert_rules')
@@ -0,0 +1,30 @@
+"""Add streaming evaluation settings to alert_rules
+
+Revision ID: 0009_alert_rule_streaming
+Revises: 0008_add_alert_rules
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009_alert_rule_streaming'
+down_revision: Union[str, None] = '0008_add_alert_rules'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('alert_rules', sa.Column('consecutive_samples', sa.Integer(), server_default='1', nullable=True))
+    op.add_column('alert_rules', sa.Column('hysteresis', sa.Float(), server_default='0', nullable=True))
+    op.add_column('alert_rules', sa.Column('ewma_alpha', sa.Float(), server_default='1', nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('alert_rules', 'ewma_alpha')
+    op.drop_column('alert_rules', 'hysteresis')
+    op.drop_column('alert_rules', 'consecutive_samples')
@@ -0,0 +1,26 @@
+"""Add confidence score to alerts
+
+Revision ID: 0010_alert_confidence
+Revises: 0009_alert_rule_streaming
+Create Date: 2026-10-19 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010_alert_confidence'
+down_revision: Union[str, None] = '0009_alert_rule_streaming'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('alerts', sa.Column('confidence', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('alerts', 'confidence')
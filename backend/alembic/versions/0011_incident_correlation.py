@@ -0,0 +1,64 @@
+"""Correlate alerts into site-level incidents
+
+Revision ID: 0011_incident_correlation
+Revises: 0010_alert_confidence
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0011_incident_correlation'
+down_revision: Union[str, None] = '0010_alert_confidence'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('incidents', sa.Column('site_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.add_column('incidents', sa.Column('status', sa.String(), server_default='open', nullable=True))
+    op.add_column('incidents', sa.Column('severity', sa.String(), server_default='warning', nullable=True))
+    op.add_column('incidents', sa.Column('alert_count', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('incidents', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.add_column('incidents', sa.Column('resolved_at', sa.DateTime(), nullable=True))
+    op.create_foreign_key('fk_incidents_site_id', 'incidents', 'sites', ['site_id'], ['id'])
+    op.create_index('ix_incidents_site_id', 'incidents', ['site_id'])
+
+    op.add_column('alerts', sa.Column('incident_id', postgresql.UUID(as_uuid=True), nullable=True))
+    op.create_foreign_key('fk_alerts_incident_id', 'alerts', 'incidents', ['incident_id'], ['id'])
+    op.create_index('ix_alerts_incident_id', 'alerts', ['incident_id'])
+
+    # Existing incidents wrap exactly one alert: copy site, severity and status from it
+    op.execute("""
+        UPDATE incidents i
+        SET site_id = d.site_id,
+            severity = a.severity,
+            status = CASE WHEN a.status IN ('open', 'acknowledged') THEN 'open' ELSE 'resolved' END,
+            resolved_at = CASE WHEN a.status IN ('open', 'acknowledged') THEN NULL ELSE a.resolved_at END,
+            updated_at = i.created_at
+        FROM alerts a JOIN devices d ON d.id = a.device_id
+        WHERE a.id = i.alert_id
+    """)
+    op.execute("""
+        UPDATE alerts a SET incident_id = i.id
+        FROM incidents i WHERE i.alert_id = a.id
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_alerts_incident_id', table_name='alerts')
+    op.drop_constraint('fk_alerts_incident_id', 'alerts', type_='foreignkey')
+    op.drop_column('alerts', 'incident_id')
+    op.drop_index('ix_incidents_site_id', table_name='incidents')
+    op.drop_constraint('fk_incidents_site_id', 'incidents', type_='foreignkey')
+    op.drop_column('incidents', 'resolved_at')
+    op.drop_column('incidents', 'updated_at')
+    op.drop_column('incidents', 'alert_count')
+    op.drop_column('incidents', 'severity')
+    op.drop_column('incidents', 'status')
+    op.drop_column('incidents', 'site_id')
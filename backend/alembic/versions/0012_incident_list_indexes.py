@@ -0,0 +1,53 @@
+"""Add indexes for incident filtering and keyset pagination
+
+Revision ID: 0012_incident_list_indexes
+Revises: 0011_incident_correlation
+Create Date: 2026-10-19 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0012_incident_list_indexes'
+down_revision: Union[str, None] = '0011_incident_correlation'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keyset pagination walks (created_at DESC, id DESC)
+    op.create_index(
+        'idx_incidents_created_id',
+        'incidents',
+        ['created_at', 'id'],
+        unique=False,
+        if_not_exists=True
+    )
+
+    # Status filter (e.g. status=open) ordered by recency
+    op.create_index(
+        'idx_incidents_status_created',
+        'incidents',
+        ['status', 'created_at', 'id'],
+        unique=False,
+        if_not_exists=True
+    )
+
+    # Severity filter
+    op.create_index(
+        'idx_incidents_severity_created',
+        'incidents',
+        ['severity', 'created_at'],
+        unique=False,
+        if_not_exists=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('idx_incidents_severity_created', table_name='incidents', if_exists=True)
+    op.drop_index('idx_incidents_status_created', table_name='incidents', if_exists=True)
+    op.drop_index('idx_incidents_created_id', table_name='incidents', if_exists=True)
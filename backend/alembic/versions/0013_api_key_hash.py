@@ -0,0 +1,47 @@
+"""Look up API keys by hash
+
+Revision ID: 0013_api_key_hash
+Revises: 0012_incident_list_indexes
+Create Date: 2026-10-19 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0013_api_key_hash'
+down_revision: Union[str, None] = '0012_incident_list_indexes'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('api_keys', sa.Column('key_hash', sa.String(length=64), nullable=True))
+    op.add_column('api_keys', sa.Column('key_prefix', sa.String(length=16), nullable=True))
+
+    # Keys no longer store the plaintext
+    op.alter_column('api_keys', 'key', existing_type=sa.String(), nullable=True)
+
+    # Existing keys keep working: hash them in place (matches hashlib.sha256 of the UTF-8 key)
+    # and drop the plaintext
+    op.execute("""
+        UPDATE api_keys
+        SET key_hash = encode(sha256(convert_to(key, 'UTF8')), 'hex'),
+            key_prefix = left(key, 10),
+            key = NULL
+        WHERE key IS NOT NULL
+    """)
+
+    op.create_index('ix_api_keys_key_hash', 'api_keys', ['key_hash'], unique=True)
+
+
+def downgrade() -> None:
+    # Only hashes are stored, so no key can be restored
+    op.execute("DELETE FROM api_keys WHERE key IS NULL")
+    op.alter_column('api_keys', 'key', existing_type=sa.String(), nullable=False)
+    op.drop_index('ix_api_keys_key_hash', table_name='api_keys')
+    op.drop_column('api_keys', 'key_prefix')
+    op.drop_column('api_keys', 'key_hash')
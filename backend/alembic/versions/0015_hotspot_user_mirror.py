@@ -0,0 +1,63 @@
+"""Mirror hotspot users locally
+
+Revision ID: 0015_hotspot_user_mirror
+Revises: 0014_user_token_version
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0015_hotspot_user_mirror'
+down_revision: Union[str, None] = '0014_user_token_version'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'hotspot_users',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('device_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('router_id', sa.String(), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('password', sa.String(), nullable=True),
+        sa.Column('profile', sa.String(), nullable=True),
+        sa.Column('uptime', sa.String(), nullable=True),
+        sa.Column('uptime_sec', sa.Integer(), nullable=True),
+        sa.Column('bytes_in', sa.BigInteger(), nullable=True),
+        sa.Column('bytes_out', sa.BigInteger(), nullable=True),
+        sa.Column('limit_uptime', sa.String(), nullable=True),
+        sa.Column('limit_bytes_total', sa.BigInteger(), nullable=True),
+        sa.Column('comment', sa.String(), nullable=True),
+        sa.Column('disabled', sa.Boolean(), nullable=True),
+        sa.Column('row_hash', sa.String(length=32), nullable=True),
+        sa.Column('synced_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('device_id', 'router_id', name='uq_hotspot_users_device_router'),
+    )
+    op.create_index('ix_hotspot_users_device_name', 'hotspot_users', ['device_id', 'name'])
+
+    op.create_table(
+        'hotspot_sync_state',
+        sa.Column('device_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('resource', sa.String(), nullable=False),
+        sa.Column('last_synced_at', sa.DateTime(), nullable=True),
+        sa.Column('last_attempt_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.String(), nullable=True),
+        sa.Column('row_count', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('device_id', 'resource'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('hotspot_sync_state')
+    op.drop_index('ix_hotspot_users_device_name', table_name='hotspot_users')
+    op.drop_table('hotspot_users')
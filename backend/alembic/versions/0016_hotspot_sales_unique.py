@@ -0,0 +1,36 @@
+"""Deduplicate hotspot sales and make (device_id, username) unique
+
+Revision ID: 0016_hotspot_sales_unique
+Revises: 0015_hotspot_user_mirror
+Create Date: 2026-10-19 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0016_hotspot_sales_unique'
+down_revision: Union[str, None] = '0015_hotspot_user_mirror'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Concurrent syncs could record a voucher twice; keep the earliest sale
+    op.execute("""
+        DELETE FROM hotspot_sales a
+        USING hotspot_sales b
+        WHERE a.device_id = b.device_id
+          AND a.username = b.username
+          AND (COALESCE(a.created_at, 'infinity'), a.id) > (COALESCE(b.created_at, 'infinity'), b.id)
+    """)
+    op.create_index('uq_hotspot_sales_device_username', 'hotspot_sales', ['device_id', 'username'], unique=True)
+    op.add_column('hotspot_sync_state', sa.Column('watermark', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('hotspot_sync_state', 'watermark')
+    op.drop_index('uq_hotspot_sales_device_username', table_name='hotspot_sales')
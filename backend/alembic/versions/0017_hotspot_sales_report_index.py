@@ -0,0 +1,26 @@
+"""Index hotspot sales for per-device report ranges
+
+Revision ID: 0017_hotspot_sales_report_index
+Revises: 0016_hotspot_sales_unique
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0017_hotspot_sales_report_index'
+down_revision: Union[str, None] = '0016_hotspot_sales_unique'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Serves the date-range aggregates and the (created_at, id) keyset pages of a device
+    op.create_index('ix_hotspot_sales_device_created', 'hotspot_sales', ['device_id', 'created_at', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_hotspot_sales_device_created', table_name='hotspot_sales')
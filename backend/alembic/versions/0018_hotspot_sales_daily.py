@@ -0,0 +1,52 @@
+"""Add hotspot_sales_daily rollup and backfill it
+
+Revision ID: 0018_hotspot_sales_daily
+Revises: 0017_hotspot_sales_report_index
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0018_hotspot_sales_daily'
+down_revision: Union[str, None] = '0017_hotspot_sales_report_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'hotspot_sales_daily',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('device_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('site_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('profile', sa.String(), nullable=False),
+        sa.Column('currency', sa.String(), nullable=False),
+        sa.Column('sale_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('revenue', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['site_id'], ['sites.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('day', 'device_id', 'site_id', 'profile', 'currency'),
+    )
+    op.create_index('ix_hotspot_sales_daily_site_day', 'hotspot_sales_daily', ['site_id', 'day'])
+    op.create_index('ix_hotspot_sales_daily_device_day', 'hotspot_sales_daily', ['device_id', 'day'])
+
+    # Backfill from existing sales; the app keeps it current from here on
+    op.execute("""
+        INSERT INTO hotspot_sales_daily (day, device_id, site_id, profile, currency, sale_count, revenue)
+        SELECT created_at::date, device_id, site_id, profile, COALESCE(currency, 'TZS'), count(*), COALESCE(sum(price), 0)
+        FROM hotspot_sales
+        WHERE created_at IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_hotspot_sales_daily_device_day', table_name='hotspot_sales_daily')
+    op.drop_index('ix_hotspot_sales_daily_site_day', table_name='hotspot_sales_daily')
+    op.drop_table('hotspot_sales_daily')
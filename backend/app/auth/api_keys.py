@@ -0,0 +1,107 @@
+"""
+API key resolution for agent traffic.
+
+Keys are looked up by their SHA-256 hash and cached per process for
+API_KEY_CACHE_TTL_SECONDS, so agent requests normally skip the database.
+Revoking a key invalidates it in every worker via Redis. last_used_at is
+buffered in memory and written back in one statement every
+API_KEY_USAGE_FLUSH_SECONDS instead of committing on each request.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+from uuid import UUID
+from sqlalchemy import select, update, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.cache import TTLCache, register_cache
+from app.core.config import settings
+from app.core.metrics import timed_job, API_KEY_USAGE_PENDING
+from app.core.database import AsyncSessionLocal
+from app.auth.security import hash_api_key
+from app.models import APIKey
+
+logger = logging.getLogger(__name__)
+
+API_KEY_CACHE = "api_keys"
+_key_cache = register_cache(API_KEY_CACHE, TTLCache(settings.API_KEY_CACHE_TTL_SECONDS))
+
+async def resolve_api_key(db: AsyncSession, raw_key: str) -> Optional[APIKey]:
+    """
+    Return the active key matching raw_key, or None.
+
+    The result is a transient APIKey (not attached to the session) built from
+    the cached columns; callers only read it.
+    """
+    key_hash = hash_api_key(raw_key)
+    snapshot = _key_cache.get(key_hash)
+    if snapshot is None:
+        result = await db.execute(
+            select(APIKey.id, APIKey.organization_id, APIKey.description, APIKey.key_prefix, APIKey.created_at)
+            .where(APIKey.key_hash == key_hash, APIKey.is_active == True)
+        )
+        row = result.first()
+        if row is None:
+            return None
+        snapshot = dict(row._mapping)
+        _key_cache.set(key_hash, snapshot)
+
+    usage_buffer.record(snapshot["id"])
+    return APIKey(**snapshot, key_hash=key_hash, is_active=True)
+
+class UsageBuffer:
+    """Write-behind buffer for APIKey.last_used_at."""
+
+    def __init__(self):
+        self._pending: Dict[UUID, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, key_id: UUID) -> None:
+        self._pending[key_id] = datetime.utcnow()
+        API_KEY_USAGE_PENDING.set(len(self._pending))
+
+    @timed_job("api_key_usage_flush")
+    async def flush(self) -> int:
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        API_KEY_USAGE_PENDING.set(0)
+        table = APIKey.__table__
+        stmt = (
+            update(table)
+            .where(table.c.id == bindparam("key_id"))
+            .values(last_used_at=bindparam("used_at"))
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(stmt, [{"key_id": k, "used_at": v} for k, v in batch.items()])
+                await db.commit()
+        except Exception as e:
+            # Keep the newest timestamps for the next attempt
+            for key_id, used_at in batch.items():
+                if used_at > self._pending.get(key_id, datetime.min):
+                    self._pending[key_id] = used_at
+            API_KEY_USAGE_PENDING.set(len(self._pending))
+            logger.warning(f"Failed to flush API key usage: {e}")
+            return 0
+        return len(batch)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.API_KEY_USAGE_FLUSH_SECONDS)
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+usage_buffer = UsageBuffer()
@@ -1,5 +1,5 @@
 from typing import Generator, Optional, Union
-from fastapi import Depends, HTTPException, status, Header, Security
+from fastapi import Depends, HTTPException, Request, status, Header, Security
 from fastapi.security import OAuth2PasswordBearer, APIKeyHeader
 from jose import jwt, JWTError
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -8,6 +8,9 @@ from app.auth.security import settings
 from app.models import User, APIKey
 from sqlalchemy import select
 from app.models.core import UserRole
+from app.auth.api_keys import resolve_api_key
+from app.auth.token_versions import current_token_version, token_state
+from uuid import UUID
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_PREFIX}/auth/login", auto_error=False)
 
@@ -34,11 +37,15 @@ async def get_current_user(
     user = result.scalars().first()
     if user is None:
         raise credentials_exception
+    if "ver" in payload and payload["ver"] != token_state(user):
+        # Revoked by a role change, deactivation or password reset
+        raise credentials_exception
     return user
 
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 async def get_api_key(
+    request: Request,
     api_key_header: str = Security(api_key_header),
     db: AsyncSession = Depends(get_db)
 ) -> APIKey:
@@ -48,36 +55,29 @@ async def get_api_key(
             detail="Missing API Key",
         )
     
-    result = await db.execute(select(APIKey).where(APIKey.key == api_key_header, APIKey.is_active == True))
-    api_key = result.scalars().first()
+    api_key = await resolve_api_key(db, api_key_header)
     
     if not api_key:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid API Key",
         )
-        
-    # Update last_used_at
-    from datetime import datetime
-    api_key.last_used_at = datetime.utcnow()
-    await db.commit()
     
+    request.state.rate_limit_key = f"key:{api_key.id}"
     return api_key
 
 async def get_authorized_actor(
+    request: Request,
     api_key_header: Optional[str] = Security(api_key_header),
     token: Optional[str] = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_db)
 ) -> Union[User, APIKey]:
     # 1. Try API Key
     if api_key_header:
-        result = await db.execute(select(APIKey).where(APIKey.key == api_key_header, APIKey.is_active == True))
-        api_key = result.scalars().first()
+        # Cached by key hash; last_used_at is written back in batches
+        api_key = await resolve_api_key(db, api_key_header)
         if api_key:
-            # Update last_used_at
-            from datetime import datetime
-            api_key.last_used_at = datetime.utcnow()
-            await db.commit()
+            request.state.rate_limit_key = f"key:{api_key.id}"
             return api_key
     
     # 2. Try User Token
@@ -85,12 +85,25 @@ async def get_authorized_actor(
         try:
             payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
             user_id: str = payload.get("sub")
-            if user_id:
+            if user_id and "ver" in payload:
+                # Authorize from the token's claims; only the token version is checked
+                if payload["ver"] == await current_token_version(db, user_id):
+                    request.state.rate_limit_key = f"user:{user_id}"
+                    org_id = payload.get("org_id")
+                    return User(
+                        id=UUID(user_id),
+                        role=payload.get("role"),
+                        organization_id=UUID(org_id) if org_id else None,
+                        is_active=True,
+                    )
+            elif user_id:
+                # Tokens issued before claims were added
                 result = await db.execute(select(User).where(User.id == user_id))
                 user = result.scalars().first()
                 if user and user.is_active:
+                    request.state.rate_limit_key = f"user:{user_id}"
                     return user
-        except JWTError:
+        except (JWTError, ValueError):
             pass
             
     # 3. Fail
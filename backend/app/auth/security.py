@@ -2,6 +2,7 @@ from datetime import datetime, timedelta
 from typing import Optional, Any, Union
 from jose import jwt
 import bcrypt
+import hashlib
 from app.core.config import settings
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -10,12 +11,27 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
-def create_access_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None) -> str:
+def hash_api_key(api_key: str) -> str:
+    # Keys are long random tokens, so an unsalted fast hash is enough for lookups
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+def create_access_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None, claims: Optional[dict] = None) -> str:
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode = {"exp": expire, "sub": str(subject)}
+    to_encode = {**(claims or {}), "exp": expire, "sub": str(subject)}
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
+
+def create_user_access_token(user) -> str:
+    """Token carrying the claims needed to authorize requests without a user lookup."""
+    return create_access_token(
+        subject=user.id,
+        claims={
+            "role": user.role,
+            "org_id": str(user.organization_id) if user.organization_id else None,
+            "ver": user.token_version or 0,
+        },
+    )
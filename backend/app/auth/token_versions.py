@@ -0,0 +1,69 @@
+"""
+Per-user token versions for stateless JWT revocation.
+
+Access tokens carry the user's role, org_id and token version ("ver"), so
+requests can be authorized from the token alone. Deactivating a user,
+changing their role or resetting their password bumps users.token_version;
+the current version is mirrored into a Redis hash and cached per process for
+a few seconds, so older tokens stop working almost immediately. When Redis is
+unavailable the version is read from the database instead.
+"""
+import logging
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.cache import TTLCache, register_cache, invalidate
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.models import User
+
+logger = logging.getLogger(__name__)
+
+TOKEN_VERSIONS_KEY = "auth:token_versions"
+TOKEN_VERSION_CACHE = "token_versions"
+# Stored for deleted or deactivated users; never matches a token's ver claim
+REVOKED = -1
+
+_version_cache = register_cache(TOKEN_VERSION_CACHE, TTLCache(settings.TOKEN_VERSION_CACHE_TTL_SECONDS))
+
+def token_state(user: User) -> int:
+    """The version tokens for this user must carry to be accepted."""
+    return (user.token_version or 0) if user.is_active else REVOKED
+
+async def current_token_version(db: AsyncSession, user_id: str) -> int:
+    """Current accepted token version: local cache, then Redis, then the database."""
+    version = _version_cache.get(user_id)
+    if version is not None:
+        return version
+
+    try:
+        raw = await get_redis().hget(TOKEN_VERSIONS_KEY, user_id)
+        version = int(raw) if raw is not None else None
+    except Exception as e:
+        logger.debug(f"Token version lookup in Redis failed: {e}")
+
+    if version is None:
+        result = await db.execute(select(User.token_version, User.is_active).where(User.id == user_id))
+        row = result.first()
+        version = REVOKED if row is None or not row.is_active else (row.token_version or 0)
+        try:
+            await get_redis().hset(TOKEN_VERSIONS_KEY, user_id, version)
+        except Exception as e:
+            logger.debug(f"Token version write to Redis failed: {e}")
+
+    _version_cache.set(user_id, version)
+    return version
+
+async def publish_token_version(user_id, version: int) -> None:
+    """Record a user's new token version after it has been committed."""
+    user_id = str(user_id)
+    try:
+        await get_redis().hset(TOKEN_VERSIONS_KEY, user_id, version)
+    except Exception as e:
+        # Workers fall back to the database once their few-second cache expires
+        logger.warning(f"Failed to publish token version for {user_id}: {e}")
+        try:
+            await get_redis().hdel(TOKEN_VERSIONS_KEY, user_id)
+        except Exception:
+            pass
+    await invalidate(TOKEN_VERSION_CACHE, user_id)
@@ -0,0 +1,123 @@
+"""
+In-process TTL caches with cross-worker invalidation.
+
+Hot lookups (API keys, devices, ...) are served from small per-process caches.
+Entries expire after a TTL, so staleness is bounded even if Redis is down;
+explicit invalidations are published on one Redis channel so every worker
+drops the entry within milliseconds of a revoke or update.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire ttl seconds after being set."""
+
+    def __init__(self, ttl: float, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+_caches: Dict[str, TTLCache] = {}
+
+def register_cache(name: str, cache: TTLCache) -> TTLCache:
+    """Make a cache addressable by invalidate() and the Redis listener."""
+    _caches[name] = cache
+    return cache
+
+def _apply_invalidation(name: str, key: Optional[str]) -> None:
+    cache = _caches.get(name)
+    if cache is None:
+        return
+    if key is None:
+        cache.clear()
+    else:
+        cache.pop(key)
+
+async def invalidate(name: str, key: Optional[str] = None) -> None:
+    """Drop a key (or the whole cache when key is None) here and in every other worker."""
+    _apply_invalidation(name, key)
+    try:
+        await get_redis().publish(INVALIDATION_CHANNEL, json.dumps({"cache": name, "key": key}))
+    except Exception as e:
+        logger.warning(f"Failed to publish cache invalidation for {name}: {e}")
+
+class InvalidationListener:
+    """Background task applying invalidations published by other workers."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            pubsub = None
+            try:
+                pubsub = get_redis().pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Invalidations may have been missed while disconnected
+                for cache in _caches.values():
+                    cache.clear()
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message:
+                        payload = json.loads(message["data"])
+                        _apply_invalidation(payload.get("cache"), payload.get("key"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Cache invalidation listener disconnected: {e}")
+                await asyncio.sleep(5)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+invalidation_listener = InvalidationListener()
@@ -20,6 +20,13 @@ class Settings(BaseSettings):
     @property
     def DATABASE_URL(self) -> str:
         return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+
+    # Connection pool per worker process; keep WEB_CONCURRENCY * (size + overflow) below max_connections
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "20"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+    # Migrations run in the prestart step; set for single-process setups that skip it
+    RUN_MIGRATIONS_ON_STARTUP: bool = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "false").lower() == "true"
         
     # Security - All from environment variables with safe defaults
     SECRET_KEY: str = os.getenv("SECRET_KEY", "supersecretkey")  # Backward compatible default
@@ -31,11 +38,82 @@ class Settings(BaseSettings):
     WG_SERVER_ENDPOINT: str = os.getenv("WG_SERVER_ENDPOINT", "74.208.167.166")
     WG_SERVER_PORT: int = int(os.getenv("WG_SERVER_PORT", "51820"))
     
+    # Redis (pub/sub events, shared caches)
+    REDIS_HOST: str = os.getenv("REDIS_HOST", "redis")
+    REDIS_PORT: int = int(os.getenv("REDIS_PORT", "6379"))
+    REDIS_DB: int = int(os.getenv("REDIS_DB", "0"))
+
+    @property
+    def REDIS_URL(self) -> str:
+        return f"redis://{self.REDIS_HOST}:{self.REDIS_PORT}/{self.REDIS_DB}"
+
+    # Alert rule evaluation
+    # Metrics older than this are treated as stale and neither fire nor clear alerts
+    RULE_EVAL_LOOKBACK_SECONDS: int = int(os.getenv("RULE_EVAL_LOOKBACK_SECONDS", "300"))
+    # Streaming evaluation on ingest: how often the rule cache reloads and how long idle rule state is kept in Redis
+    RULE_CACHE_TTL_SECONDS: int = int(os.getenv("RULE_CACHE_TTL_SECONDS", "30"))
+    RULE_STATE_TTL_SECONDS: int = int(os.getenv("RULE_STATE_TTL_SECONDS", "86400"))
+
+    # Anomaly detection: series scored, window/bucket sizes and detector thresholds
+    ANOMALY_METRIC_TYPES: str = os.getenv("ANOMALY_METRIC_TYPES", "cpu_usage,memory_usage,latency,connected_clients")
+    ANOMALY_WINDOW_SECONDS: int = int(os.getenv("ANOMALY_WINDOW_SECONDS", "3600"))
+    ANOMALY_BUCKET_SECONDS: int = int(os.getenv("ANOMALY_BUCKET_SECONDS", "60"))
+    ANOMALY_SEASON_DAYS: int = int(os.getenv("ANOMALY_SEASON_DAYS", "7"))
+    ANOMALY_MIN_POINTS: int = int(os.getenv("ANOMALY_MIN_POINTS", "10"))
+    ANOMALY_MIN_SEASONS: int = int(os.getenv("ANOMALY_MIN_SEASONS", "3"))
+    ANOMALY_Z_THRESHOLD: float = float(os.getenv("ANOMALY_Z_THRESHOLD", "3.0"))
+    ANOMALY_EWMA_ALPHA: float = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.3"))
+
+    @property
+    def ANOMALY_METRIC_TYPES_LIST(self) -> list:
+        return [m.strip() for m in self.ANOMALY_METRIC_TYPES.split(",") if m.strip()]
+
+    # Incident correlation: an open incident absorbs new alerts from its site while active within the window
+    CORRELATION_WINDOW_SECONDS: int = int(os.getenv("CORRELATION_WINDOW_SECONDS", "600"))
+    CORRELATION_OUTAGE_MIN_DEVICES: int = int(os.getenv("CORRELATION_OUTAGE_MIN_DEVICES", "2"))
+
+    # API key auth: cache lifetime and how often buffered last_used_at values are written back
+    API_KEY_CACHE_TTL_SECONDS: int = int(os.getenv("API_KEY_CACHE_TTL_SECONDS", "60"))
+    API_KEY_USAGE_FLUSH_SECONDS: int = int(os.getenv("API_KEY_USAGE_FLUSH_SECONDS", "60"))
+
+    # How long a worker trusts its cached copy of a user's token version
+    TOKEN_VERSION_CACHE_TTL_SECONDS: int = int(os.getenv("TOKEN_VERSION_CACHE_TTL_SECONDS", "5"))
+
+    # Rate limiting: shared Redis storage so limits hold across workers (moving-window runs as a Lua script)
+    RATE_LIMIT_STORAGE_URI: str = os.getenv("RATE_LIMIT_STORAGE_URI", "")
+    RATE_LIMIT_STRATEGY: str = os.getenv("RATE_LIMIT_STRATEGY", "moving-window")
+
+    # Responses at least this many bytes are brotli/gzip compressed when the client accepts it
+    COMPRESSION_MIN_SIZE: int = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+    # Connect and per-reply timeout for RouterOS API calls
+    ROUTEROS_TIMEOUT_SECONDS: float = float(os.getenv("ROUTEROS_TIMEOUT_SECONDS", "10"))
+    # Pooled RouterOS API sessions: concurrent sessions per router and idle lifetime
+    ROUTEROS_MAX_SESSIONS_PER_DEVICE: int = int(os.getenv("ROUTEROS_MAX_SESSIONS_PER_DEVICE", "2"))
+    ROUTEROS_SESSION_IDLE_SECONDS: float = float(os.getenv("ROUTEROS_SESSION_IDLE_SECONDS", "60"))
+    # Hotspot user mirror: background refresh interval, routers synced at once, and how long a router is refreshed after its users were last read
+    HOTSPOT_SYNC_INTERVAL_SECONDS: int = int(os.getenv("HOTSPOT_SYNC_INTERVAL_SECONDS", "60"))
+    HOTSPOT_SYNC_CONCURRENCY: int = int(os.getenv("HOTSPOT_SYNC_CONCURRENCY", "4"))
+    HOTSPOT_SYNC_IDLE_SECONDS: int = int(os.getenv("HOTSPOT_SYNC_IDLE_SECONDS", "1800"))
+    # Background sales sync: per-device interval and the random delay spreading runs across it
+    HOTSPOT_SALES_SYNC_INTERVAL_SECONDS: int = int(os.getenv("HOTSPOT_SALES_SYNC_INTERVAL_SECONDS", "120"))
+    HOTSPOT_SALES_SYNC_JITTER_SECONDS: int = int(os.getenv("HOTSPOT_SALES_SYNC_JITTER_SECONDS", "30"))
+    # Live active-session tracking: probe interval for quiet routers, and how long a router is followed after its last viewer
+    HOTSPOT_ACTIVE_KEEPALIVE_SECONDS: float = float(os.getenv("HOTSPOT_ACTIVE_KEEPALIVE_SECONDS", "15"))
+    HOTSPOT_ACTIVE_IDLE_SECONDS: int = int(os.getenv("HOTSPOT_ACTIVE_IDLE_SECONDS", "600"))
+
+    # Authorized devices (with decrypted credentials) are cached per tenant for this long
+    DEVICE_CACHE_TTL_SECONDS: int = int(os.getenv("DEVICE_CACHE_TTL_SECONDS", "30"))
+
     # CORS Configuration
     CORS_ORIGINS: str = os.getenv("CORS_ORIGINS", "https://app.netguard.fun,https://www.netguard.fun")
     
     # Encryption Key for database field encryption
     ENCRYPTION_KEY: str = os.getenv("ENCRYPTION_KEY", "")
+    # Retired keys (comma separated) still accepted for decryption until secrets are re-encrypted
+    ENCRYPTION_PREVIOUS_KEYS: str = os.getenv("ENCRYPTION_PREVIOUS_KEYS", "")
+    # Decrypted field values kept in memory, keyed by ciphertext digest
+    DECRYPT_CACHE_SIZE: int = int(os.getenv("DECRYPT_CACHE_SIZE", "4096"))
     
     @property
     def CORS_ORIGINS_LIST(self) -> list:
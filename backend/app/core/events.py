@@ -0,0 +1,19 @@
+"""
+Change events for live clients, published over Redis Pub/Sub.
+
+Events are fire-and-forget notifications ("something changed, refetch"), so a
+Redis outage must never fail the request that produced them.
+"""
+import json
+import logging
+from app.core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+ALERTS_CHANGED_CHANNEL = "alerts:changed"
+
+async def publish_event(channel: str, payload: dict) -> None:
+    try:
+        await get_redis().publish(channel, json.dumps(payload, default=str))
+    except Exception as e:
+        logger.warning(f"Failed to publish event on {channel}: {e}")
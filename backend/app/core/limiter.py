@@ -1,4 +1,35 @@
+"""
+Rate limiter shared by every worker.
+
+Counters live in Redis and use the moving-window strategy, which limits
+implements as atomic Lua scripts, so a limit is enforced once across all
+uvicorn workers rather than per process. Requests are keyed by the API key
+or user that get_authorized_actor resolved, so agents behind one NAT don't
+share a bucket. Anything unauthenticated (including /auth/login and requests
+carrying an invalid key or token) is keyed by client address, so a made-up
+credential can't buy a fresh bucket. If Redis is unreachable the limiter
+falls back to per-process memory until it recovers.
+
+slowapi checks limits through the synchronous redis-py client, so every
+rate-limited request spends one blocking Redis round trip on the event loop.
+That is normally well under a millisecond, but a stalled Redis would freeze
+the worker; the same 2s socket timeouts as app.core.redis bound the stall
+before the memory fallback takes over.
+"""
+from fastapi import Request
 from slowapi import Limiter
 from slowapi.util import get_remote_address
+from app.core.config import settings
+
+def rate_limit_key(request: Request) -> str:
+    """Resolved API key or user (set by the auth dependencies), else remote address."""
+    return getattr(request.state, "rate_limit_key", None) or f"ip:{get_remote_address(request)}"
 
-limiter = Limiter(key_func=get_remote_address)
+limiter = Limiter(
+    key_func=rate_limit_key,
+    storage_uri=settings.RATE_LIMIT_STORAGE_URI or settings.REDIS_URL,
+    strategy=settings.RATE_LIMIT_STRATEGY,
+    storage_options={"socket_connect_timeout": 2, "socket_timeout": 2},
+    key_prefix="ratelimit",
+    in_memory_fallback_enabled=True,
+)
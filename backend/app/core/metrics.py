@@ -0,0 +1,223 @@
+"""
+Prometheus instrumentation, exposed at /metrics.
+
+Covers HTTP latency by route template, the SQLAlchemy pool and per-statement
+timings, RouterOS calls per device, metric ingestion in flight and background
+job durations. Everything is a plain counter/histogram update on the hot path.
+The same hooks add up per-request DB, RouterOS and serialization time for the
+Server-Timing header (see RequestContextMiddleware).
+
+With several uvicorn workers set PROMETHEUS_MULTIPROC_DIR to an empty
+directory shared by the workers (the prestart step clears it); /metrics then
+aggregates the samples of every worker.
+"""
+import functools
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+)
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    # Metrics without labels open their sample files as soon as they are defined below
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time spent waiting for a pooled database connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+DB_POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use",
+    "Database connections currently checked out",
+    multiprocess_mode="livesum",
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Database statement execution time by statement type",
+    ["statement"],
+)
+ROUTEROS_CALL_DURATION = Histogram(
+    "routeros_call_duration_seconds",
+    "RouterOS API call latency by device",
+    ["device"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+ROUTEROS_ERRORS = Counter(
+    "routeros_call_errors_total",
+    "Failed RouterOS API calls by device",
+    ["device"],
+)
+ROUTEROS_CONNECTIONS = Gauge(
+    "routeros_connections_open",
+    "Authenticated RouterOS API connections currently open",
+    multiprocess_mode="livesum",
+)
+INGEST_IN_FLIGHT = Gauge(
+    "metric_ingest_in_flight",
+    "Metric samples being written and evaluated",
+    multiprocess_mode="livesum",
+)
+API_KEY_USAGE_PENDING = Gauge(
+    "api_key_usage_pending",
+    "API keys with a buffered last_used_at not yet written",
+    multiprocess_mode="livesum",
+)
+JOB_DURATION = Histogram(
+    "background_job_duration_seconds",
+    "Duration of evaluation, correlation and flush jobs",
+    ["job"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+# Seconds per Server-Timing category for the current request. The dict is
+# created by the outermost middleware and mutated in place, so time recorded
+# in threadpool calls and child tasks still lands on the right request.
+_request_timings: ContextVar[Optional[dict]] = ContextVar("request_timings", default=None)
+
+def start_request_timings():
+    """Begin collecting timings for a request; returns (timings, reset token)."""
+    timings = {}
+    return timings, _request_timings.set(timings)
+
+def end_request_timings(token) -> None:
+    _request_timings.reset(token)
+
+def record_timing(category: str, seconds: float) -> None:
+    """Add time to a Server-Timing category; a no-op outside a request."""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[category] = timings.get(category, 0.0) + seconds
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Async queue pool that records how long checkouts wait for a connection."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - started)
+
+def _statement_type(statement: str) -> str:
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return verb if verb in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH") else "OTHER"
+
+def instrument_engine(engine) -> None:
+    """Attach pool usage and statement timing listeners to an (async) engine."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_IN_USE.inc()
+
+    @event.listens_for(sync_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        DB_POOL_IN_USE.dec()
+
+    # The start time rides on the per-statement execution context, so failed
+    # statements leave nothing behind
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_query_started", None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            DB_QUERY_DURATION.labels(_statement_type(statement)).observe(elapsed)
+            record_timing("db", elapsed)
+
+@contextmanager
+def observe_routeros(device: str):
+    """Time one RouterOS API call and count it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ROUTEROS_ERRORS.labels(device).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        ROUTEROS_CALL_DURATION.labels(device).observe(elapsed)
+        record_timing("routeros", elapsed)
+
+def timed_job(name: str):
+    """Decorator recording the duration of an async background job."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                JOB_DURATION.labels(name).observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+class PrometheusMiddleware:
+    """ASGI middleware recording request latency labelled by route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Templates keep label cardinality bounded; unmatched paths share one label
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(
+                scope["method"], getattr(route, "path", "unmatched"), str(status_code),
+            ).observe(time.perf_counter() - started)
+
+def render_metrics():
+    """Return (body, content type) for the /metrics endpoint."""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def clear_multiproc_dir() -> None:
+    """Remove samples left by previous worker processes; run before workers start."""
+    if not MULTIPROC_DIR:
+        return
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    for name in os.listdir(MULTIPROC_DIR):
+        if name.endswith(".db"):
+            os.remove(os.path.join(MULTIPROC_DIR, name))
+
+def mark_process_dead() -> None:
+    """Drop this worker's live gauges when it shuts down."""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(os.getpid())
@@ -1,16 +1,219 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import Request
+import gzip
+import logging
+import re
+import time
+import uuid
+import zlib
+from contextvars import ContextVar
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
 from app.core.config import settings
+from app.core.metrics import start_request_timings, end_request_timings
 
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        # Add security headers
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Incoming IDs from proxies/clients are kept only if short and log-safe
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,128}$")
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+class SecurityHeadersMiddleware:
+    """Add the standard security headers to every HTTP response."""
+
+    def __init__(self, app):
+        self.app = app
+        self.headers = {
+            "X-Content-Type-Options": "nosniff",
+            "X-Frame-Options": "DENY",
+            "X-XSS-Protection": "1; mode=block",
+            "Referrer-Policy": "strict-origin-when-cross-origin",
+        }
         if not settings.DEBUG:
             # Only add HSTS in production
-            response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        return response
+            self.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                for name, value in self.headers.items():
+                    headers[name] = value
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+class RequestIdFilter(logging.Filter):
+    """Expose the current request ID to log formats as %(request_id)s."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+class RequestContextMiddleware:
+    """
+    Tag each request with an X-Request-ID (the caller's, if well formed) and
+    report where the time went in a Server-Timing header: database, RouterOS
+    and JSON serialization, plus the total until the response started.
+    Headers are added to the start message only, so streamed bodies pass
+    straight through.
+    """
+    CATEGORIES = ("db", "routeros", "serialize")
+
+    def __init__(self, app):
+        self.app = app
+
+    def server_timing(self, timings: dict, total: float) -> str:
+        parts = [f"{name};dur={timings.get(name, 0.0) * 1000:.1f}" for name in self.CATEGORIES]
+        parts.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(parts)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = Headers(scope=scope).get("x-request-id", "")
+        if not REQUEST_ID_PATTERN.match(request_id):
+            request_id = uuid.uuid4().hex
+        scope.setdefault("state", {})["request_id"] = request_id
+        id_token = request_id_var.set(request_id)
+        timings, timings_token = start_request_timings()
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers["X-Request-ID"] = request_id
+                headers["Server-Timing"] = self.server_timing(timings, time.perf_counter() - started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end_request_timings(timings_token)
+            request_id_var.reset(id_token)
+
+class CompressionMiddleware:
+    """
+    Compress JSON/text responses with brotli or gzip, whichever the client
+    accepts (brotli preferred), once the body reaches minimum_size bytes.
+    Complete bodies are compressed in one go; chunked bodies (e.g. behind
+    CSV exports) are compressed as they stream.
+    """
+    COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+    # Single bodies this large are compressed off the event loop
+    THREAD_THRESHOLD = 256 * 1024
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def choose_encoding(self, accept_encoding: str):
+        accepted = set()
+        for part in accept_encoding.split(","):
+            token, _, params = part.strip().partition(";")
+            if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+                continue
+            accepted.add(token.strip().lower())
+        if brotli is not None and "br" in accepted:
+            return "br"
+        if "gzip" in accepted:
+            return "gzip"
+        return None
+
+    def compress(self, encoding: str, body: bytes) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level)
+
+    def compressor(self, encoding: str):
+        """(compress, finish) callables for streaming bodies."""
+        if encoding == "br":
+            c = brotli.Compressor(quality=self.brotli_quality)
+            return c.process, c.finish
+        c = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return c.compress, c.flush
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = self.choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _CompressingSender(self, encoding, send))
+
+class _CompressingSender:
+    """Per-response state: hold the headers until the body size decides."""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.send = send
+        self.start = None
+        self.buffer = []
+        self.buffered = 0
+        self.passthrough = False
+        self.stream = None
+
+    def _headers(self) -> MutableHeaders:
+        headers = MutableHeaders(raw=self.start["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        return headers
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = Headers(raw=message["headers"])
+            if "content-encoding" in headers or not headers.get("content-type", "").startswith(
+                CompressionMiddleware.COMPRESSIBLE_TYPES
+            ):
+                self.passthrough = True
+                await self.send(message)
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.stream is not None:
+            compress, finish = self.stream
+            chunk = compress(body) + (b"" if more_body else finish())
+            await self.send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+            return
+
+        self.buffer.append(body)
+        self.buffered += len(body)
+        if not more_body:
+            body = b"".join(self.buffer)
+            if self.buffered < self.middleware.minimum_size:
+                await self.send(self.start)
+            else:
+                if self.buffered >= CompressionMiddleware.THREAD_THRESHOLD:
+                    body = await anyio.to_thread.run_sync(self.middleware.compress, self.encoding, body)
+                else:
+                    body = self.middleware.compress(self.encoding, body)
+                self._headers()["Content-Length"] = str(len(body))
+                await self.send(self.start)
+            await self.send({"type": "http.response.body", "body": body})
+        elif self.buffered >= self.middleware.minimum_size:
+            # Too big to hold back any longer: switch to streaming compression
+            headers = self._headers()
+            del headers["Content-Length"]
+            await self.send(self.start)
+            self.stream = self.middleware.compressor(self.encoding)
+            compress, _ = self.stream
+            await self.send({"type": "http.response.body", "body": compress(b"".join(self.buffer)), "more_body": True})
+            self.buffer = []
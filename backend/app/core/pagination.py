@@ -0,0 +1,56 @@
+"""
+Keyset (cursor) pagination helpers.
+
+List endpoints order rows by (created_at DESC, id DESC) and hand back an opaque
+cursor for the last row of the page. The next request passes it back and the
+query continues strictly after that row, so pages stay stable while new rows
+arrive and the database never has to skip over OFFSET rows.
+"""
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+from uuid import UUID
+
+from fastapi import HTTPException, Response
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: UUID) -> str:
+    """Encode the sort key of the last row on a page into an opaque cursor."""
+    raw = f"{created_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    """Decode a cursor produced by encode_cursor(). Raises 400 on garbage input."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        created_at, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), UUID(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+def keyset_after(stmt, created_col, id_col, cursor: Optional[str]):
+    """Apply the (created_at, id) < cursor predicate for DESC keyset pagination."""
+    if not cursor:
+        return stmt
+    created_at, row_id = decode_cursor(cursor)
+    return stmt.where(
+        (created_col < created_at) | ((created_col == created_at) & (id_col < row_id))
+    )
+
+
+def set_next_cursor(response: Response, rows: list, limit: int) -> Optional[str]:
+    """
+    Expose the cursor for the next page via the X-Next-Cursor header.
+    The response body stays a plain list so existing clients keep working.
+    """
+    if len(rows) < limit or not rows:
+        return None
+    last = rows[-1]
+    cursor = encode_cursor(last.created_at, last.id)
+    response.headers[NEXT_CURSOR_HEADER] = cursor
+    return cursor
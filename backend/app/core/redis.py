@@ -0,0 +1,28 @@
+"""
+Shared async Redis client.
+
+One connection pool per worker process; callers must treat Redis as optional
+and degrade gracefully when it is unreachable.
+"""
+import redis.asyncio as aioredis
+from app.core.config import settings
+
+_redis_client = None
+
+def get_redis() -> aioredis.Redis:
+    """Get or create the process-wide async Redis client."""
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = aioredis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=2,
+            socket_connect_timeout=2,
+            decode_responses=True,
+        )
+    return _redis_client
+
+async def close_redis():
+    global _redis_client
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
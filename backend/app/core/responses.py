@@ -0,0 +1,30 @@
+"""
+orjson-backed JSON response used as the application's default response class.
+
+Hot list endpoints return FastJSONResponse with plain dicts/rows directly,
+which skips response_model validation while the model still documents the
+shape in OpenAPI.
+"""
+import time
+import uuid
+from decimal import Decimal
+from typing import Any
+import orjson
+from fastapi.responses import ORJSONResponse
+from app.core.metrics import record_timing
+
+def _default(value: Any):
+    # asyncpg hands back its own UUID subclass, which orjson doesn't serialize natively
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+class FastJSONResponse(ORJSONResponse):
+    def render(self, content: Any) -> bytes:
+        started = time.perf_counter()
+        try:
+            return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        finally:
+            record_timing("serialize", time.perf_counter() - started)
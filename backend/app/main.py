@@ -1,10 +1,8 @@
-from fastapi import FastAPI, Request, status
+from fastapi import FastAPI, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
-from starlette.middleware.base import BaseHTTPMiddleware
 from slowapi import _rate_limit_exceeded_handler
-from slowapi.middleware import SlowAPIMiddleware
 from slowapi.errors import RateLimitExceeded
 from app.core.config import settings
 from contextlib import asynccontextmanager
@@ -12,67 +10,70 @@ from app.core.database import engine, Base
 from sqlalchemy import text
 import logging
 from app.core.limiter import limiter
+from app.core.metrics import PrometheusMiddleware, render_metrics, mark_process_dead
+from app.core.middleware import (
+    CompressionMiddleware, RequestContextMiddleware, RequestIdFilter, SecurityHeadersMiddleware,
+)
+from app.core.responses import FastJSONResponse
 
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s'
 )
+for handler in logging.getLogger().handlers:
+    handler.addFilter(RequestIdFilter())
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Run Alembic migrations
-    import subprocess
-    
-    try:
-        logger.info("Running database migrations...")
-        result = subprocess.run(
-            ["alembic", "upgrade", "head"],
-            check=True,
-            capture_output=True,
-            text=True
-        )
-        logger.info("Database migrations applied successfully.")
-        if result.stdout:
-            logger.debug(f"Migration output: {result.stdout}")
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Migration failed with exit code {e.returncode}")
-        logger.error(f"Migration error: {e.stderr}")
-        # In production, we might want to crash or continue
-        # For now, log error but continue (existing data should still work)
-    except Exception as e:
-        logger.error(f"Unexpected error during migrations: {e}", exc_info=True)
-    
-    # Verify TimescaleDB hypertable exists
-    try:
-        async with engine.begin() as conn:
-            result = await conn.execute(
-                text("SELECT * FROM timescaledb_information.hypertables WHERE hypertable_name = 'metrics'")
-            )
-            hypertable = result.first()
-            if hypertable:
-                logger.info("TimescaleDB hypertable 'metrics' verified.")
-            else:
-                logger.warning("TimescaleDB hypertable 'metrics' not found. Attempting to create...")
-                try:
-                    await conn.execute(
-                        text("SELECT create_hypertable('metrics', 'time', if_not_exists => TRUE)")
-                    )
-                    logger.info("TimescaleDB hypertable 'metrics' created.")
-                except Exception as ht_error:
-                    logger.warning(f"Could not create hypertable (may already exist or table not ready): {ht_error}")
-    except Exception as e:
-        logger.warning(f"Could not verify TimescaleDB hypertable: {e}")
-        # Non-critical, continue startup
+    # Migrations normally run once in the prestart step (python -m app.prestart);
+    # enable this for single-process setups that start uvicorn directly
+    if settings.RUN_MIGRATIONS_ON_STARTUP:
+        from app.prestart import prestart
+        try:
+            await prestart()
+        except Exception as e:
+            # Log and continue; existing data should still work
+            logger.error(f"Startup migrations failed: {e}", exc_info=True)
     
+    # Cross-worker cache invalidation and buffered API key usage writes
+    from app.core.cache import invalidation_listener
+    from app.auth.api_keys import usage_buffer
+    invalidation_listener.start()
+    usage_buffer.start()
+
+    # Pooled RouterOS sessions; the reaper closes idle ones
+    from app.services.routeros_sessions import routeros_sessions
+    routeros_sessions.start()
+
+    # Keep mirrored hotspot user tables and recorded sales fresh
+    from app.services.hotspot_mirror import hotspot_mirror
+    from app.services.hotspot_sales import hotspot_sales_scheduler
+    hotspot_mirror.start()
+    hotspot_sales_scheduler.start()
+
+    # Follow active hotspot sessions of the routers being viewed
+    from app.services.hotspot_active import hotspot_active
+    hotspot_active.start()
+
     yield
     # Shutdown
+    await hotspot_active.stop()
+    await hotspot_sales_scheduler.stop()
+    await hotspot_mirror.stop()
+    await routeros_sessions.stop()
+    await usage_buffer.stop()
+    await invalidation_listener.stop()
+    mark_process_dead()
+    from app.core.redis import close_redis
+    await close_redis()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
 # Rate limiter is imported from app.core.limiter
@@ -80,29 +81,22 @@ app = FastAPI(
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# Security Headers Middleware
-class SecurityHeadersMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        response = await call_next(request)
-        # Add security headers
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        if not settings.DEBUG:
-            # Only add HSTS in production
-            response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        return response
-
+# All middleware is pure ASGI, so streamed responses are never buffered.
+# Rate limits are enforced by the @limiter.limit decorators (there are no
+# default limits), so SlowAPIMiddleware isn't needed.
 app.add_middleware(SecurityHeadersMiddleware)
-app.add_middleware(SlowAPIMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=settings.CORS_ORIGINS_LIST,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Request-ID", "Server-Timing", "X-Data-Synced-At", "X-Data-Age-Seconds", "X-Data-Stale"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+app.add_middleware(RequestContextMiddleware)
+# Outermost, so latency covers every other middleware
+app.add_middleware(PrometheusMiddleware)
 
 @app.get("/")
 def read_root():
@@ -139,6 +133,12 @@ async def liveness_check():
     """Kubernetes liveness probe - basic alive check."""
     return {"status": "alive"}
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus exposition; outside /api so Caddy never proxies it, and compose publishes port 8000 on loopback only."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 from app.routers import auth, devices, monitoring, api_keys
 app.include_router(auth.router, prefix=f"{settings.API_PREFIX}/auth", tags=["auth"])
 app.include_router(devices.router, prefix=f"{settings.API_PREFIX}/inventory", tags=["inventory"])
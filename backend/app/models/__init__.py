@@ -1,3 +1,4 @@
 from app.models.core import User, Organization, Site, Device, UserRole, VoucherSale
-from app.models.monitoring import Metric, Alert, Incident, AutoFixAction, AgentLog, AlertSeverity, AlertStatus
+from app.models.monitoring import Metric, Alert, Incident, AutoFixAction, AgentLog, AlertSeverity, AlertStatus, AlertRule, RuleOperator, IncidentStatus
 from app.models.api_keys import APIKey
+from app.models.hotspot import HotspotUserRecord, HotspotSyncState, HotspotSalesDaily
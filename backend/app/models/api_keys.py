@@ -9,7 +9,9 @@ class APIKey(Base):
     __tablename__ = "api_keys"
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    key = Column(String, unique=True, index=True, nullable=False)
+    key = Column(String, unique=True, index=True, nullable=True) # Legacy plaintext; new keys only store key_hash
+    key_hash = Column(String(64), unique=True, index=True, nullable=True) # sha256 of the key, used for lookups
+    key_prefix = Column(String(16), nullable=True) # Shown in listings to identify the key
     description = Column(String)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
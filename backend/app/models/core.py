@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Enum, Integer, event, BigInteger
+from sqlalchemy import Column, String, Boolean, DateTime, ForeignKey, Enum, Integer, event, BigInteger, Index
 
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
@@ -34,6 +34,7 @@ class User(Base):
     role = Column(String, default=UserRole.VIEWER) # Storing enum as string for simplicity
     is_active = Column(Boolean, default=True)
     organization_id = Column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=True) # Super admin might not have org
+    token_version = Column(Integer, default=0, nullable=False) # Bumped to revoke issued access tokens
     created_at = Column(DateTime, default=datetime.utcnow)
     
     organization = relationship("Organization", back_populates="users")
@@ -123,6 +124,12 @@ def decrypt_device_secrets(device: "Device") -> "Device":
 
 class VoucherSale(Base):
     __tablename__ = "hotspot_sales"
+    __table_args__ = (
+        # One sale per voucher; backs ON CONFLICT DO NOTHING in the sales sync and record-sale
+        Index("uq_hotspot_sales_device_username", "device_id", "username", unique=True),
+        # Report range scans and (created_at, id) keyset pages per device
+        Index("ix_hotspot_sales_device_created", "device_id", "created_at", "id"),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     device_id = Column(UUID(as_uuid=True), ForeignKey("devices.id"), nullable=False)
@@ -0,0 +1,58 @@
+from sqlalchemy import Column, String, Boolean, Date, DateTime, ForeignKey, Integer, BigInteger, Index, UniqueConstraint
+from sqlalchemy.dialects.postgresql import UUID
+import uuid
+from datetime import datetime
+from app.core.database import Base
+
+class HotspotUserRecord(Base):
+    """Local mirror of a router's /ip/hotspot/user table, refreshed in the background."""
+    __tablename__ = "hotspot_users"
+    __table_args__ = (
+        UniqueConstraint("device_id", "router_id", name="uq_hotspot_users_device_router"),
+        Index("ix_hotspot_users_device_name", "device_id", "name"),
+    )
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    device_id = Column(UUID(as_uuid=True), ForeignKey("devices.id", ondelete="CASCADE"), nullable=False)
+    router_id = Column(String, nullable=False) # RouterOS .id, e.g. "*1A"
+    name = Column(String, nullable=False)
+    password = Column(String)
+    profile = Column(String)
+    uptime = Column(String)
+    uptime_sec = Column(Integer, default=0)
+    bytes_in = Column(BigInteger, default=0)
+    bytes_out = Column(BigInteger, default=0)
+    limit_uptime = Column(String)
+    limit_bytes_total = Column(BigInteger)
+    comment = Column(String)
+    disabled = Column(Boolean, default=False)
+    row_hash = Column(String(32)) # Digest of the router's values; unchanged rows aren't rewritten
+    synced_at = Column(DateTime, default=datetime.utcnow)
+
+class HotspotSyncState(Base):
+    """When each mirrored router resource was last refreshed, and the last failure."""
+    __tablename__ = "hotspot_sync_state"
+
+    device_id = Column(UUID(as_uuid=True), ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    resource = Column(String, primary_key=True) # e.g. "users"
+    last_synced_at = Column(DateTime, nullable=True)
+    last_attempt_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    row_count = Column(Integer, default=0)
+    watermark = Column(DateTime, nullable=True) # Newest source row already processed (sales sync)
+
+class HotspotSalesDaily(Base):
+    """Per-day sales totals, maintained alongside hotspot_sales for long-range revenue reports."""
+    __tablename__ = "hotspot_sales_daily"
+    __table_args__ = (
+        Index("ix_hotspot_sales_daily_site_day", "site_id", "day"),
+        Index("ix_hotspot_sales_daily_device_day", "device_id", "day"),
+    )
+
+    day = Column(Date, primary_key=True) # UTC day of the sale
+    device_id = Column(UUID(as_uuid=True), ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    site_id = Column(UUID(as_uuid=True), ForeignKey("sites.id", ondelete="CASCADE"), primary_key=True)
+    profile = Column(String, primary_key=True)
+    currency = Column(String, primary_key=True)
+    sale_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(BigInteger, nullable=False, default=0)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Float, DateTime, ForeignKey, Enum, Text, Boolean
+from sqlalchemy import Column, String, Float, DateTime, ForeignKey, Enum, Text, Boolean, Integer, Index, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 import uuid
@@ -14,10 +14,23 @@ class AlertSeverity(str, enum.Enum):
 
 class AlertStatus(str, enum.Enum):
     OPEN = "open"
+    ACKNOWLEDGED = "acknowledged"
     AUTO_FIXED = "auto_fixed"
     RESOLVED = "resolved"
     ARCHIVED = "archived"
 
+class IncidentStatus(str, enum.Enum):
+    OPEN = "open"
+    RESOLVED = "resolved"
+
+class RuleOperator(str, enum.Enum):
+    GT = ">"
+    GTE = ">="
+    LT = "<"
+    LTE = "<="
+    EQ = "=="
+    NE = "!="
+
 class Metric(Base):
     __tablename__ = "metrics"
     
@@ -36,6 +49,15 @@ class Metric(Base):
 
 class Alert(Base):
     __tablename__ = "alerts"
+    __table_args__ = (
+        # At most one open or acknowledged alert per (device, rule); backs upsert_open_alerts
+        Index(
+            "uq_alerts_open_device_rule",
+            "device_id", "rule_name",
+            unique=True,
+            postgresql_where=text("status IN ('open', 'acknowledged')"),
+        ),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     device_id = Column(UUID(as_uuid=True), ForeignKey("devices.id"), nullable=False)
@@ -45,21 +67,37 @@ class Alert(Base):
     message = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     resolved_at = Column(DateTime, nullable=True)
+    # Repeat firings of an open alert bump these instead of inserting new rows
+    occurrence_count = Column(Integer, default=1, nullable=False)
+    last_seen_at = Column(DateTime, default=datetime.utcnow)
+    confidence = Column(Float, nullable=True) # Set by anomaly detection (0-1)
+    # Incident this alert was correlated into (alerts of one site outage share it)
+    incident_id = Column(UUID(as_uuid=True), ForeignKey("incidents.id"), nullable=True, index=True)
     
     device = relationship("Device", back_populates="alerts")
-    incident = relationship("Incident", uselist=False, back_populates="alert")
+    # Incident for which this alert is the root-cause candidate
+    incident = relationship("Incident", uselist=False, back_populates="alert", foreign_keys="Incident.alert_id")
+    correlated_incident = relationship("Incident", back_populates="alerts", foreign_keys=[incident_id])
     auto_fix_actions = relationship("AutoFixAction", back_populates="alert")
 
 class Incident(Base):
     __tablename__ = "incidents"
     
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    alert_id = Column(UUID(as_uuid=True), ForeignKey("alerts.id"), unique=True)
+    alert_id = Column(UUID(as_uuid=True), ForeignKey("alerts.id"), unique=True) # Root-cause candidate
+    site_id = Column(UUID(as_uuid=True), ForeignKey("sites.id"), nullable=True, index=True)
+    status = Column(String, default=IncidentStatus.OPEN)
+    severity = Column(String, default=AlertSeverity.WARNING)
+    alert_count = Column(Integer, default=1, nullable=False)
     summary = Column(Text) # Human readable summary from ReporterAgent
     root_cause = Column(Text, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    resolved_at = Column(DateTime, nullable=True)
     
-    alert = relationship("Alert", back_populates="incident")
+    alert = relationship("Alert", back_populates="incident", foreign_keys=[alert_id])
+    alerts = relationship("Alert", back_populates="correlated_incident", foreign_keys="Alert.incident_id")
+    site = relationship("Site")
 
 class AutoFixAction(Base):
     __tablename__ = "auto_fix_actions"
@@ -81,3 +119,21 @@ class AgentLog(Base):
     level = Column(String, default="INFO")
     message = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+
+class AlertRule(Base):
+    __tablename__ = "alert_rules"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    # NULL organization means the rule applies to every organization
+    organization_id = Column(UUID(as_uuid=True), ForeignKey("organizations.id"), nullable=True, index=True)
+    name = Column(String, nullable=False) # Becomes the alert's rule_name
+    metric_type = Column(String, nullable=False)
+    operator = Column(String, nullable=False, default=RuleOperator.GT)
+    threshold = Column(Float, nullable=False)
+    duration_seconds = Column(Integer, default=0) # Breach must persist this long before firing
+    consecutive_samples = Column(Integer, default=1) # Breaching samples in a row before firing
+    hysteresis = Column(Float, default=0.0) # Clear only once the value is this far back past the threshold
+    ewma_alpha = Column(Float, default=1.0) # Streaming: EWMA smoothing factor, 1.0 = raw samples
+    severity = Column(String, default=AlertSeverity.WARNING)
+    is_enabled = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
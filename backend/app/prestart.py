@@ -0,0 +1,78 @@
+"""
+One-time startup tasks, run once per deployment before the API workers:
+
+    python -m app.prestart && uvicorn app.main:app --workers $WEB_CONCURRENCY
+
+Migrations run under a Postgres advisory lock, so several containers (or
+workers started with RUN_MIGRATIONS_ON_STARTUP) wait for a single
+`alembic upgrade head` instead of racing each other.
+"""
+import asyncio
+import logging
+import sys
+from sqlalchemy import text
+from app.core.database import engine
+from app.core.metrics import clear_multiproc_dir
+
+logger = logging.getLogger(__name__)
+
+# Distinct from the background job locks (0x4E470001-0x4E470003)
+MIGRATION_LOCK_ID = 0x4E470004
+
+async def run_migrations() -> None:
+    """Run `alembic upgrade head` while holding the migration advisory lock."""
+    async with engine.connect() as conn:
+        # Autocommit so the lock holder never sits idle in a transaction while DDL runs
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            logger.info("Running database migrations...")
+            proc = await asyncio.create_subprocess_exec(
+                "alembic", "upgrade", "head",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout, stderr = await proc.communicate()
+            if proc.returncode != 0:
+                raise RuntimeError(f"alembic exited with {proc.returncode}: {stderr.decode().strip()}")
+            logger.info("Database migrations applied successfully.")
+            if stdout:
+                logger.debug(f"Migration output: {stdout.decode()}")
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+
+async def ensure_hypertable() -> None:
+    """Make sure metrics is a TimescaleDB hypertable; non-critical if TimescaleDB is absent."""
+    try:
+        async with engine.begin() as conn:
+            result = await conn.execute(
+                text("SELECT * FROM timescaledb_information.hypertables WHERE hypertable_name = 'metrics'")
+            )
+            if result.first():
+                logger.info("TimescaleDB hypertable 'metrics' verified.")
+                return
+            logger.warning("TimescaleDB hypertable 'metrics' not found. Attempting to create...")
+            await conn.execute(text("SELECT create_hypertable('metrics', 'time', if_not_exists => TRUE)"))
+            logger.info("TimescaleDB hypertable 'metrics' created.")
+    except Exception as e:
+        logger.warning(f"Could not verify TimescaleDB hypertable: {e}")
+
+async def prestart() -> None:
+    await run_migrations()
+    await ensure_hypertable()
+
+async def _main() -> int:
+    try:
+        await prestart()
+    except Exception as e:
+        logger.error(f"Prestart failed: {e}")
+        return 1
+    finally:
+        await engine.dispose()
+        # Workers haven't started yet, so only stale and prestart samples are dropped
+        clear_multiproc_dir()
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(asyncio.run(_main()))
@@ -4,8 +4,10 @@ from sqlalchemy import select, func
 from typing import List
 from app.core.database import get_db
 from app.auth.deps import get_current_super_admin
+from app.auth.token_versions import publish_token_version, token_state, REVOKED
 from app.models import User, APIKey, Device, Organization
 from app.schemas.user import UserResponse
+from app.services.key_rotation import reencrypt_device_secrets
 from pydantic import BaseModel
 from uuid import UUID
 
@@ -37,10 +39,16 @@ async def update_user(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
+    revoke = user.is_active != user_update.is_active or user.role != user_update.role
     user.is_active = user_update.is_active
     user.role = user_update.role
+    if revoke:
+        # Issued tokens carry the old role/status; force them to be re-issued
+        user.token_version = (user.token_version or 0) + 1
     await db.commit()
     await db.refresh(user)
+    if revoke:
+        await publish_token_version(user.id, token_state(user))
     return user
 
 @router.delete("/users/{user_id}")
@@ -56,6 +64,7 @@ async def delete_user(
     
     await db.delete(user)
     await db.commit()
+    await publish_token_version(user_id, REVOKED)
     return {"status": "success", "message": "User deleted"}
 
 class PasswordReset(BaseModel):
@@ -75,7 +84,9 @@ async def reset_user_password(
         raise HTTPException(status_code=404, detail="User not found")
     
     user.hashed_password = get_password_hash(pw_data.new_password)
+    user.token_version = (user.token_version or 0) + 1
     await db.commit()
+    await publish_token_version(user.id, token_state(user))
     return {"status": "success", "message": "Password reset successfully"}
 
 @router.get("/security")
@@ -100,3 +111,11 @@ async def get_security_stats(
         "monitored_devices": device_count,
         "system_status": "SECURE" # Placeholder for actual security check
     }
+
+@router.post("/encryption/reencrypt")
+async def reencrypt_secrets(
+    db: AsyncSession = Depends(get_db),
+    admin: User = Depends(get_current_super_admin)
+):
+    """Re-encrypt device secrets under the current key after a key rotation."""
+    return await reencrypt_device_secrets(db)
@@ -5,7 +5,10 @@ from typing import List
 from app.core.database import get_db
 from app.auth.deps import get_current_user
 from app.models import User, APIKey
-from app.schemas.api_key import APIKeyCreate, APIKeyResponse
+from app.schemas.api_key import APIKeyCreate, APIKeyResponse, APIKeyCreatedResponse
+from app.auth.security import hash_api_key
+from app.auth.api_keys import API_KEY_CACHE
+from app.core.cache import invalidate
 import secrets
 import uuid
 
@@ -27,7 +30,7 @@ async def get_api_keys(
     )
     return result.scalars().all()
 
-@router.post("/", response_model=APIKeyResponse)
+@router.post("/", response_model=APIKeyCreatedResponse)
 async def create_api_key(
     key_in: APIKeyCreate,
     db: AsyncSession = Depends(get_db),
@@ -41,8 +44,10 @@ async def create_api_key(
     raw_key = secrets.token_urlsafe(32)
     api_key_str = f"ng_sk_{raw_key}"
     
+    # Only the hash is stored; the plaintext is returned this once
     new_key = APIKey(
-        key=api_key_str,
+        key_hash=hash_api_key(api_key_str),
+        key_prefix=api_key_str[:10],
         description=key_in.description,
         organization_id=current_user.organization_id,
         is_active=True
@@ -51,7 +56,15 @@ async def create_api_key(
     db.add(new_key)
     await db.commit()
     await db.refresh(new_key)
-    return new_key
+    return APIKeyCreatedResponse(
+        id=new_key.id,
+        key=api_key_str,
+        description=new_key.description,
+        is_active=new_key.is_active,
+        created_at=new_key.created_at,
+        last_used_at=new_key.last_used_at,
+        organization_id=new_key.organization_id,
+    )
 
 @router.delete("/{key_id}", status_code=204)
 async def revoke_api_key(
@@ -71,8 +84,11 @@ async def revoke_api_key(
     if not key_obj:
         raise HTTPException(status_code=404, detail="API Key not found")
         
+    key_hash = key_obj.key_hash
     await db.delete(key_obj)
     await db.commit()
+    # Drop the cached key in every worker so it stops working immediately
+    await invalidate(API_KEY_CACHE, key_hash)
     return
 
 @router.get("/usage", response_model=List[APIKeyResponse])
@@ -4,11 +4,12 @@ from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from app.core.database import get_db
-from app.auth.security import verify_password, create_access_token, get_password_hash
+from app.auth.security import verify_password, create_user_access_token, get_password_hash
 from app.models import User
 from app.schemas.user import UserCreate, UserRegister, UserResponse, Token
 from app.models.core import Organization, UserRole
 from app.auth.deps import get_current_user
+from app.auth.token_versions import publish_token_version, token_state
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -22,7 +23,7 @@ async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: AsyncSession = Depends(get_db)
 ):
-    # Rate limiting is handled globally by slowapi middleware in main.py
+    # Rate limiting is enforced by the @limiter.limit decorator above
     # Find user
     result = await db.execute(select(User).where(User.email == form_data.username))
     user = result.scalars().first()
@@ -34,7 +35,7 @@ async def login(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token = create_access_token(subject=user.id)
+    access_token = create_user_access_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/me", response_model=UserResponse)
@@ -87,5 +88,13 @@ async def change_password(
         raise HTTPException(status_code=400, detail="Incorrect old password")
     
     current_user.hashed_password = get_password_hash(pw_data.new_password)
+    # Revoke every token issued before the change; the caller gets a fresh one
+    current_user.token_version = (current_user.token_version or 0) + 1
     await db.commit()
-    return {"status": "success", "message": "Password updated"}
+    await publish_token_version(current_user.id, token_state(current_user))
+    return {
+        "status": "success",
+        "message": "Password updated",
+        "access_token": create_user_access_token(current_user),
+        "token_type": "bearer",
+    }
@@ -5,10 +5,13 @@ from typing import List
 from uuid import UUID
 import logging
 from app.core.database import get_db
+from app.core.responses import FastJSONResponse
 from app.auth.deps import get_current_user, get_authorized_actor
 from app.models import Device, Site, User, APIKey, Metric, Alert, UserRole
 from app.schemas.inventory import DeviceCreate, DeviceResponse, SiteCreate, SiteResponse, WireGuardProvisionResponse
 from app.services.wireguard import WireGuardService
+from app.services.device_access import resolve_device, invalidate_device
+from app.services.alerts import is_global_actor
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
@@ -70,70 +73,30 @@ async def get_devices(
     db: AsyncSession = Depends(get_db), 
     actor = Depends(get_authorized_actor)
 ):
-    from app.models.core import decrypt_device_secrets
-    
-    if isinstance(actor, APIKey):
-        if actor.organization_id:
-            # Filter by API key's org
-            result = await db.execute(select(Device).join(Site).where(Site.organization_id == actor.organization_id))
-        else:
-            # Global API key sees all
-            result = await db.execute(select(Device))
-        devices = result.scalars().all()
-        for d in devices:
-            decrypt_device_secrets(d)
-        return devices
+    # Only the response columns are loaded, so secrets are never read or
+    # decrypted, and rows go straight to orjson without model validation
+    query = select(*[getattr(Device, name) for name in DeviceResponse.model_fields])
+    if not is_global_actor(actor):
+        if not actor.organization_id:
+            return []
+        # Filter by the actor's org via Site
+        query = query.join(Site).where(Site.organization_id == actor.organization_id)
 
-    current_user = actor
-    # Super Admin sees all
-    if current_user.role == UserRole.SUPER_ADMIN:
-        result = await db.execute(select(Device))
-        devices = result.scalars().all()
-        for d in devices:
-            decrypt_device_secrets(d)
-        return devices
-
-    # Filter by user's org via Site
-    if current_user.organization_id:
-        result = await db.execute(select(Device).join(Site).where(Site.organization_id == current_user.organization_id))
-        devices = result.scalars().all()
-        for d in devices:
-            decrypt_device_secrets(d)
-        return devices
-    
-    return []
+    result = await db.execute(query)
+    return FastJSONResponse([dict(row._mapping) for row in result])
 
 @router.get("/devices/{device_id}", response_model=DeviceResponse)
 async def get_device(device_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
     # Verify ownership
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-         query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-         query = select(Device).where(Device.id == UUID(device_id))
-    else:
-         query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    result = await db.execute(query)
-    device = result.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+    device = await resolve_device(db, actor, device_id)
     return device
 
 @router.delete("/devices/{device_id}", status_code=204)
 async def delete_device(device_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
     
     # Check existence and ownership
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-         query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-         query = select(Device).where(Device.id == UUID(device_id))
-    else:
-         query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    result = await db.execute(query)
-    device = result.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+    device = await resolve_device(db, actor, device_id, for_update=True)
+    organization_id = device.site.organization_id
         
     # Cascade delete (Manual for MVP)
     # Delete metrics
@@ -144,45 +107,30 @@ async def delete_device(device_id: str, db: AsyncSession = Depends(get_db), acto
     # Delete device
     await db.delete(device)
     await db.commit()
+    await invalidate_device(device_id, organization_id)
     return
 
 @router.put("/devices/{device_id}", response_model=DeviceResponse)
 async def update_device(device_id: str, device_update: DeviceCreate, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
     # Verify ownership
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-         query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-         query = select(Device).where(Device.id == UUID(device_id))
-    else:
-         query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-         
-    result = await db.execute(query)
-    device = result.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+    device = await resolve_device(db, actor, device_id, for_update=True)
+    # The device may be moved to another site, so remember where it was cached
+    organization_id = device.site.organization_id
         
     # Update fields
     for key, value in device_update.dict(exclude_unset=True).items():
         setattr(device, key, value)
         
     await db.commit()
+    await invalidate_device(device_id, organization_id)
     await db.refresh(device)
     return device
 
 @router.post("/devices/{device_id}/provision-wireguard", response_model=WireGuardProvisionResponse)
 async def provision_wireguard(device_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
     # Verify ownership
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-         query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-         query = select(Device).where(Device.id == UUID(device_id))
-    else:
-         query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-         
-    result = await db.execute(query)
-    device = result.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
+    device = await resolve_device(db, actor, device_id, for_update=True)
+    organization_id = device.site.organization_id
 
     # Decrypt device secrets (required for async SQLAlchemy)
     from app.models.core import decrypt_device_secrets
@@ -202,6 +150,7 @@ async def provision_wireguard(device_id: str, db: AsyncSession = Depends(get_db)
     # Update DB
     db.add(device)
     await db.commit()
+    await invalidate_device(device_id, organization_id)
     await db.refresh(device)
     
     # Decrypt again after refresh (since refresh loads from DB)
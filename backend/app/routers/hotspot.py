@@ -1,20 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, Security
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, Security
 from fastapi.responses import StreamingResponse
 import io
 import csv
 from typing import List, Optional
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func, or_, asc, desc, false
+from sqlalchemy.dialects.postgresql import insert
 from app.core.database import get_db
+from app.core.pagination import NEXT_CURSOR_HEADER, encode_cursor, keyset_after, set_next_cursor
+from app.core.responses import FastJSONResponse
 from app.auth.deps import get_authorized_actor, get_current_user
-from app.models import Device, User, Site, APIKey, UserRole, VoucherSale
-from app.models.core import decrypt_device_secrets
-import routeros_api
+from app.models import Device, Site, VoucherSale, HotspotUserRecord, HotspotSalesDaily
+from app.services.device_access import resolve_device, invalidate_device
+from app.services.routeros import RouterOSError, RouterOSTrapError, parse_routeros_time, format_routeros_time
+from app.services.routeros_sessions import device_session
+from app.services.hotspot_active import active_sessions, forget_session
+from app.services.hotspot_sales import (
+    sync_device_sales, sales_staleness_headers, report_range, sales_in_range, rollup_in_range, revenue_breakdown,
+    add_to_daily_rollup, SALES_RESOURCE,
+)
+from app.services.alerts import is_global_actor
+from app.services.hotspot_mirror import (
+    ensure_users_mirror, get_sync_state, staleness_headers, upsert_users, remove_users,
+)
 from uuid import UUID
 from datetime import datetime
-import time
+import asyncio
 import random
+import re
 import string
 import logging
 
@@ -70,205 +84,52 @@ class SaleRecord(BaseModel):
     comment: Optional[str] = ""
 
 
-def parse_routeros_time(time_str: str) -> int:
-    """Converts RouterOS time (1d2h3m4s or HH:MM:SS) to seconds."""
-    if not time_str or time_str in ("0s", "00:00:00", ""):
-        return 0
-    
-    # Handle HH:MM:SS format
-    if ":" in time_str:
-        try:
-            parts = [p for p in time_str.split(':') if p.strip()]
-            if len(parts) == 3: # HH:MM:SS
-                h, m, s = map(int, parts)
-                return h * 3600 + m * 60 + s
-            elif len(parts) == 2: # MM:SS
-                m, s = map(int, parts)
-                return m * 60 + s
-        except (ValueError, TypeError):
-            pass # Fall through to regex-like parser
-            
-    # Handle 1d2h3m4s format
-    total_seconds = 0
-    current_val = ""
-    multipliers = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
-    
-    for char in time_str:
-        if char.isdigit():
-            current_val += char
-        elif char in multipliers:
-            if current_val:
-                total_seconds += int(current_val) * multipliers[char]
-                current_val = ""
-                
-    return total_seconds
-
-def format_routeros_time(seconds: int) -> str:
-    """Converts seconds back to RouterOS time string."""
-    if seconds <= 0:
-        return "0s"
-    
-    periods = [
-        ('d', 86400),
-        ('h', 3600),
-        ('m', 60),
-        ('s', 1)
-    ]
-    
-    result = ""
-    for suffix, count in periods:
-        if seconds >= count:
-            val = seconds // count
-            result += f"{val}{suffix}"
-            seconds %= count
-            
-    return result or "0s"
+USER_SORT_COLUMNS = {
+    "name": HotspotUserRecord.name,
+    "profile": HotspotUserRecord.profile,
+    "uptime": HotspotUserRecord.uptime_sec,
+    "bytes": HotspotUserRecord.bytes_in + HotspotUserRecord.bytes_out,
+    "comment": HotspotUserRecord.comment,
+}
+
+def mirrored_user(u: HotspotUserRecord) -> dict:
+    return {
+        "name": u.name,
+        "password": u.password,
+        "profile": u.profile,
+        "uptime": u.uptime,
+        "bytes_in": u.bytes_in,
+        "bytes_out": u.bytes_out,
+        "limit_uptime": u.limit_uptime,
+        "limit_bytes_total": u.limit_bytes_total,
+        "comment": u.comment,
+    }
 
-def get_api_pool(ip, username, password, port=8728):
-    connection = routeros_api.RouterOsApiPool(
-        ip, 
-        username=username, 
-        password=password,
-        port=port,
-        plaintext_login=True,
-        use_ssl=False
-    )
-    return connection
-
-async def sync_hotspot_sales(device: Device, db: AsyncSession):
+@router.get("/{device_id}/users", response_model=List[HotspotUser])
+async def get_hotspot_users(
+    device_id: str,
+    search: Optional[str] = None,
+    profile: Optional[str] = None,
+    comment: Optional[str] = None,
+    used: Optional[bool] = None,
+    sort: str = Query("name", pattern="^(name|profile|uptime|bytes|comment)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    limit: Optional[int] = Query(None, ge=1, le=10000),
+    offset: int = Query(0, ge=0),
+    refresh: bool = False,
+    db: AsyncSession = Depends(get_db),
+    actor = Depends(get_authorized_actor)
+):
     """
-    Syncs sold/used vouchers from MikroTik to the local VoucherSale table.
-    A voucher is considered 'sold' if uptime > 0.
+    Hotspot users from the local mirror, filtered and sorted in SQL.
+    X-Total-Count carries the match count and X-Data-* how fresh the mirror is;
+    refresh=true re-syncs from the router first.
     """
-    try:
-        # Heuristic: If port is 22 (SSH), use 8728 (API) for RouterOS API connections
-        db_port = getattr(device, 'ssh_port', 8728) or 8728
-        port = 8728 if int(db_port) == 22 else db_port
-        
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        
-        # Use standard resource (binary can sometimes have unexpected key names)
-        users_resource = api.get_resource('/ip/hotspot/user')
-        users = users_resource.get()
-        logger.info(f"Sync: Found {len(users)} total hotspot users on device {device.name}")
-        connection.disconnect()
-
-        
-        # Build price map
-        hs_settings = device.voucher_template or {}
-        profile_pricing = hs_settings.get('profile_pricing', {})
-        default_currency = hs_settings.get('default_currency', 'TZS')
-        
-        def get_pricing(p_name):
-            if p_name in profile_pricing:
-                return profile_pricing[p_name]['price'], profile_pricing[p_name]['currency']
-            import re
-            match = re.search(r'(\d+)$', p_name or '')
-            if match:
-                return float(match.group(1)), default_currency
-            return 0, default_currency
-
-        # Find users with uptime
-        new_sales = 0
-        uptime_vouchers = 0
-        for u in users:
-            uptime_str = u.get('uptime', '0s')
-            uptime_sec = parse_routeros_time(uptime_str)
-            
-            if uptime_sec > 0:
-                uptime_vouchers += 1
-                username = u.get('name')
-                comment = u.get('comment', '')
-                prof_name = u.get('profile', 'default')
-                
-                # Check for existing record to avoid duplicates
-                stmt = select(VoucherSale).where(VoucherSale.device_id == device.id, VoucherSale.username == username)
-                res = await db.execute(stmt)
-                existing = res.scalars().first()
-                
-                if not existing:
-                    price, currency = get_pricing(prof_name)
-                    
-                    # Try to parse creation date from comment: "Batch-pref | YYYY-MM-DD HH:MM:SS"
-                    # UPDATE: User requested to track sale based on Usage Date (Now), not creation date.
-                    sale_date = datetime.utcnow()
-                    # if '|' in comment:
-                    #     try:
-                    #         date_str = comment.split('|')[-1].strip()
-                    #         sale_date = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S')
-                    #     except:
-                    #         pass
-                    
-                    sale = VoucherSale(
-                        device_id=device.id,
-                        site_id=device.site_id,
-                        username=username,
-                        profile=prof_name,
-                        comment=comment,
-                        uptime=uptime_str,
-                        uptime_sec=uptime_sec,
-                        bytes_total=int(u.get('bytes-in', 0)) + int(u.get('bytes-out', 0)),
-                        price=price,
-                        currency=currency,
-                        created_at=sale_date
-                    )
-                    db.add(sale)
-                    new_sales += 1
-        
-        logger.info(f"Sync Stats: {len(users)} total, {uptime_vouchers} with uptime, {new_sales} newly recorded")
-        
-        if new_sales > 0:
-            await db.commit()
-            logger.info(f"Synced {new_sales} new hotspot sales for device {device.name}")
-
-            
-    except Exception as e:
-        logger.error(f"Sync Hotspot Sales Error: {e}")
-        await db.rollback()
-
-
-@router.get("/{device_id}/users", response_model=List[HotspotUser])
-async def get_hotspot_users(device_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
     # Fetch device with visibility check
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    # Decrypt device secrets (required for async SQLAlchemy)
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
         
     try:
-        # Heuristic: If port is 22 (SSH), use 8728 (API) for RouterOS API connections
-        db_port = getattr(device, 'ssh_port', 8728) or 8728
-        port = 8728 if int(db_port) == 22 else db_port
-        
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        
-        users = api.get_resource('/ip/hotspot/user').get()
-        connection.disconnect()
-        
-        return [HotspotUser(
-            name=u.get('name'), 
-            password=u.get('password'), 
-            profile=u.get('profile'),
-            uptime=u.get('uptime'),
-            bytes_in=int(u.get('bytes-in', 0)),
-            bytes_out=int(u.get('bytes-out', 0)),
-            limit_uptime=u.get('limit-uptime'),
-            limit_bytes_total=int(u.get('limit-bytes-total')) if u.get('limit-bytes-total') else None,
-            comment=u.get('comment')
-        ) for u in users]
-        
+        state = await ensure_users_mirror(db, device, refresh=refresh)
     except Exception as e:
         logger.error(f"Hotspot API Error: {e}")
         error_msg = str(e)
@@ -278,40 +139,56 @@ async def get_hotspot_users(device_id: str, db: AsyncSession = Depends(get_db),
              raise HTTPException(status_code=504, detail="Router Connection Timed Out. Check VPN status and IP.")
         raise HTTPException(status_code=500, detail=f"Router Error: {error_msg}")
 
+    conditions = [HotspotUserRecord.device_id == device.id]
+    if search:
+        pattern = f"%{search}%"
+        conditions.append(or_(HotspotUserRecord.name.ilike(pattern), HotspotUserRecord.comment.ilike(pattern)))
+    if profile:
+        conditions.append(HotspotUserRecord.profile == profile)
+    if comment:
+        conditions.append(HotspotUserRecord.comment.ilike(f"%{comment}%"))
+    if used is not None:
+        conditions.append(HotspotUserRecord.uptime_sec > 0 if used else HotspotUserRecord.uptime_sec == 0)
+
+    total = await db.scalar(select(func.count()).select_from(HotspotUserRecord).where(*conditions))
+    column = USER_SORT_COLUMNS[sort]
+    direction = desc if order == "desc" else asc
+    query = (
+        select(HotspotUserRecord)
+        .where(*conditions)
+        .order_by(direction(column), direction(HotspotUserRecord.name))
+        .offset(offset)
+    )
+    if limit is not None:
+        query = query.limit(limit)
+    users = (await db.execute(query)).scalars().all()
+
+    # Vouchers can number in the tens of thousands; build plain dicts in the
+    # HotspotUser shape and skip response_model re-validation
+    headers = {"X-Total-Count": str(total), **staleness_headers(state)}
+    return FastJSONResponse([mirrored_user(u) for u in users], headers=headers)
+
 
 @router.post("/{device_id}/users")
 async def create_hotspot_user(device_id: str, user: HotspotUser, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-         raise HTTPException(status_code=404, detail="Device not found")
-    
-    # Decrypt device secrets (required for async SQLAlchemy)
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
          
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        
-        # Check if exists
-        existing = api.get_resource('/ip/hotspot/user').get(name=user.name)
-        if existing:
-             raise HTTPException(status_code=400, detail="User already exists")
-             
-        api.get_resource('/ip/hotspot/user').add(
-            name=user.name, 
-            password=user.password, 
-            profile=user.profile
-        )
-        connection.disconnect()
+        async with device_session(device) as api:
+            # Check if exists
+            existing = await api.get('/ip/hotspot/user', name=user.name)
+            if existing:
+                 raise HTTPException(status_code=400, detail="User already exists")
+
+            router_id = await api.add(
+                '/ip/hotspot/user',
+                name=user.name, 
+                password=user.password, 
+                profile=user.profile
+            )
+        # Write through so the voucher shows up before the next mirror sync
+        await upsert_users(db, device.id, [{'.id': router_id, 'name': user.name, 'password': user.password, 'profile': user.profile}])
+        await db.commit()
         return {"status": "success"}
     except Exception as e:
         if "User already exists" in str(e): raise e
@@ -319,40 +196,22 @@ async def create_hotspot_user(device_id: str, user: HotspotUser, db: AsyncSessio
         raise HTTPException(status_code=500, detail=str(e))
 @router.delete("/{device_id}/users/{username}")
 async def delete_hotspot_user(device_id: str, username: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
          
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        
-        resource = api.get_resource('/ip/hotspot/user')
-        user_list = resource.get(name=username)
-        if not user_list:
-             connection.disconnect()
-             raise HTTPException(status_code=404, detail="User not found")
-             
-        # Safely get internal ID (sometimes .id, sometimes id)
-        uid = user_list[0].get('.id') or user_list[0].get('id')
-        if not uid:
-            logger.error(f"Delete failed: Internal ID not found for user {username}. Response: {user_list[0]}")
-            connection.disconnect()
-            raise HTTPException(status_code=500, detail="Voucher found but internal identifier missing from router response.")
+        async with device_session(device) as api:
+            user_list = await api.get('/ip/hotspot/user', name=username)
+            if not user_list:
+                 raise HTTPException(status_code=404, detail="User not found")
 
-        resource.remove(id=uid)
-        connection.disconnect()
+            uid = user_list[0].get('.id')
+            if not uid:
+                logger.error(f"Delete failed: Internal ID not found for user {username}. Response: {user_list[0]}")
+                raise HTTPException(status_code=500, detail="Voucher found but internal identifier missing from router response.")
+
+            await api.remove('/ip/hotspot/user', uid)
+        await remove_users(db, device.id, [uid])
+        await db.commit()
         return {"status": "success"}
     except Exception as e:
         logger.error(f"Delete User Error: {e}")
@@ -360,28 +219,13 @@ async def delete_hotspot_user(device_id: str, username: str, db: AsyncSession =
 
 @router.get("/{device_id}/profiles", response_model=List[dict])
 async def get_hotspot_profiles(device_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    # Decrypt device secrets (required for async SQLAlchemy)
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
         
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        
-        profiles = api.get_resource('/ip/hotspot/user/profile').get()
-        active = api.get_resource('/ip/hotspot/active').get()
+        async with device_session(device) as api:
+            profiles = await api.get('/ip/hotspot/user/profile')
+        active = await active_sessions(device)
+        await ensure_users_mirror(db, device)
         
         # Calculate active users per profile
         active_per_profile = {}
@@ -393,8 +237,12 @@ async def get_hotspot_profiles(device_id: str, db: AsyncSession = Depends(get_db
 
         # Let's just return the profiles for now, but enriched if we can.
         # Enriched Profiles with user counts:
-        users = api.get_resource('/ip/hotspot/user').get()
-        user_to_profile = {u.get('name'): u.get('profile') for u in users}
+        active_names = {a.get('user') for a in active}
+        result = await db.execute(
+            select(HotspotUserRecord.name, HotspotUserRecord.profile)
+            .where(HotspotUserRecord.device_id == device.id, HotspotUserRecord.name.in_(active_names))
+        )
+        user_to_profile = dict(result.all())
         
         profile_counts = {p.get('name'): 0 for p in profiles}
         for a in active:
@@ -416,7 +264,6 @@ async def get_hotspot_profiles(device_id: str, db: AsyncSession = Depends(get_db
             p['custom_price'] = pricing.get('price', 0)
             p['custom_currency'] = pricing.get('currency', default_currency)
 
-        connection.disconnect()
         return profiles
     except Exception as e:
         logger.error(f"Hotspot Profiles Error: {e}")
@@ -428,19 +275,7 @@ class ProfileSettings(BaseModel):
 
 @router.post("/{device_id}/profiles/{profile_name}/settings")
 async def update_profile_settings(device_id: str, profile_name: str, settings: ProfileSettings, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id, for_update=True)
     try:
         # Update local database instead of MikroTik (RouterOS might not support comments on profiles via API)
         import copy
@@ -461,6 +296,7 @@ async def update_profile_settings(device_id: str, profile_name: str, settings: P
         device.voucher_template = hs_settings
         db.add(device)
         await db.commit()
+        await invalidate_device(device.id, device.site.organization_id)
         
         return {"status": "success"}
     except Exception as e:
@@ -469,77 +305,41 @@ async def update_profile_settings(device_id: str, profile_name: str, settings: P
 
 @router.get("/{device_id}/summary")
 async def get_hotspot_summary(device_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
          
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        
-        active_resource = api.get_resource('/ip/hotspot/active')
-        user_resource = api.get_resource('/ip/hotspot/user')
-        
-        active_sessions = active_resource.get()
-        total_users = user_resource.get()
-        
-        total_bytes_in = sum(int(a.get('bytes-in', 0)) for a in active_sessions)
-        total_bytes_out = sum(int(a.get('bytes-out', 0)) for a in active_sessions)
-        
-        # Profile Distribution
-        profile_dist = {}
-        for u in total_users:
-            p = u.get('profile', 'default')
-            profile_dist[p] = profile_dist.get(p, 0) + 1
-            
-        connection.disconnect()
+        sessions = await active_sessions(device)
+        state = await ensure_users_mirror(db, device)
+        
+        total_bytes_in = sum(int(a.get('bytes-in', 0)) for a in sessions)
+        total_bytes_out = sum(int(a.get('bytes-out', 0)) for a in sessions)
+        
+        # Profile Distribution, counted from the mirror
+        profile = func.coalesce(HotspotUserRecord.profile, 'default')
+        result = await db.execute(
+            select(profile, func.count())
+            .where(HotspotUserRecord.device_id == device.id)
+            .group_by(profile)
+        )
+        profile_dist = dict(result.all())
         
-        return {
-            "active_count": len(active_sessions),
-            "total_vouchers": len(total_users),
+        return FastJSONResponse({
+            "active_count": len(sessions),
+            "total_vouchers": sum(profile_dist.values()),
             "total_data_mb": round((total_bytes_in + total_bytes_out) / 1024 / 1024, 2),
             "profile_distribution": [{"name": k, "value": v} for k, v in profile_dist.items()]
-        }
+        }, headers=staleness_headers(state))
     except Exception as e:
         logger.error(f"Hotspot Summary Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{device_id}/system-info")
 async def get_router_system_info(device_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
          
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        
-        resource = api.get_resource('/system/resource')
-        info = resource.get()[0]
-        
-        connection.disconnect()
+        async with device_session(device) as api:
+            info = (await api.get('/system/resource'))[0]
         
         return {
             "cpu_load": info.get('cpu-load'),
@@ -555,26 +355,9 @@ async def get_router_system_info(device_id: str, db: AsyncSession = Depends(get_
 
 @router.post("/{device_id}/profiles")
 async def create_hotspot_profile(device_id: str, profile: HotspotProfile, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-         raise HTTPException(status_code=404, detail="Device not found")
-    
-    # Decrypt device secrets (required for async SQLAlchemy)
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
          
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        
         params = {
             'name': profile.name,
             'shared-users': str(profile.sharedUsers)
@@ -582,78 +365,44 @@ async def create_hotspot_profile(device_id: str, profile: HotspotProfile, db: As
         if profile.rateLimit:
             params['rate-limit'] = profile.rateLimit
             
-        api.get_resource('/ip/hotspot/user/profile').add(**params)
-        connection.disconnect()
+        async with device_session(device) as api:
+            await api.add('/ip/hotspot/user/profile', **params)
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.delete("/{device_id}/profiles/{profile_name}")
 async def delete_hotspot_profile(device_id: str, profile_name: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    # Decrypt device secrets (required for async SQLAlchemy)
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
         
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        
-        # In RouterOS API, removing by name usually requires finding the .id first or using the name if the library supports it
-        # routeros-api's remove() typically takes an id.
-        resource = api.get_resource('/ip/hotspot/user/profile')
-        profile = resource.get(name=profile_name)
-        if not profile:
-             raise HTTPException(status_code=404, detail="Profile not found")
-             
-        resource.remove(id=profile[0]['id'])
-        connection.disconnect()
+        # Removing by name requires finding the .id first
+        async with device_session(device) as api:
+            profile = await api.get('/ip/hotspot/user/profile', name=profile_name)
+            if not profile:
+                 raise HTTPException(status_code=404, detail="Profile not found")
+
+            await api.remove('/ip/hotspot/user/profile', profile[0]['.id'])
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{device_id}/active", response_model=List[HotspotActive])
 async def get_active_users(device_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    # Decrypt device secrets (required for async SQLAlchemy)
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
     
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        active = api.get_resource('/ip/hotspot/active').get()
-        users = api.get_resource('/ip/hotspot/user').get()
-        connection.disconnect()
+        active = await active_sessions(device)
+        await ensure_users_mirror(db, device)
         
+        # Limits only for the users that are online, from the mirror
+        result = await db.execute(
+            select(HotspotUserRecord.name, HotspotUserRecord.limit_uptime, HotspotUserRecord.limit_bytes_total)
+            .where(HotspotUserRecord.device_id == device.id, HotspotUserRecord.name.in_({a.get('user') for a in active}))
+        )
         user_limits = {
-            u.get('name'): {
-                'limit-uptime': u.get('limit-uptime'), 
-                'limit-bytes-total': int(u.get('limit-bytes-total')) if u.get('limit-bytes-total') else None
-            } 
-            for u in users
+            name: {'limit-uptime': limit_uptime, 'limit-bytes-total': limit_bytes}
+            for name, limit_uptime, limit_bytes in result.all()
         }
         
         results = []
@@ -679,7 +428,7 @@ async def get_active_users(device_id: str, db: AsyncSession = Depends(get_db), a
                 remaining = format_routeros_time(rem_sec)
 
             results.append(HotspotActive(
-                id=a.get('.id') or a.get('id'),
+                id=a.get('.id'),
                 user=username,
                 address=a.get('address'),
                 uptime=uptime_str,
@@ -697,27 +446,12 @@ async def get_active_users(device_id: str, db: AsyncSession = Depends(get_db), a
 
 @router.delete("/{device_id}/active/{active_id}")
 async def kick_active_user(device_id: str, active_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    # Decrypt device secrets (required for async SQLAlchemy)
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
         
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        api.get_resource('/ip/hotspot/active').remove(id=active_id)
-        connection.disconnect()
+        async with device_session(device) as api:
+            await api.remove('/ip/hotspot/active', active_id)
+        await forget_session(device.id, active_id)
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -734,37 +468,16 @@ class VoucherTemplate(BaseModel):
 
 @router.post("/{device_id}/voucher-template")
 async def update_voucher_template(device_id: str, template: VoucherTemplate, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
+    device = await resolve_device(db, actor, device_id, for_update=True)
     device.voucher_template = template.dict()
     await db.commit()
+    await invalidate_device(device.id, device.site.organization_id)
     
     return {"status": "saved", "template": template}
 
 @router.get("/{device_id}/voucher-template", response_model=VoucherTemplate)
 async def get_voucher_template(device_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-        
+    device = await resolve_device(db, actor, device_id)
     if device.voucher_template:
         return VoucherTemplate(**device.voucher_template)
         
@@ -774,85 +487,69 @@ async def get_voucher_template(device_id: str, db: AsyncSession = Depends(get_db
 @router.post("/{device_id}/users/batch")
 async def batch_generate_users(device_id: str, batch: BatchUserCreate, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
     
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-        
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    # Decrypt device secrets (required for async SQLAlchemy)
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
         
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        resource = api.get_resource('/ip/hotspot/user')
-        
-        generated = []
-        max_attempts = batch.qty * 3 # Allow for more collisions
-        attempts = 0
-        
-        logger.info(f"Starting batch generation: qty={batch.qty}, random={batch.random_mode}, format={batch.format}")
-        
-        while len(generated) < batch.qty and attempts < max_attempts:
-            attempts += 1
-            if batch.random_mode:
-                if batch.format == "numeric":
-                    # numeric mode with variable length
-                    length = batch.length if batch.length else 8
-                    username = ''.join(random.choices(string.digits, k=length))
-                    password = username
-                else:
-                    # alphanumeric mode: split length between letters and numbers
-                    # default length 8 if not specified
-                    length = batch.length if batch.length else 8
-                    num_len = length // 2
-                    char_len = length - num_len
+        async with device_session(device) as api:
+            generated = []
+            created = []
+            max_attempts = batch.qty * 3 # Allow for more collisions
+            attempts = 0
+        
+            logger.info(f"Starting batch generation: qty={batch.qty}, random={batch.random_mode}, format={batch.format}")
+        
+            while len(generated) < batch.qty and attempts < max_attempts:
+                attempts += 1
+                if batch.random_mode:
+                    if batch.format == "numeric":
+                        # numeric mode with variable length
+                        length = batch.length if batch.length else 8
+                        username = ''.join(random.choices(string.digits, k=length))
+                        password = username
+                    else:
+                        # alphanumeric mode: split length between letters and numbers
+                        # default length 8 if not specified
+                        length = batch.length if batch.length else 8
+                        num_len = length // 2
+                        char_len = length - num_len
                     
-                    letters = ''.join(random.choices(string.ascii_lowercase, k=char_len))
-                    numbers = ''.join(random.choices(string.digits, k=num_len))
-                    username = f"{letters}{numbers}"
-                    password = username # Same as username
-            else:
-                suffix_len = batch.length if batch.length else 4
-                suffix = ''.join(random.choices(string.digits, k=suffix_len))
-                username = f"{batch.prefix}{suffix}"
-                password = ''.join(random.choices(string.digits, k=4)) # Simple 4 digit password
+                        letters = ''.join(random.choices(string.ascii_lowercase, k=char_len))
+                        numbers = ''.join(random.choices(string.digits, k=num_len))
+                        username = f"{letters}{numbers}"
+                        password = username # Same as username
+                else:
+                    suffix_len = batch.length if batch.length else 4
+                    suffix = ''.join(random.choices(string.digits, k=suffix_len))
+                    username = f"{batch.prefix}{suffix}"
+                    password = ''.join(random.choices(string.digits, k=4)) # Simple 4 digit password
             
-            try:
-                params = {
-                    'name': username,
-                    'password': password,
-                    'profile': batch.profile or 'default',
-                    'comment': f"Batch-{batch.prefix or 'auto'} | {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                }
-                if batch.time_limit:
-                    params['limit-uptime'] = batch.time_limit
-                if batch.data_limit:
-                    params['limit-bytes-total'] = batch.data_limit
+                try:
+                    params = {
+                        'name': username,
+                        'password': password,
+                        'profile': batch.profile or 'default',
+                        'comment': f"Batch-{batch.prefix or 'auto'} | {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+                    }
+                    if batch.time_limit:
+                        params['limit-uptime'] = batch.time_limit
+                    if batch.data_limit:
+                        params['limit-bytes-total'] = batch.data_limit
                     
-                resource.add(**params)
-                generated.append({"username": username, "password": password})
-            except Exception as e:
-                # Likely "user already exists", continue to next attempt
-                if "already exists" not in str(e).lower():
-                    logger.warning(f"Batch item error (Attempt {attempts}/{max_attempts}): {e}")
-                continue
+                    router_id = await api.add('/ip/hotspot/user', **params)
+                    generated.append({"username": username, "password": password})
+                    created.append({'.id': router_id, **params})
+                except Exception as e:
+                    # Likely "user already exists", continue to next attempt
+                    if "already exists" not in str(e).lower():
+                        logger.warning(f"Batch item error (Attempt {attempts}/{max_attempts}): {e}")
+                    continue
                 
-        logger.info(f"Batch generation complete: {len(generated)}/{batch.qty} created in {attempts} attempts")
-        connection.disconnect()
+            logger.info(f"Batch generation complete: {len(generated)}/{batch.qty} created in {attempts} attempts")
+        await upsert_users(db, device.id, created)
+        await db.commit()
         return generated
     except Exception as e:
         logger.error(f"Batch Gen Error: {e}", exc_info=True)
-        if 'connection' in locals() and connection:
-            connection.disconnect()
         raise HTTPException(status_code=500, detail=f"Failed to generate vouchers: {str(e)}")
 @router.delete("/{device_id}/users/bulk")
 async def bulk_delete_users(
@@ -863,135 +560,95 @@ async def bulk_delete_users(
     db: AsyncSession = Depends(get_db), 
     actor = Depends(get_authorized_actor)
 ):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-        
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
     
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        resource = api.get_resource('/ip/hotspot/user')
-        
-        users = resource.get()
-        to_delete = []
+        async with device_session(device) as api:
+            users = await api.get('/ip/hotspot/user')
+            to_delete = []
         
-        def safe_int(v):
-            try:
-                return int(v) if v else 0
-            except ValueError:
-                return 0
+            def safe_int(v):
+                try:
+                    return int(v) if v else 0
+                except ValueError:
+                    return 0
 
-        for u in users:
-            should_delete = False
-            if comment and u.get('comment') == comment:
-                should_delete = True
+            for u in users:
+                should_delete = False
+                if comment and u.get('comment') == comment:
+                    should_delete = True
             
-            if expired:
-                uptime_str = u.get('uptime', '0s')
-                limit_uptime_str = u.get('limit-uptime')
+                if expired:
+                    uptime_str = u.get('uptime', '0s')
+                    limit_uptime_str = u.get('limit-uptime')
                 
-                uptime_sec = parse_routeros_time(uptime_str)
-                limit_uptime_sec = parse_routeros_time(limit_uptime_str)
+                    uptime_sec = parse_routeros_time(uptime_str)
+                    limit_uptime_sec = parse_routeros_time(limit_uptime_str)
                 
-                # Mikrotik returns bytes as strings
-                bytes_out = safe_int(u.get('bytes-out'))
-                bytes_in = safe_int(u.get('bytes-in'))
-                total_bytes = bytes_out + bytes_in
-                limit_bytes = safe_int(u.get('limit-bytes-total'))
+                    # Mikrotik returns bytes as strings
+                    bytes_out = safe_int(u.get('bytes-out'))
+                    bytes_in = safe_int(u.get('bytes-in'))
+                    total_bytes = bytes_out + bytes_in
+                    limit_bytes = safe_int(u.get('limit-bytes-total'))
                 
-                # Robust comparison for "expired":
-                # 1. If reached uptime limit
-                # 2. If reached data limit
-                if limit_uptime_sec > 0 and uptime_sec >= limit_uptime_sec:
-                    should_delete = True
-                if limit_bytes > 0 and total_bytes >= limit_bytes:
-                    should_delete = True
+                    # Robust comparison for "expired":
+                    # 1. If reached uptime limit
+                    # 2. If reached data limit
+                    if limit_uptime_sec > 0 and uptime_sec >= limit_uptime_sec:
+                        should_delete = True
+                    if limit_bytes > 0 and total_bytes >= limit_bytes:
+                        should_delete = True
             
-            if unused:
-                # Delete never used vouchers (uptime is 0s, bytes in/out 0)
-                uptime_str = u.get('uptime', '0s')
-                uptime_sec = parse_routeros_time(uptime_str)
-                bytes_out = safe_int(u.get('bytes-out'))
-                bytes_in = safe_int(u.get('bytes-in'))
+                if unused:
+                    # Delete never used vouchers (uptime is 0s, bytes in/out 0)
+                    uptime_str = u.get('uptime', '0s')
+                    uptime_sec = parse_routeros_time(uptime_str)
+                    bytes_out = safe_int(u.get('bytes-out'))
+                    bytes_in = safe_int(u.get('bytes-in'))
                 
-                if uptime_sec == 0 and bytes_out == 0 and bytes_in == 0:
-                    should_delete = True
+                    if uptime_sec == 0 and bytes_out == 0 and bytes_in == 0:
+                        should_delete = True
 
             
-            if should_delete:
-                to_delete.append(u.get('.id') or u.get('id'))
+                if should_delete:
+                    to_delete.append(u.get('.id'))
         
-        deleted_count = 0
-        failed_count = 0
-        errors = []
-
-        # Function to (re)initialize connection and get resource
-        def get_resource():
-            # Close existing if it exists
-            nonlocal connection, api, resource
-            if connection:
-                try:
-                    connection.disconnect()
-                except:
-                    pass
-            
-            # Re-establish
-            port = getattr(device, 'ssh_port', 8728) or 8728
-            connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-            api = connection.get_api()
-            # Use binary resource for more raw control
-            resource = api.get_binary_resource('/ip/hotspot/user')
-            return resource
+            deleted_count = 0
+            failed_count = 0
+            errors = []
+            deleted_ids = []
 
-        # Initialize
-        resource = get_resource()
-
-        for uid in to_delete:
-            if not uid:
-                continue
-                
-            try:
-                # Use call('remove') directly on binary resource for more stability
-                resource.call('remove', {'.id': uid})
-                deleted_count += 1
-            except Exception as del_err:
-                err_msg = str(del_err)
-                logger.error(f"Failed to delete voucher {uid}: {err_msg}")
+            for uid in to_delete:
+                if not uid:
+                    continue
                 
-                # If we hit protocol desync or malformed sentence, stay calm and reconnect
-                if "Malformed sentence" in err_msg or "!empty" in err_msg or "desync" in err_msg.lower():
-                    logger.warning(f"Protocol desync detected during deletion of {uid}. Resetting connection...")
-                    try:
-                        resource = get_resource()
-                        failed_count += 1 # Count this one as failed for now
-                    except Exception as conn_err:
-                        logger.error(f"Failed to reconnect after protocol error: {conn_err}")
-                        break 
-                else:
+                try:
+                    await api.remove('/ip/hotspot/user', uid)
+                    deleted_count += 1
+                    deleted_ids.append(uid)
+                except RouterOSTrapError as del_err:
+                    logger.error(f"Failed to delete voucher {uid}: {del_err}")
                     failed_count += 1
-                    errors.append(f"{uid}: {err_msg}")
-            
-            # Throttling
-            if deleted_count % 10 == 0:
-                time.sleep(0.02)
+                    errors.append(f"{uid}: {del_err}")
+                except RouterOSError as conn_err:
+                    # Connection dropped or timed out: reconnect and carry on
+                    logger.warning(f"Connection lost during deletion of {uid}: {conn_err}. Reconnecting...")
+                    failed_count += 1
+                    try:
+                        await api.connect()
+                    except RouterOSError as e:
+                        logger.error(f"Failed to reconnect after connection error: {e}")
+                        break
             
-        if connection:
-            connection.disconnect()
+                # Throttling, without blocking the event loop
+                if deleted_count % 10 == 0:
+                    await asyncio.sleep(0.02)
         
-        if failed_count > 0:
-            logger.warning(f"Bulk delete partial completion. Deleted: {deleted_count}, Failed: {failed_count}. Errors: {errors[:5]}")
+            if failed_count > 0:
+                logger.warning(f"Bulk delete partial completion. Deleted: {deleted_count}, Failed: {failed_count}. Errors: {errors[:5]}")
             
+        await remove_users(db, device.id, deleted_ids)
+        await db.commit()
         return {"status": "success", "count": deleted_count, "failed": failed_count}
     except Exception as e:
         logger.error(f"Bulk Delete Error: {e}")
@@ -999,30 +656,12 @@ async def bulk_delete_users(
 
 @router.get("/{device_id}/logs")
 async def get_hotspot_logs(device_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
          
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        
         # Fetch recent logs (last 500 to ensure we find enough hotspot entries)
-        log_resource = api.get_resource('/log')
-        all_logs = log_resource.get()
-        
-        connection.disconnect()
+        async with device_session(device) as api:
+            all_logs = await api.get('/log')
         
         # Filter for logs containing 'hotspot' topic
         hotspot_logs = [l for l in all_logs if 'hotspot' in l.get('topics', '').lower()]
@@ -1054,146 +693,201 @@ async def get_hotspot_logs(device_id: str, db: AsyncSession = Depends(get_db), a
         logger.error(f"Router Logs Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def sale_row(sale: VoucherSale) -> dict:
+    return {
+        "username": sale.username,
+        "profile": sale.profile,
+        "created_at": sale.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        "uptime": sale.uptime,
+        "bytes": sale.bytes_total,
+        "price": sale.price,
+        "currency": sale.currency,
+        "comment": sale.comment
+    }
+
+def newest_sales(device_id, start_dt: Optional[datetime], end_dt: Optional[datetime], cursor: Optional[str], limit: int, search: Optional[str] = None):
+    """Sales in range, newest first, continuing after `cursor` (keyset on created_at, id)."""
+    stmt = select(VoucherSale).where(VoucherSale.device_id == device_id, *sales_in_range(start_dt, end_dt))
+    if search:
+        pattern = f"%{search}%"
+        stmt = stmt.where(or_(VoucherSale.username.ilike(pattern), VoucherSale.profile.ilike(pattern), VoucherSale.comment.ilike(pattern)))
+    stmt = keyset_after(stmt, VoucherSale.created_at, VoucherSale.id, cursor)
+    return stmt.order_by(desc(VoucherSale.created_at), desc(VoucherSale.id)).limit(limit)
+
 @router.get("/{device_id}/reports")
 async def get_hotspot_reports(
     device_id: str, 
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
     period: Optional[str] = None,
+    refresh: bool = False,
+    limit: int = Query(100, ge=1, le=1000),
     db: AsyncSession = Depends(get_db), 
     actor = Depends(get_authorized_actor)
 ):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    decrypt_device_secrets(device)
+    """
+    Sales report: totals, daily and per-profile stats are aggregated in SQL;
+    `data` holds only the newest `limit` sales. Fetch the rest from
+    /reports/sales by passing `next_cursor` (also sent as X-Next-Cursor).
+    """
+    device = await resolve_device(db, actor, device_id)
          
     try:
-        # 1. Sync latest sales before reporting
-        await sync_hotspot_sales(device, db)
-        
-        # 2. Query the persistent VoucherSale table
-        from sqlalchemy import and_, func
-        
-        stmt = select(VoucherSale).where(VoucherSale.device_id == device.id)
-        
-        # Handle period presets
-        from datetime import timedelta
-        now = datetime.utcnow()
-        if period == 'day':
-            start_date = now.strftime('%Y-%m-%d')
-        elif period == 'week':
-            start_date = (now - timedelta(days=7)).strftime('%Y-%m-%d')
-        elif period == 'month':
-            start_date = now.replace(day=1).strftime('%Y-%m-%d')
-
-        if start_date:
-            try:
-                start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-                stmt = stmt.where(VoucherSale.created_at >= start_dt)
-            except: pass
-            
-        if end_date:
+        # 1. Sales are synced in the background; only a device's first report
+        #    (or refresh=true) syncs inline
+        sync_state = await get_sync_state(db, device.id, SALES_RESOURCE)
+        if refresh or sync_state is None:
             try:
-                # End date inclusive (until end of day)
-                end_dt = datetime.strptime(end_date, '%Y-%m-%d').replace(hour=23, minute=59, second=59)
-                stmt = stmt.where(VoucherSale.created_at <= end_dt)
-            except: pass
-
-        # Sort by most recent
-        stmt = stmt.order_by(VoucherSale.created_at.desc())
-        
-        res = await db.execute(stmt)
-        all_sales = res.scalars().all()
+                await sync_device_sales(db, device)
+            except Exception as e:
+                logger.error(f"Sync Hotspot Sales Error: {e}")
+                await db.rollback()
+            db.expire_all()
+            sync_state = await get_sync_state(db, device.id, SALES_RESOURCE)
+        
+        # 2. Aggregate the daily rollup (Mikhmon style: per day and per profile)
+        start_date, start_dt, end_dt = report_range(period, start_date, end_date)
+        result = await db.execute(
+            select(
+                HotspotSalesDaily.day, HotspotSalesDaily.profile, HotspotSalesDaily.currency,
+                func.sum(HotspotSalesDaily.sale_count), func.sum(HotspotSalesDaily.revenue),
+            )
+            .where(HotspotSalesDaily.device_id == device.id, *rollup_in_range(start_dt, end_dt))
+            .group_by(HotspotSalesDaily.day, HotspotSalesDaily.profile, HotspotSalesDaily.currency)
+        )
         
-        report_data = []
         total_revenue = {} # Per currency
         total_sold = 0
-        
-        for sale in all_sales:
-            total_sold += 1
-            curr = sale.currency or "TZS"
-            total_revenue[curr] = total_revenue.get(curr, 0) + sale.price
-            
-            report_data.append({
-                "username": sale.username,
-                "profile": sale.profile,
-                "created_at": sale.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-                "uptime": sale.uptime,
-                "bytes": sale.bytes_total,
-                "price": sale.price,
-                "currency": sale.currency,
-                "comment": sale.comment
-            })
-
-        # Aggregation by period (Mikhmon Style)
         daily_stats = {}
-        for sale in all_sales:
-            day_str = sale.created_at.strftime('%Y-%m-%d')
-            if day_str not in daily_stats:
-                daily_stats[day_str] = {"count": 0, "revenue": {}}
-            
-            daily_stats[day_str]["count"] += 1
-            c = sale.currency or "TZS"
-            daily_stats[day_str]["revenue"][c] = daily_stats[day_str]["revenue"].get(c, 0) + sale.price
-
         profile_stats = {}
-        for sale in all_sales:
-            p = sale.profile
-            if p not in profile_stats:
-                profile_stats[p] = {"count": 0, "revenue": {}}
-            profile_stats[p]["count"] += 1
-            c = sale.currency or "TZS"
-            profile_stats[p]["revenue"][c] = profile_stats[p]["revenue"].get(c, 0) + sale.price
-
-        return {
+        for sale_day, profile, curr, count, revenue in result.all():
+            count, revenue = int(count), int(revenue)
+            total_sold += count
+            total_revenue[curr] = total_revenue.get(curr, 0) + revenue
+            for stats, key in ((daily_stats, sale_day.strftime('%Y-%m-%d')), (profile_stats, profile)):
+                entry = stats.setdefault(key, {"count": 0, "revenue": {}})
+                entry["count"] += count
+                entry["revenue"][curr] = entry["revenue"].get(curr, 0) + revenue
+
+        # 3. First page of detail rows
+        sales = (await db.execute(newest_sales(device.id, start_dt, end_dt, None, limit))).scalars().all()
+        headers = sales_staleness_headers(sync_state)
+        next_cursor = encode_cursor(sales[-1].created_at, sales[-1].id) if len(sales) == limit else None
+        if next_cursor:
+            headers[NEXT_CURSOR_HEADER] = next_cursor
+
+        return FastJSONResponse({
             "status": "success",
+            "last_synced_at": sync_state.last_synced_at.isoformat() if sync_state and sync_state.last_synced_at else None,
             "period": period or f"{start_date} to {end_date}",
             "total_sold": total_sold,
             "total_revenue": total_revenue,
-            "data": report_data,
+            "data": [sale_row(sale) for sale in sales],
+            "next_cursor": next_cursor,
             "daily_stats": sorted([{"date": k, **v} for k, v in daily_stats.items()], key=lambda x: x['date'], reverse=True),
             "profile_stats": sorted([{"profile": k, **v} for k, v in profile_stats.items()], key=lambda x: x['count'], reverse=True)
-        }
+        }, headers=headers)
     except Exception as e:
         logger.error(f"Hotspot Report Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/revenue")
+async def get_hotspot_revenue(
+    organization_id: Optional[UUID] = None,
+    site_id: Optional[UUID] = None,
+    device_id: Optional[UUID] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    period: Optional[str] = None,
+    interval: str = Query("day", pattern="^(day|week|month|year)$"),
+    db: AsyncSession = Depends(get_db),
+    actor = Depends(get_authorized_actor)
+):
+    """
+    Revenue across the actor's organization, narrowed to a site or device,
+    served from the daily rollup so month and year ranges stay cheap. Only
+    global actors may pick another organization_id.
+    """
+    start_date, start_dt, end_dt = report_range(period, start_date, end_date)
+    conditions = rollup_in_range(start_dt, end_dt)
+    if not is_global_actor(actor):
+        organization_id = actor.organization_id
+        if not organization_id:
+            conditions.append(false())
+    if organization_id:
+        conditions.append(HotspotSalesDaily.site_id.in_(select(Site.id).where(Site.organization_id == organization_id)))
+    if site_id:
+        conditions.append(HotspotSalesDaily.site_id == site_id)
+    if device_id:
+        conditions.append(HotspotSalesDaily.device_id == device_id)
+
+    bucket = func.date_trunc(interval, HotspotSalesDaily.day).label('bucket')
+    series = await revenue_breakdown(db, conditions, bucket)
+    sites = await revenue_breakdown(db, conditions, HotspotSalesDaily.site_id)
+    devices = await revenue_breakdown(db, conditions, HotspotSalesDaily.device_id, HotspotSalesDaily.site_id)
+    profiles = await revenue_breakdown(db, conditions, HotspotSalesDaily.profile)
+
+    site_names = dict((await db.execute(select(Site.id, Site.name).where(Site.id.in_([k[0] for k in sites])))).all())
+    device_names = dict((await db.execute(select(Device.id, Device.name).where(Device.id.in_([k[0] for k in devices])))).all())
+    total_revenue = {}
+    for entry in sites.values():
+        for curr, revenue in entry["revenue"].items():
+            total_revenue[curr] = total_revenue.get(curr, 0) + revenue
+
+    return FastJSONResponse({
+        "status": "success",
+        "period": period or f"{start_date} to {end_date}",
+        "interval": interval,
+        "total_sold": sum(entry["count"] for entry in sites.values()),
+        "total_revenue": total_revenue,
+        "series": sorted([{"date": k[0].strftime('%Y-%m-%d'), **v} for k, v in series.items()], key=lambda x: x['date'], reverse=True),
+        "sites": sorted([{"site_id": str(k[0]), "name": site_names.get(k[0]), **v} for k, v in sites.items()], key=lambda x: x['count'], reverse=True),
+        "devices": sorted([
+            {"device_id": str(k[0]), "site_id": str(k[1]), "name": device_names.get(k[0]), **v} for k, v in devices.items()
+        ], key=lambda x: x['count'], reverse=True),
+        "profile_stats": sorted([{"profile": k[0], **v} for k, v in profiles.items()], key=lambda x: x['count'], reverse=True),
+    })
+
+@router.get("/{device_id}/reports/sales")
+async def get_hotspot_report_sales(
+    device_id: str,
+    response: Response,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    period: Optional[str] = None,
+    search: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_db),
+    actor = Depends(get_authorized_actor)
+):
+    """
+    Sales detail rows of a report, newest first, optionally matching `search`
+    in the code, profile or comment. Pagination is keyset based on
+    (created_at, id): pass the X-Next-Cursor response header back as `cursor`.
+    """
+    device = await resolve_device(db, actor, device_id)
+    _, start_dt, end_dt = report_range(period, start_date, end_date)
+    sales = (await db.execute(newest_sales(device.id, start_dt, end_dt, cursor, limit, search))).scalars().all()
+    set_next_cursor(response, sales, limit)
+    return [sale_row(sale) for sale in sales]
+
 @router.get("/{device_id}/users/export")
 async def export_hotspot_users(
     device_id: str, 
     db: AsyncSession = Depends(get_db), 
     actor = Depends(get_authorized_actor)
 ):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        query = select(Device).where(Device.id == UUID(device_id))
-    else:
-        query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-        
-    res = await db.execute(query)
-    device = res.scalars().first()
-    if not device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
-    decrypt_device_secrets(device)
+    device = await resolve_device(db, actor, device_id)
     
     try:
-        port = getattr(device, 'ssh_port', 8728) or 8728
-        connection = get_api_pool(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', int(port))
-        api = connection.get_api()
-        users = api.get_resource('/ip/hotspot/user').get()
-        connection.disconnect()
+        await ensure_users_mirror(db, device)
+        result = await db.execute(
+            select(HotspotUserRecord)
+            .where(HotspotUserRecord.device_id == device.id)
+            .order_by(HotspotUserRecord.name)
+        )
+        users = result.scalars().all()
         
         output = io.StringIO()
         writer = csv.writer(output)
@@ -1201,15 +895,15 @@ async def export_hotspot_users(
         
         for u in users:
             writer.writerow([
-                u.get('name'),
-                u.get('password'),
-                u.get('profile'),
-                u.get('uptime'),
-                u.get('bytes-in'),
-                u.get('bytes-out'),
-                u.get('limit-uptime'),
-                u.get('limit-bytes-total'),
-                u.get('comment')
+                u.name,
+                u.password,
+                u.profile,
+                u.uptime,
+                u.bytes_in,
+                u.bytes_out,
+                u.limit_uptime,
+                u.limit_bytes_total,
+                u.comment
             ])
             
         output.seek(0)
@@ -1284,11 +978,12 @@ async def record_hotspot_sale(
     #     except:
     #         pass
 
-    new_sale = VoucherSale(
-        device_id=sale.device_id,
+    # A sync or a repeated report may record the same voucher concurrently
+    row = dict(
+        device_id=device.id,
         site_id=device.site_id,
         username=sale.username,
-        profile=sale.profile,
+        profile=sale.profile or 'default',
         comment=sale.comment,
         uptime=sale.uptime,
         uptime_sec=parse_routeros_time(sale.uptime),
@@ -1297,8 +992,12 @@ async def record_hotspot_sale(
         currency=currency,
         created_at=sale_date
     )
-    
-    db.add(new_sale)
+    stmt = insert(VoucherSale).values(**row).on_conflict_do_nothing(index_elements=["device_id", "username"]).returning(VoucherSale.id)
+    new_id = (await db.execute(stmt)).scalar()
+    if new_id is None:
+        await db.commit()
+        return {"status": "already_recorded"}
+    await add_to_daily_rollup(db, [row])
     await db.commit()
     
-    return {"status": "recorded", "id": str(new_sale.id)}
+    return {"status": "recorded", "id": str(new_id)}
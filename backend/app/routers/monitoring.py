@@ -1,12 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request, Response, Query
 from app.core.config import settings
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from typing import List, Optional
 from app.core.database import get_db
-from app.models import Metric, Alert, Incident, AutoFixAction, AlertStatus, User, Device, Site, APIKey, UserRole
-from app.schemas.monitoring import MetricCreate, MetricResponse, AlertResponse, IncidentResponse, AlertCreate, AlertUpdate, AutoFixActionCreate, AutoFixActionResponse, DashboardStatsResponse
+from app.core.responses import FastJSONResponse
+from app.models import Metric, Alert, Incident, IncidentStatus, AutoFixAction, AlertStatus, AlertSeverity, AlertRule, User, Device, Site, APIKey, UserRole
+from app.schemas.monitoring import MetricCreate, MetricResponse, AlertResponse, IncidentResponse, AlertCreate, AlertUpdate, AutoFixActionCreate, AutoFixActionResponse, DashboardStatsResponse, AlertBulkTransition, AlertBulkTransitionResponse, BulkAlertAction, AlertRuleCreate, AlertRuleResponse, RuleEvaluationResponse, AnomalyEvaluationResponse, IncidentUpdate, IncidentCorrelationResponse, IncidentListResponse
 from app.auth.deps import get_authorized_actor, get_current_user
+from app.core.pagination import keyset_after, set_next_cursor
+from app.core.metrics import INGEST_IN_FLIGHT
+from app.core.events import publish_event, ALERTS_CHANGED_CHANNEL
+from app.services.rule_engine import evaluate_rules
+from app.services.stream_evaluator import stream_evaluator
+from app.services.anomaly import detect_anomalies
+from app.services.correlation import correlate_alerts, resolve_incident
+from app.services.device_access import resolve_device
+from app.services.alerts import scope_alerts, filter_alerts, bulk_transition_alerts, upsert_open_alerts, is_global_actor, naive_utc
 from uuid import UUID
 from datetime import datetime, timezone
 
@@ -20,34 +32,40 @@ async def create_metric(metric: MetricCreate, db: AsyncSession = Depends(get_db)
     import logging
     logger = logging.getLogger(__name__)
     
-    try:
-        # Verify device exists and belongs to actor's organization (if restricted)
-        from app.models import Device, Site
-        if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-            dev_query = select(Device).where(Device.id == metric.device_id)
-        elif isinstance(actor, APIKey) and not actor.organization_id:
-            dev_query = select(Device).where(Device.id == metric.device_id)
-        else:
-            dev_query = select(Device).join(Site).where(
-                Device.id == metric.device_id,
-                Site.organization_id == actor.organization_id
-            )
+    with INGEST_IN_FLIGHT.track_inprogress():
+        try:
+            # Verify device exists and belongs to actor's organization (if restricted)
+            from app.models import Device, Site
+            # Organization is selected alongside so the stream evaluator can match org rules
+            dev_query = select(Device.id, Site.organization_id).join(Site).where(Device.id == metric.device_id)
+            if not is_global_actor(actor):
+                dev_query = dev_query.where(Site.organization_id == actor.organization_id)
         
-        dev_result = await db.execute(dev_query)
-        device = dev_result.scalars().first()
-        if not device:
-            raise HTTPException(status_code=404, detail="Device not found or access denied")
+            dev_result = await db.execute(dev_query)
+            device = dev_result.first()
+            if not device:
+                raise HTTPException(status_code=404, detail="Device not found or access denied")
         
-        new_metric = Metric(**metric.dict())
-        db.add(new_metric)
-        await db.commit()
-        await db.refresh(new_metric)
-        return new_metric
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"Error creating metric: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="Failed to create metric")
+            new_metric = Metric(**metric.dict())
+            db.add(new_metric)
+            await db.commit()
+            await db.refresh(new_metric)
+
+            # Fire/clear alerts right away; a failure here must not lose the sample
+            try:
+                await stream_evaluator.process(
+                    db, new_metric.device_id, device.organization_id,
+                    new_metric.metric_type, new_metric.value, new_metric.time,
+                )
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Streaming rule evaluation failed: {e}", exc_info=True)
+            return new_metric
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error creating metric: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Failed to create metric")
 
 @router.get("/metrics/latest", response_model=List[MetricResponse])
 @limiter.limit("100/minute")
@@ -55,16 +73,7 @@ async def get_latest_metrics(request: Request, device_id: str, metric_type: Opti
     from uuid import UUID
     
     # Verify ownership
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-         dev_query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-         dev_query = select(Device).where(Device.id == UUID(device_id))
-    else:
-         dev_query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    dev_res = await db.execute(dev_query)
-    if not dev_res.scalars().first():
-         raise HTTPException(status_code=404, detail="Device not found")
+    await resolve_device(db, actor, device_id)
          
     query = select(Metric).where(Metric.device_id == UUID(device_id))
     
@@ -82,19 +91,13 @@ async def get_historical_metrics(request: Request, device_id: str, start_time: s
     import traceback
     
     # Verify ownership
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-         dev_query = select(Device).where(Device.id == UUID(device_id))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-         dev_query = select(Device).where(Device.id == UUID(device_id))
-    else:
-         dev_query = select(Device).join(Site).where(Device.id == UUID(device_id), Site.organization_id == actor.organization_id)
-    
-    dev_res = await db.execute(dev_query)
-    if not dev_res.scalars().first():
-         raise HTTPException(status_code=404, detail="Device not found")
+    await resolve_device(db, actor, device_id)
     
     try:
-        query = select(Metric).where(Metric.device_id == UUID(device_id))
+        # Plain rows go straight to orjson; re-validating up to 5000 models dominated this endpoint
+        query = select(
+            Metric.time, Metric.device_id, Metric.metric_type, Metric.value, Metric.unit, Metric.meta_data,
+        ).where(Metric.device_id == UUID(device_id))
         
         # Handle JS toISOString which might end in Z. Python 3.11 handles Z, but let's be safe.
         if start_time.endswith('Z'):
@@ -119,31 +122,81 @@ async def get_historical_metrics(request: Request, device_id: str, start_time: s
             
         # Limit to prevent crash, but large enough for graph
         result = await db.execute(query.order_by(Metric.time.asc()).limit(5000))
-        return result.scalars().all()
+        return FastJSONResponse([dict(row._mapping) for row in result])
     except Exception as e:
         print(f"History Error: {e}")
         traceback.print_exc()
         return []
 
 @router.get("/alerts", response_model=List[AlertResponse])
-async def get_alerts(skip: int = 0, limit: int = 50, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        stmt = select(Alert).where(Alert.status != AlertStatus.ARCHIVED).order_by(desc(Alert.created_at)).offset(skip).limit(limit)
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        stmt = select(Alert).where(Alert.status != AlertStatus.ARCHIVED).order_by(desc(Alert.created_at)).offset(skip).limit(limit)
+async def get_alerts(
+    response: Response,
+    device_id: Optional[UUID] = None,
+    status: Optional[AlertStatus] = None,
+    severity: Optional[AlertSeverity] = None,
+    rule_name: Optional[str] = None,
+    incident_id: Optional[UUID] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    skip: int = 0,
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+    actor = Depends(get_authorized_actor)
+):
+    """
+    List alerts newest first, filtered server-side.
+
+    Archived alerts are hidden unless explicitly requested with status=archived.
+    Pagination is keyset based on (created_at, id): pass the X-Next-Cursor
+    response header back as `cursor` to fetch the next page. `skip` is kept for
+    older clients and ignored when a cursor is given.
+    """
+    stmt = scope_alerts(select(Alert), actor)
+    if status:
+        stmt = stmt.where(Alert.status == status)
     else:
-        stmt = select(Alert).join(Device).join(Site).where(Site.organization_id == actor.organization_id, Alert.status != AlertStatus.ARCHIVED).order_by(desc(Alert.created_at)).offset(skip).limit(limit)
-    
+        stmt = stmt.where(Alert.status != AlertStatus.ARCHIVED)
+    stmt = filter_alerts(
+        stmt,
+        device_id=device_id,
+        severity=severity,
+        rule_name=rule_name,
+        since=since,
+        until=until,
+    )
+    if incident_id:
+        stmt = stmt.where(Alert.incident_id == incident_id)
+
+    if cursor:
+        stmt = keyset_after(stmt, Alert.created_at, Alert.id, cursor)
+    elif skip:
+        stmt = stmt.offset(skip)
+
+    stmt = stmt.order_by(desc(Alert.created_at), desc(Alert.id)).limit(limit)
     result = await db.execute(stmt)
-    return result.scalars().all()
+    alerts = result.scalars().all()
+    set_next_cursor(response, alerts, limit)
+    return alerts
 
 @router.post("/alerts", response_model=AlertResponse)
 async def create_alert(alert: AlertCreate, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    new_alert = Alert(**alert.dict())
-    db.add(new_alert)
+    """
+    Open an alert, or bump the existing open alert for the same device and rule.
+
+    Idempotent: agents can POST on every detection cycle without checking
+    first. A repeat increments occurrence_count and refreshes last_seen_at.
+    """
+    dev_query = select(Device.id).where(Device.id == alert.device_id)
+    if not is_global_actor(actor):
+        dev_query = dev_query.join(Site).where(Site.organization_id == actor.organization_id)
+    dev_res = await db.execute(dev_query)
+    if dev_res.scalar() is None:
+        raise HTTPException(status_code=404, detail="Device not found or access denied")
+
+    upserted = await upsert_open_alerts(db, [alert.dict()])
     await db.commit()
-    await db.refresh(new_alert)
-    return new_alert
+    return upserted[0]
 
 @router.post("/alerts/clear", response_model=dict)
 async def clear_alerts(db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
@@ -151,39 +204,183 @@ async def clear_alerts(db: AsyncSession = Depends(get_db), actor = Depends(get_a
     Archives all currently visible alerts (Open/Resolved) for the organization.
     They will no longer appear in the main list.
     """
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        stmt = select(Alert).where(Alert.status != AlertStatus.ARCHIVED)
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        stmt = select(Alert).where(Alert.status != AlertStatus.ARCHIVED)
-    else:
-        stmt = select(Alert).join(Device).join(Site).where(
-            Site.organization_id == actor.organization_id,
-            Alert.status != AlertStatus.ARCHIVED
-        )
-    
-    result = await db.execute(stmt)
-    alerts = result.scalars().all()
-    
-    count = 0
-    for alert in alerts:
-        alert.status = AlertStatus.ARCHIVED
-        count += 1
-        
-    await db.commit()
+    count = await bulk_transition_alerts(db, actor, BulkAlertAction.ARCHIVE.value)
     return {"status": "success", "cleared_count": count}
 
-@router.get("/incidents", response_model=List[IncidentResponse])
-async def get_incidents(db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
-    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
-        stmt = select(Incident).order_by(desc(Incident.created_at))
-    elif isinstance(actor, APIKey) and not actor.organization_id:
-        stmt = select(Incident).order_by(desc(Incident.created_at))
-    else:
-        stmt = select(Incident).join(Alert).join(Device).join(Site).where(Site.organization_id == actor.organization_id).order_by(desc(Incident.created_at))
-    
+@router.post("/alerts/bulk/{action}", response_model=AlertBulkTransitionResponse)
+async def bulk_transition(
+    action: BulkAlertAction,
+    selection: AlertBulkTransition,
+    db: AsyncSession = Depends(get_db),
+    actor = Depends(get_authorized_actor)
+):
+    """
+    Archive, resolve or acknowledge every alert matching the filter in a single
+    UPDATE, scoped to the actor's organization.
+    """
+    count = await bulk_transition_alerts(db, actor, action.value, **selection.dict())
+    return {"status": "success", "action": action, "updated_count": count}
+
+@router.get("/rules", response_model=List[AlertRuleResponse])
+async def get_alert_rules(db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
+    """List global rules plus the actor's organization rules."""
+    stmt = select(AlertRule).order_by(AlertRule.created_at)
+    if not is_global_actor(actor):
+        stmt = stmt.where(or_(AlertRule.organization_id.is_(None), AlertRule.organization_id == actor.organization_id))
     result = await db.execute(stmt)
     return result.scalars().all()
 
+@router.post("/rules", response_model=AlertRuleResponse)
+async def create_alert_rule(rule: AlertRuleCreate, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
+    # Rules created by global actors apply to every organization
+    organization_id = None if is_global_actor(actor) else actor.organization_id
+    new_rule = AlertRule(**rule.dict(), organization_id=organization_id)
+    db.add(new_rule)
+    await db.commit()
+    await db.refresh(new_rule)
+    stream_evaluator.invalidate_rules()
+    return new_rule
+
+async def _get_editable_rule(rule_id: str, db: AsyncSession, actor) -> AlertRule:
+    stmt = select(AlertRule).where(AlertRule.id == UUID(rule_id))
+    if not is_global_actor(actor):
+        # Global rules are read-only for organization actors
+        stmt = stmt.where(AlertRule.organization_id == actor.organization_id)
+    result = await db.execute(stmt)
+    rule = result.scalars().first()
+    if not rule:
+        raise HTTPException(status_code=404, detail="Alert rule not found")
+    return rule
+
+@router.put("/rules/{rule_id}", response_model=AlertRuleResponse)
+async def update_alert_rule(rule_id: str, rule_update: AlertRuleCreate, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
+    rule = await _get_editable_rule(rule_id, db, actor)
+    for key, value in rule_update.dict().items():
+        setattr(rule, key, value)
+    await db.commit()
+    await db.refresh(rule)
+    stream_evaluator.invalidate_rules()
+    return rule
+
+@router.delete("/rules/{rule_id}", status_code=204)
+async def delete_alert_rule(rule_id: str, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
+    rule = await _get_editable_rule(rule_id, db, actor)
+    await db.delete(rule)
+    await db.commit()
+    stream_evaluator.invalidate_rules()
+    return
+
+@router.post("/rules/evaluate", response_model=RuleEvaluationResponse)
+async def evaluate_alert_rules(db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
+    """
+    Run one fleet-wide evaluation tick: every enabled rule against the latest
+    metrics of every device in one query, then bulk open/resolve alerts.
+    Called periodically by the diagnoser agent.
+    """
+    if not is_global_actor(actor):
+        raise HTTPException(status_code=403, detail="Rule evaluation requires a global API key or super admin")
+    return await evaluate_rules(db)
+
+@router.post("/anomalies/evaluate", response_model=AnomalyEvaluationResponse)
+async def evaluate_anomalies(db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
+    """
+    Score every active metric series for anomalies in one vectorised pass and
+    open/resolve anomaly alerts. Called periodically by the diagnoser agent.
+    """
+    if not is_global_actor(actor):
+        raise HTTPException(status_code=403, detail="Anomaly detection requires a global API key or super admin")
+    return await detect_anomalies(db)
+
+@router.post("/incidents/correlate", response_model=IncidentCorrelationResponse)
+async def correlate_incidents(db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
+    """
+    Group uncorrelated open alerts into one incident per site and resolve
+    incidents whose alerts have all cleared. Called periodically by the
+    diagnoser agent.
+    """
+    if not is_global_actor(actor):
+        raise HTTPException(status_code=403, detail="Incident correlation requires a global API key or super admin")
+    return await correlate_alerts(db)
+
+@router.get("/incidents", response_model=List[IncidentListResponse])
+async def get_incidents(
+    response: Response,
+    status: Optional[IncidentStatus] = None,
+    severity: Optional[AlertSeverity] = None,
+    site_id: Optional[UUID] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_db),
+    actor = Depends(get_authorized_actor)
+):
+    """
+    List incidents newest first with their root-cause alert and device.
+
+    The alert and device are many-to-one, so they are joined into the same
+    query without multiplying rows. Pagination is keyset based on
+    (created_at, id): pass the X-Next-Cursor response header back as `cursor`.
+    """
+    stmt = select(Incident).options(joinedload(Incident.alert).joinedload(Alert.device))
+    if not is_global_actor(actor):
+        org_sites = select(Site.id).where(Site.organization_id == actor.organization_id)
+        stmt = stmt.where(Incident.site_id.in_(org_sites))
+    if status:
+        stmt = stmt.where(Incident.status == status)
+    if severity:
+        stmt = stmt.where(Incident.severity == severity)
+    if site_id:
+        stmt = stmt.where(Incident.site_id == site_id)
+    if since:
+        stmt = stmt.where(Incident.created_at >= naive_utc(since))
+    if until:
+        stmt = stmt.where(Incident.created_at <= naive_utc(until))
+
+    stmt = keyset_after(stmt, Incident.created_at, Incident.id, cursor)
+    stmt = stmt.order_by(desc(Incident.created_at), desc(Incident.id)).limit(limit)
+    result = await db.execute(stmt)
+    incidents = result.scalars().all()
+    set_next_cursor(response, incidents, limit)
+    return incidents
+
+@router.patch("/incidents/{incident_id}", response_model=IncidentResponse)
+async def update_incident(incident_id: str, update: IncidentUpdate, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
+    """Update an incident. Resolving it also closes every still-active alert it groups."""
+    stmt = select(Incident).where(Incident.id == UUID(incident_id))
+    if not is_global_actor(actor):
+        stmt = stmt.join(Site, Site.id == Incident.site_id).where(Site.organization_id == actor.organization_id)
+    result = await db.execute(stmt)
+    incident = result.scalars().first()
+    if not incident:
+        raise HTTPException(status_code=404, detail="Incident not found")
+
+    if update.root_cause is not None:
+        incident.root_cause = update.root_cause
+    if update.resolution_summary is not None:
+        incident.summary = update.resolution_summary
+
+    alerts_closed = 0
+    if update.status == IncidentStatus.RESOLVED and incident.status != IncidentStatus.RESOLVED:
+        if update.alert_status not in (AlertStatus.RESOLVED, AlertStatus.AUTO_FIXED):
+            raise HTTPException(status_code=400, detail="alert_status must be resolved or auto_fixed")
+        alerts_closed = await resolve_incident(db, incident, update.alert_status)
+    elif update.status == IncidentStatus.OPEN:
+        incident.status = IncidentStatus.OPEN
+        incident.resolved_at = None
+        incident.updated_at = datetime.utcnow()
+
+    await db.commit()
+    await db.refresh(incident)
+    if alerts_closed:
+        await publish_event(ALERTS_CHANGED_CHANNEL, {
+            "organization_id": getattr(actor, "organization_id", None),
+            "action": "incident_resolved",
+            "incident_id": str(incident.id),
+            "count": alerts_closed,
+        })
+    return incident
+
 @router.patch("/alerts/{alert_id}", response_model=AlertResponse)
 async def update_alert(alert_id: str, update: AlertUpdate, db: AsyncSession = Depends(get_db), actor = Depends(get_authorized_actor)):
     # Verify ownership via device -> site
@@ -204,7 +401,12 @@ async def update_alert(alert_id: str, update: AlertUpdate, db: AsyncSession = De
     if update.status in [AlertStatus.RESOLVED, AlertStatus.AUTO_FIXED]:
         alert_obj.resolved_at = datetime.utcnow()
         
-    await db.commit()
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Re-opening would clash with another open alert for the same device and rule
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="An open alert for this device and rule already exists")
     await db.refresh(alert_obj)
     return alert_obj
 
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional
 from datetime import datetime
 from uuid import UUID
@@ -16,7 +16,8 @@ class APIKeyCreate(BaseModel):
 
 class APIKeyResponse(BaseModel):
     id: UUID
-    key: str
+    # Only the prefix is kept in a readable form; the full key is shown once on creation
+    key: str = Field(validation_alias="key_prefix")
     description: Optional[str]
     is_active: bool
     created_at: datetime
@@ -25,3 +26,6 @@ class APIKeyResponse(BaseModel):
 
     class Config:
         from_attributes = True  # Updated from orm_mode (Pydantic v2)
+
+class APIKeyCreatedResponse(APIKeyResponse):
+    key: str  # Full plaintext key, returned only by the create endpoint
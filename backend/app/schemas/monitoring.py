@@ -1,7 +1,8 @@
 from pydantic import BaseModel, UUID4, Field, validator
 from typing import Optional, Any, Dict, List
 from datetime import datetime
-from app.models.monitoring import AlertSeverity, AlertStatus
+from enum import Enum
+from app.models.monitoring import AlertSeverity, AlertStatus, RuleOperator, IncidentStatus
 
 # Metric
 class MetricCreate(BaseModel):
@@ -64,6 +65,10 @@ class AlertResponse(AlertBase):
     status: AlertStatus
     created_at: datetime
     resolved_at: Optional[datetime] = None
+    occurrence_count: int = 1
+    last_seen_at: Optional[datetime] = None
+    confidence: Optional[float] = None
+    incident_id: Optional[UUID4] = None
     
     class Config:
         from_attributes = True
@@ -81,6 +86,84 @@ class AlertUpdate(BaseModel):
         }
     }
 
+class BulkAlertAction(str, Enum):
+    ARCHIVE = "archive"
+    RESOLVE = "resolve"
+    ACKNOWLEDGE = "acknowledge"
+
+class AlertBulkTransition(BaseModel):
+    """Filter selecting the alerts a bulk action applies to. Empty means all in scope."""
+    alert_ids: Optional[List[UUID4]] = None
+    device_id: Optional[UUID4] = None
+    severity: Optional[AlertSeverity] = None
+    rule_name: Optional[str] = None
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "device_id": "123e4567-e89b-12d3-a456-426614174000",
+                "rule_name": "High CPU"
+            }
+        }
+    }
+
+class AlertBulkTransitionResponse(BaseModel):
+    status: str = "success"
+    action: BulkAlertAction
+    updated_count: int
+
+# Alert Rules
+class AlertRuleBase(BaseModel):
+    name: str = Field(..., min_length=1, max_length=255, description="Alert rule_name raised when the rule fires")
+    metric_type: str = Field(..., min_length=1, max_length=100)
+    operator: RuleOperator = RuleOperator.GT
+    threshold: float
+    duration_seconds: int = Field(0, ge=0, le=86400, description="Breach must persist this long before firing")
+    consecutive_samples: int = Field(1, ge=1, le=1000, description="Breaching samples in a row before firing")
+    hysteresis: float = Field(0.0, ge=0, description="Clear only once the value is this far back past the threshold")
+    ewma_alpha: float = Field(1.0, gt=0, le=1, description="EWMA smoothing factor applied to samples; 1.0 disables smoothing")
+    severity: AlertSeverity = AlertSeverity.WARNING
+    is_enabled: bool = True
+
+class AlertRuleCreate(AlertRuleBase):
+    model_config = {
+        "json_schema_extra": {
+            "example": {
+                "name": "High Memory",
+                "metric_type": "memory_usage",
+                "operator": ">",
+                "threshold": 90,
+                "duration_seconds": 300,
+                "severity": "warning"
+            }
+        }
+    }
+
+class AlertRuleResponse(AlertRuleBase):
+    id: UUID4
+    organization_id: Optional[UUID4] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class RuleEvaluationResponse(BaseModel):
+    status: str
+    evaluated: int
+    opened: int
+    firing: int
+    resolved: int
+
+class AnomalyEvaluationResponse(BaseModel):
+    status: str
+    series: int
+    anomalies: int
+    opened: int
+    resolved: int
+    elapsed_ms: float
+
 # AutoFixAction
 class AutoFixActionCreate(BaseModel):
     action_type: str
@@ -107,14 +190,60 @@ class AutoFixActionResponse(AutoFixActionCreate):
 # Incident
 class IncidentResponse(BaseModel):
     id: UUID4
-    alert_id: UUID4
+    alert_id: Optional[UUID4] = None
+    site_id: Optional[UUID4] = None
+    status: IncidentStatus = IncidentStatus.OPEN
+    severity: Optional[AlertSeverity] = None
+    alert_count: int = 1
     summary: Optional[str]
     root_cause: Optional[str]
     created_at: datetime
+    updated_at: Optional[datetime] = None
+    resolved_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
 
+class IncidentDeviceSummary(BaseModel):
+    id: UUID4
+    name: str
+    ip_address: Optional[str] = None
+    device_type: Optional[str] = None
+    site_id: Optional[UUID4] = None
+
+    class Config:
+        from_attributes = True
+
+class IncidentAlertSummary(BaseModel):
+    id: UUID4
+    rule_name: str
+    severity: AlertSeverity
+    status: AlertStatus
+    message: str
+    created_at: datetime
+    device: Optional[IncidentDeviceSummary] = None
+
+    class Config:
+        from_attributes = True
+
+class IncidentListResponse(IncidentResponse):
+    """Incident with its root-cause alert and device, loaded in the listing query."""
+    alert: Optional[IncidentAlertSummary] = None
+
+class IncidentUpdate(BaseModel):
+    status: IncidentStatus
+    # Status given to the incident's still-active alerts when it is resolved
+    alert_status: AlertStatus = AlertStatus.RESOLVED
+    root_cause: Optional[str] = None
+    resolution_summary: Optional[str] = None
+
+class IncidentCorrelationResponse(BaseModel):
+    status: str
+    correlated: int
+    created: int
+    updated: int
+    resolved: int
+
 # Dashboard Stats
 class HotspotUser(BaseModel):
     user: Optional[str] = None
@@ -0,0 +1,167 @@
+"""
+Set-based alert operations shared by the monitoring router and background jobs.
+"""
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from sqlalchemy import select, update, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import Alert, AlertSeverity, AlertStatus, APIKey, Device, Site, User, UserRole
+from app.core.events import publish_event, ALERTS_CHANGED_CHANNEL
+
+# Alerts still needing attention; at most one per (device, rule), enforced by
+# the uq_alerts_open_device_rule partial index whose predicate is ACTIVE_ALERT_PREDICATE
+ACTIVE_ALERT_STATUSES = [AlertStatus.OPEN, AlertStatus.ACKNOWLEDGED]
+ACTIVE_ALERT_PREDICATE = "status IN ('open', 'acknowledged')"
+
+# Which statuses each bulk action may move an alert out of, and where it lands.
+BULK_TRANSITIONS = {
+    "archive": (
+        [AlertStatus.OPEN, AlertStatus.ACKNOWLEDGED, AlertStatus.RESOLVED, AlertStatus.AUTO_FIXED],
+        AlertStatus.ARCHIVED,
+    ),
+    "resolve": ([AlertStatus.OPEN, AlertStatus.ACKNOWLEDGED], AlertStatus.RESOLVED),
+    "acknowledge": ([AlertStatus.OPEN], AlertStatus.ACKNOWLEDGED),
+}
+
+def is_global_actor(actor) -> bool:
+    """Super admins and org-less (global) API keys can see every organization."""
+    if isinstance(actor, User) and actor.role == UserRole.SUPER_ADMIN:
+        return True
+    if isinstance(actor, APIKey) and not actor.organization_id:
+        return True
+    return False
+
+def scope_alerts(stmt, actor):
+    """Restrict an Alert select/update to devices in the actor's organization."""
+    if is_global_actor(actor):
+        return stmt
+    org_devices = select(Device.id).join(Site).where(Site.organization_id == actor.organization_id)
+    return stmt.where(Alert.device_id.in_(org_devices))
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Alerts are stored as naive UTC; normalise aware query params to match."""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def filter_alerts(stmt, device_id=None, severity=None, rule_name=None, since=None, until=None):
+    """Apply the optional alert filters shared by listing and bulk endpoints."""
+    if device_id:
+        stmt = stmt.where(Alert.device_id == device_id)
+    if severity:
+        stmt = stmt.where(Alert.severity == severity)
+    if rule_name:
+        stmt = stmt.where(Alert.rule_name == rule_name)
+    if since:
+        stmt = stmt.where(Alert.created_at >= naive_utc(since))
+    if until:
+        stmt = stmt.where(Alert.created_at <= naive_utc(until))
+    return stmt
+
+async def bulk_transition_alerts(
+    db: AsyncSession,
+    actor,
+    action: str,
+    alert_ids=None,
+    **filters,
+) -> int:
+    """
+    Move every matching alert to the action's target status in one
+    UPDATE ... WHERE statement, commit, and emit a single change event.
+    Returns the number of rows updated.
+    """
+    from_statuses, to_status = BULK_TRANSITIONS[action]
+
+    values = {"status": to_status}
+    if to_status == AlertStatus.RESOLVED:
+        values["resolved_at"] = datetime.utcnow()
+
+    stmt = update(Alert).where(Alert.status.in_(from_statuses))
+    stmt = filter_alerts(scope_alerts(stmt, actor), **filters)
+    if alert_ids:
+        stmt = stmt.where(Alert.id.in_(alert_ids))
+    stmt = stmt.values(**values).execution_options(synchronize_session=False)
+
+    result = await db.execute(stmt)
+    await db.commit()
+
+    count = result.rowcount or 0
+    if count:
+        await publish_event(ALERTS_CHANGED_CHANNEL, {
+            "organization_id": getattr(actor, "organization_id", None),
+            "action": action,
+            "status": to_status.value,
+            "count": count,
+        })
+    return count
+
+async def upsert_open_alerts(db: AsyncSession, alerts: List[dict]) -> List[Alert]:
+    """
+    Open alerts idempotently in a single INSERT ... ON CONFLICT statement.
+
+    Each dict needs device_id, rule_name, severity and message, and may carry
+    a confidence score. If an open or acknowledged alert already exists for
+    the same (device_id, rule_name) - enforced by the uq_alerts_open_device_rule
+    partial index - its occurrence_count is bumped and last_seen_at, message,
+    severity and confidence are refreshed instead of adding a row (an
+    acknowledged alert stays acknowledged). The caller commits.
+    """
+    if not alerts:
+        return []
+
+    now = datetime.utcnow()
+    rows = {}
+    for a in alerts:
+        # A row may only be hit once per statement, so collapse in-batch repeats
+        rows[(a["device_id"], a["rule_name"])] = {
+            "id": uuid.uuid4(),
+            "device_id": a["device_id"],
+            "rule_name": a["rule_name"],
+            "severity": AlertSeverity(a["severity"]).value,
+            "message": a["message"],
+            "status": AlertStatus.OPEN.value,
+            "created_at": now,
+            "last_seen_at": now,
+            "occurrence_count": 1,
+            "confidence": a.get("confidence"),
+        }
+
+    stmt = pg_insert(Alert).values(list(rows.values()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Alert.device_id, Alert.rule_name],
+        # Literal predicate so Postgres can infer the partial unique index
+        index_where=text(ACTIVE_ALERT_PREDICATE),
+        set_={
+            "occurrence_count": Alert.occurrence_count + 1,
+            "last_seen_at": stmt.excluded.last_seen_at,
+            "message": stmt.excluded.message,
+            "severity": stmt.excluded.severity,
+            "confidence": stmt.excluded.confidence,
+        },
+    ).returning(Alert)
+
+    result = await db.execute(
+        select(Alert).from_statement(stmt).execution_options(populate_existing=True)
+    )
+    return list(result.scalars().all())
+
+async def resolve_open_alerts(db: AsyncSession, pairs: List[Tuple]) -> int:
+    """
+    Resolve the open or acknowledged alerts for the given (device_id, rule_name) pairs in one
+    UPDATE. Returns the number of alerts resolved. The caller commits.
+    """
+    if not pairs:
+        return 0
+    stmt = (
+        update(Alert)
+        .where(
+            Alert.status.in_(ACTIVE_ALERT_STATUSES),
+            tuple_(Alert.device_id, Alert.rule_name).in_(list(set(pairs))),
+        )
+        .values(status=AlertStatus.RESOLVED, resolved_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    result = await db.execute(stmt)
+    return result.rowcount or 0
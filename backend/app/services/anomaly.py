@@ -0,0 +1,243 @@
+"""
+Statistical anomaly detection over metric windows.
+
+Each tick pulls the recent window for every (device, metric_type) series in
+one grouped query, plus the same time-of-day window from previous days as a
+seasonal baseline, and scores the whole fleet at once with NumPy over arrays
+shaped (series, time). Three detectors vote:
+
+- window z-score: latest bucket against the mean/std of the rest of the window
+- EWMA deviation: latest bucket against the smoothed level of the window
+- seasonal z-score: latest bucket against the same time of day on earlier days
+
+Series flagged by at least two detectors become "Anomaly: <metric_type>"
+alerts with a confidence score; series that score normally again resolve them.
+A series with only one usable detector (e.g. seasonal history but too few
+recent buckets) is never flagged on that detector alone.
+"""
+import logging
+import math
+import time
+import warnings
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+import numpy as np
+from sqlalchemy import select, func, literal
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.events import publish_event, ALERTS_CHANGED_CHANNEL
+from app.models import Metric, Device, AlertSeverity
+from app.services.alerts import upsert_open_alerts, resolve_open_alerts
+from app.core.metrics import timed_job
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_LOCK_ID = 0x4E470002
+ANOMALY_RULE_PREFIX = "Anomaly: "
+
+def anomaly_rule_name(metric_type: str) -> str:
+    return f"{ANOMALY_RULE_PREFIX}{metric_type}"
+
+def ewma_rows(window: np.ndarray, alpha: float) -> np.ndarray:
+    """Row-wise EWMA over the time axis, carrying the level across NaN gaps."""
+    level = np.full(window.shape[0], np.nan)
+    for t in range(window.shape[1]):
+        col = window[:, t]
+        level = np.where(
+            np.isnan(level), col,
+            np.where(np.isnan(col), level, alpha * col + (1 - alpha) * level),
+        )
+    return level
+
+def score_windows(window: np.ndarray, seasonal: np.ndarray, alpha: float, z_threshold: float) -> Dict[str, np.ndarray]:
+    """
+    Score every series at once.
+
+    window is (series, buckets) of recent bucket means, seasonal is
+    (series, days) of same-time-of-day means from earlier days; both use NaN
+    for missing data. Returns per-series arrays: current, last_idx, baseline,
+    score (largest |z|), votes, available and flagged.
+    """
+    n, t = window.shape
+    rows = np.arange(n)
+    observed = ~np.isnan(window)
+    has_data = observed.any(axis=1)
+    last_idx = t - 1 - np.argmax(observed[:, ::-1], axis=1)
+    current = window[rows, last_idx]
+
+    # History is the window without the bucket being scored
+    history = window.copy()
+    history[rows, last_idx] = np.nan
+
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        hist_count = (~np.isnan(history)).sum(axis=1)
+        mean = np.nanmean(history, axis=1)
+        # Floor the spread so flat series don't turn tiny wiggles into huge z-scores
+        std = np.maximum(np.nanstd(history, axis=1), 0.1 * np.abs(mean))
+        std = np.where(std > 0, std, np.nan)
+        level = ewma_rows(history, alpha)
+
+        season_count = (~np.isnan(seasonal)).sum(axis=1)
+        season_mean = np.nanmean(seasonal, axis=1) if seasonal.shape[1] else np.full(n, np.nan)
+        season_std = np.maximum(np.nanstd(seasonal, axis=1), 0.1 * np.abs(season_mean)) if seasonal.shape[1] else np.full(n, np.nan)
+        season_std = np.where(season_std > 0, season_std, np.nan)
+
+        enough_history = hist_count >= settings.ANOMALY_MIN_POINTS
+        enough_seasons = season_count >= settings.ANOMALY_MIN_SEASONS
+        z_window = np.where(enough_history, (current - mean) / std, np.nan)
+        z_ewma = np.where(enough_history, (current - level) / std, np.nan)
+        z_season = np.where(enough_seasons, (current - season_mean) / season_std, np.nan)
+
+    z = np.abs(np.vstack([z_window, z_ewma, z_season]))
+    available = (~np.isnan(z)).sum(axis=0)
+    votes = (np.nan_to_num(z, nan=0.0) >= z_threshold).sum(axis=0)
+    score = np.nan_to_num(z, nan=0.0).max(axis=0)
+    flagged = has_data & (votes >= 2)
+    baseline = np.where(enough_seasons, season_mean, level)
+
+    return {
+        "current": current,
+        "last_idx": last_idx,
+        "baseline": baseline,
+        "score": score,
+        "votes": votes,
+        "available": available,
+        "has_data": has_data,
+        "flagged": flagged,
+    }
+
+def anomaly_confidence(score: float, votes: int, available: int) -> float:
+    """Two-sided normal mass inside |z|, weighted by detector agreement."""
+    if not available:
+        return 0.0
+    return round(math.erf(score / math.sqrt(2)) * votes / available, 4)
+
+def _bucket(column, seconds: int):
+    return func.floor(func.extract("epoch", column) / seconds)
+
+async def _fetch_window(db: AsyncSession, now: datetime, metric_types: List[str]):
+    bucket_seconds = settings.ANOMALY_BUCKET_SECONDS
+    start = now - timedelta(seconds=settings.ANOMALY_WINDOW_SECONDS)
+    bucket = _bucket(Metric.time, bucket_seconds).label("bucket")
+    stmt = (
+        select(Metric.device_id, Metric.metric_type, bucket, func.avg(Metric.value).label("value"))
+        .join(Device, Device.id == Metric.device_id)
+        .where(
+            Device.is_active == True,
+            Metric.metric_type.in_(metric_types),
+            Metric.time >= start,
+            Metric.time <= now,
+        )
+        .group_by(Metric.device_id, Metric.metric_type, bucket)
+    )
+    return (await db.execute(stmt)).all()
+
+async def _fetch_seasonal(db: AsyncSession, now: datetime, metric_types: List[str]):
+    """Mean of the same time-of-day window on each of the previous ANOMALY_SEASON_DAYS days."""
+    window = settings.ANOMALY_WINDOW_SECONDS
+    days = settings.ANOMALY_SEASON_DAYS
+    age = func.extract("epoch", literal(now) - Metric.time)
+    days_ago = func.floor(age / 86400).label("days_ago")
+    stmt = (
+        select(Metric.device_id, Metric.metric_type, days_ago, func.avg(Metric.value).label("value"))
+        .join(Device, Device.id == Metric.device_id)
+        .where(
+            Device.is_active == True,
+            Metric.metric_type.in_(metric_types),
+            Metric.time >= now - timedelta(days=days, seconds=window),
+            Metric.time <= now - timedelta(days=1),
+            age - func.floor(age / 86400) * 86400 < window,
+        )
+        .group_by(Metric.device_id, Metric.metric_type, days_ago)
+    )
+    return (await db.execute(stmt)).all()
+
+@timed_job("anomaly_detection")
+async def detect_anomalies(db: AsyncSession) -> dict:
+    """Score every active series, open/refresh anomaly alerts and resolve recovered ones."""
+    locked = await db.scalar(select(func.pg_try_advisory_xact_lock(ANOMALY_LOCK_ID)))
+    if not locked:
+        return {"status": "skipped", "series": 0, "anomalies": 0, "opened": 0, "resolved": 0, "elapsed_ms": 0.0}
+
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    metric_types = settings.ANOMALY_METRIC_TYPES_LIST
+    window_rows = await _fetch_window(db, now, metric_types)
+    seasonal_rows = await _fetch_seasonal(db, now, metric_types)
+
+    bucket_seconds = settings.ANOMALY_BUCKET_SECONDS
+    n_buckets = max(settings.ANOMALY_WINDOW_SECONDS // bucket_seconds, 1) + 1
+    # Postgres reads naive timestamps as UTC when extracting the epoch
+    first_bucket = math.floor(now.replace(tzinfo=timezone.utc).timestamp() / bucket_seconds) - n_buckets + 1
+    n_days = settings.ANOMALY_SEASON_DAYS
+
+    series: Dict[Tuple, int] = {}
+    for row in window_rows:
+        series.setdefault((row.device_id, row.metric_type), len(series))
+
+    window = np.full((len(series), n_buckets), np.nan)
+    seasonal = np.full((len(series), n_days), np.nan)
+    if series:
+        keys = [(r.device_id, r.metric_type) for r in window_rows]
+        idx = np.fromiter((series[k] for k in keys), dtype=np.int64, count=len(keys))
+        cols = np.array([int(r.bucket) - first_bucket for r in window_rows], dtype=np.int64)
+        vals = np.array([r.value for r in window_rows], dtype=np.float64)
+        keep = (cols >= 0) & (cols < n_buckets)
+        window[idx[keep], cols[keep]] = vals[keep]
+
+        season = [(series[(r.device_id, r.metric_type)], int(r.days_ago) - 1, r.value)
+                  for r in seasonal_rows if (r.device_id, r.metric_type) in series]
+        if season:
+            s_idx, s_day, s_val = (np.array(c) for c in zip(*season))
+            keep = (s_day >= 0) & (s_day < n_days)
+            seasonal[s_idx[keep], s_day[keep]] = s_val[keep]
+
+    scores = score_windows(window, seasonal, settings.ANOMALY_EWMA_ALPHA, settings.ANOMALY_Z_THRESHOLD)
+    # Series whose newest data is older than the rule lookback are stale, not anomalous
+    fresh_from = n_buckets - 1 - settings.RULE_EVAL_LOOKBACK_SECONDS // bucket_seconds
+    fresh = scores["has_data"] & (scores["last_idx"] >= fresh_from)
+
+    to_open = []
+    to_resolve = []
+    for (device_id, metric_type), i in series.items():
+        if not fresh[i]:
+            continue
+        rule_name = anomaly_rule_name(metric_type)
+        if not scores["flagged"][i]:
+            to_resolve.append((device_id, rule_name))
+            continue
+        score = float(scores["score"][i])
+        to_open.append({
+            "device_id": device_id,
+            "rule_name": rule_name,
+            "severity": AlertSeverity.CRITICAL if score >= 2 * settings.ANOMALY_Z_THRESHOLD else AlertSeverity.WARNING,
+            "message": (
+                f"{rule_name} is {scores['current'][i]:g}, expected ~{scores['baseline'][i]:.4g} "
+                f"(|z|={score:.1f}, {int(scores['votes'][i])}/{int(scores['available'][i])} detectors)"
+            ),
+            "confidence": anomaly_confidence(score, int(scores["votes"][i]), int(scores["available"][i])),
+        })
+
+    upserted = await upsert_open_alerts(db, to_open)
+    resolved = await resolve_open_alerts(db, to_resolve)
+    await db.commit()
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    opened = sum(1 for a in upserted if a.occurrence_count == 1)
+    if opened or resolved:
+        await publish_event(ALERTS_CHANGED_CHANNEL, {
+            "action": "anomaly_detection",
+            "opened": opened,
+            "resolved": resolved,
+        })
+        logger.info(f"Anomaly detection: {len(series)} series, {opened} opened, {resolved} resolved in {elapsed_ms}ms")
+
+    return {
+        "status": "success",
+        "series": len(series),
+        "anomalies": len(to_open),
+        "opened": opened,
+        "resolved": resolved,
+        "elapsed_ms": elapsed_ms,
+    }
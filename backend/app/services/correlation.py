@@ -0,0 +1,171 @@
+"""
+Site-level alert correlation.
+
+When a site's uplink fails every device behind it raises its own alert. Each
+correlation tick attaches uncorrelated open alerts to their site's active
+incident, or opens one new incident per site, and picks a single root-cause
+candidate. Fix agents then handle one incident per outage instead of one
+LLM call and SSH attempt per alert.
+"""
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, func, exists, distinct
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.events import publish_event, ALERTS_CHANGED_CHANNEL
+from app.models import Alert, AlertStatus, AlertSeverity, Device, Incident, IncidentStatus, Site
+from app.core.metrics import timed_job
+from app.services.alerts import ACTIVE_ALERT_STATUSES
+
+logger = logging.getLogger(__name__)
+
+CORRELATION_LOCK_ID = 0x4E470003
+OFFLINE_RULE = "Device Offline"
+SEVERITY_RANK = {AlertSeverity.CRITICAL.value: 3, AlertSeverity.WARNING.value: 2, AlertSeverity.INFO.value: 1}
+# Device types that sit upstream of the rest of a site and make better root-cause candidates
+UPSTREAM_DEVICE_TYPES = {"router", "gateway", "firewall"}
+
+def _root_rank(row):
+    """Most severe first, then upstream devices, then the earliest alert."""
+    return (
+        -SEVERITY_RANK.get(row.Alert.severity, 0),
+        0 if (row.device_type or "").lower() in UPSTREAM_DEVICE_TYPES else 1,
+        row.Alert.created_at,
+    )
+
+def _max_severity(*severities) -> str:
+    return max(severities, key=lambda s: SEVERITY_RANK.get(s, 0))
+
+@timed_job("correlation")
+async def correlate_alerts(db: AsyncSession) -> dict:
+    """Group open alerts into site incidents and resolve incidents with no active alerts left."""
+    locked = await db.scalar(select(func.pg_try_advisory_xact_lock(CORRELATION_LOCK_ID)))
+    if not locked:
+        return {"status": "skipped", "correlated": 0, "created": 0, "updated": 0, "resolved": 0}
+
+    now = datetime.utcnow()
+    result = await db.execute(
+        select(Alert, Device.name.label("device_name"), Device.device_type, Device.site_id, Site.name.label("site_name"))
+        .join(Device, Device.id == Alert.device_id)
+        .join(Site, Site.id == Device.site_id)
+        .where(Alert.incident_id.is_(None), Alert.status.in_(ACTIVE_ALERT_STATUSES))
+        .order_by(Alert.created_at)
+    )
+    by_site = defaultdict(list)
+    for row in result.all():
+        by_site[row.site_id].append(row)
+
+    created = updated = 0
+    touched = {}
+    if by_site:
+        # An open incident that saw activity within the window absorbs new alerts from its site
+        active = await db.execute(
+            select(Incident)
+            .where(
+                Incident.site_id.in_(list(by_site)),
+                Incident.status == IncidentStatus.OPEN,
+                Incident.updated_at >= now - timedelta(seconds=settings.CORRELATION_WINDOW_SECONDS),
+            )
+            .order_by(Incident.updated_at)
+        )
+        active_by_site = {i.site_id: i for i in active.scalars().all()}
+
+        for site_id, rows in by_site.items():
+            incident = active_by_site.get(site_id)
+            if incident is None:
+                root = min(rows, key=_root_rank)
+                incident = Incident(
+                    id=uuid.uuid4(),
+                    alert_id=root.Alert.id,
+                    site_id=site_id,
+                    status=IncidentStatus.OPEN,
+                    severity=root.Alert.severity,
+                    alert_count=0,
+                    root_cause=f"{root.Alert.rule_name} on {root.device_name}: {root.Alert.message}",
+                    created_at=now,
+                )
+                db.add(incident)
+                created += 1
+            else:
+                updated += 1
+            incident.alert_count += len(rows)
+            incident.severity = _max_severity(incident.severity, *(r.Alert.severity for r in rows))
+            incident.updated_at = now
+            touched[incident.id] = (incident, rows[0].site_name, [r.Alert.id for r in rows])
+
+        await db.flush()
+        for incident_id, (_, _, alert_ids) in touched.items():
+            await db.execute(
+                update(Alert)
+                .where(Alert.id.in_(alert_ids))
+                .values(incident_id=incident_id)
+                .execution_options(synchronize_session=False)
+            )
+
+        # Describe each touched incident from all of its members in one grouped query
+        stats = await db.execute(
+            select(
+                Alert.incident_id,
+                func.count(distinct(Alert.device_id)).label("devices"),
+                func.count(distinct(Alert.device_id)).filter(Alert.rule_name == OFFLINE_RULE).label("offline"),
+            )
+            .where(Alert.incident_id.in_(list(touched)))
+            .group_by(Alert.incident_id)
+        )
+        for row in stats.all():
+            incident, site_name, _ = touched[row.incident_id]
+            incident.summary = f"{site_name}: {incident.alert_count} alert(s) across {row.devices} device(s)"
+            if row.offline >= settings.CORRELATION_OUTAGE_MIN_DEVICES:
+                incident.root_cause = (
+                    f"{row.offline} devices at {site_name} went offline together; "
+                    "likely an upstream link or power failure"
+                )
+
+    resolved = await db.execute(
+        update(Incident)
+        .where(
+            Incident.status == IncidentStatus.OPEN,
+            ~exists().where(Alert.incident_id == Incident.id, Alert.status.in_(ACTIVE_ALERT_STATUSES)),
+        )
+        .values(status=IncidentStatus.RESOLVED, resolved_at=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    resolved_count = resolved.rowcount or 0
+    await db.commit()
+
+    correlated = sum(len(rows) for rows in by_site.values())
+    if created or updated or resolved_count:
+        await publish_event(ALERTS_CHANGED_CHANNEL, {
+            "action": "incident_correlation",
+            "created": created,
+            "updated": updated,
+            "resolved": resolved_count,
+        })
+        logger.info(f"Correlation: {correlated} alerts into {created} new / {updated} existing incidents, {resolved_count} resolved")
+
+    return {
+        "status": "success",
+        "correlated": correlated,
+        "created": created,
+        "updated": updated,
+        "resolved": resolved_count,
+    }
+
+async def resolve_incident(db: AsyncSession, incident: Incident, alert_status: AlertStatus) -> int:
+    """
+    Close an incident and move all of its still-active alerts to alert_status
+    in one UPDATE. Returns the number of alerts updated. The caller commits.
+    """
+    now = datetime.utcnow()
+    incident.status = IncidentStatus.RESOLVED
+    incident.resolved_at = now
+    incident.updated_at = now
+    result = await db.execute(
+        update(Alert)
+        .where(Alert.incident_id == incident.id, Alert.status.in_(ACTIVE_ALERT_STATUSES))
+        .values(status=alert_status, resolved_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount or 0
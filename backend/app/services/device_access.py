@@ -0,0 +1,87 @@
+"""
+Shared device lookup for routers that act on a single device.
+
+resolve_device() applies the usual visibility rule (global actors see every
+device, everyone else only devices in their organization's sites) and returns
+the device with its credentials already decrypted. Read paths are served from
+a per-process cache keyed by tenant and device id, so repeated hotspot calls
+skip both the query and the Fernet decrypt. Writers load an attached instance
+with for_update=True and call invalidate_device() once they have committed.
+"""
+import copy
+from uuid import UUID
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from app.core.cache import TTLCache, register_cache, invalidate
+from app.core.config import settings
+from app.models import Device, Site
+from app.models.core import decrypt_device_secrets
+from app.services.alerts import is_global_actor
+from app.services.routeros_sessions import ROUTEROS_SESSIONS
+
+DEVICE_CACHE = "devices"
+# Tenant part of the cache key for actors that can see every organization
+GLOBAL_TENANT = "*"
+
+_device_cache = register_cache(DEVICE_CACHE, TTLCache(settings.DEVICE_CACHE_TTL_SECONDS))
+_device_columns = [c.key for c in Device.__table__.columns]
+
+def _cache_key(tenant, device_id) -> str:
+    # Strings so the key survives the JSON round trip through Redis
+    return f"{tenant}:{device_id}"
+
+def _parse_device_id(device_id) -> UUID:
+    if isinstance(device_id, UUID):
+        return device_id
+    try:
+        return UUID(str(device_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Device not found")
+
+async def resolve_device(db: AsyncSession, actor, device_id, for_update: bool = False) -> Device:
+    """
+    Return the device if the actor may access it, otherwise raise 404.
+
+    By default the result is a transient Device (not attached to the session)
+    with decrypted secrets; callers must not modify or add it. With
+    for_update=True the device is loaded from the database as an attached
+    instance (site eagerly loaded, secrets still encrypted) for callers that
+    change or delete it.
+    """
+    device_uuid = _parse_device_id(device_id)
+    tenant = GLOBAL_TENANT if is_global_actor(actor) else actor.organization_id
+
+    if not for_update:
+        snapshot = _device_cache.get(_cache_key(tenant, device_uuid))
+        if snapshot is not None:
+            # voucher_template is mutable JSON; callers get their own copy
+            return Device(**{**snapshot, "voucher_template": copy.deepcopy(snapshot["voucher_template"])})
+
+    query = select(Device).join(Site).where(Device.id == device_uuid).options(joinedload(Device.site))
+    if tenant != GLOBAL_TENANT:
+        query = query.where(Site.organization_id == tenant)
+    result = await db.execute(query)
+    device = result.scalars().first()
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+    if for_update:
+        return device
+
+    decrypt_device_secrets(device)
+    snapshot = {key: getattr(device, key) for key in _device_columns}
+    snapshot["voucher_template"] = copy.deepcopy(device.voucher_template)
+    _device_cache.set(_cache_key(tenant, device_uuid), snapshot)
+    # Detach so the decrypted values can never be flushed back
+    db.expunge(device)
+    return device
+
+async def invalidate_device(device_id, organization_id) -> None:
+    """Drop a device from every worker's cache (and its RouterOS sessions) after it was updated or deleted."""
+    device_id = _parse_device_id(device_id)
+    await invalidate(DEVICE_CACHE, _cache_key(GLOBAL_TENANT, device_id))
+    if organization_id:
+        await invalidate(DEVICE_CACHE, _cache_key(organization_id, device_id))
+    # Sessions may be logged in with credentials that just changed
+    await invalidate(ROUTEROS_SESSIONS, str(device_id))
@@ -0,0 +1,275 @@
+"""
+Live table of active hotspot sessions, kept current by following the router.
+
+Instead of printing /ip/hotspot/active on every page load and poll, one
+worker per router holds a /ip/hotspot/active/listen open and applies each
+add, change and removal to a Redis hash (hotspot:active:<device_id>, keyed
+by session .id). Session counts and lists read from that hash are current to
+within a second, in every worker.
+
+Routers are only followed while someone looks at them: reads record the
+device in hotspot:active:wanted, and followers stop once a device has not
+been read for HOTSPOT_ACTIVE_IDLE_SECONDS. Which worker follows a router is
+decided by a Redis SET NX leader key that the holder keeps renewing. While
+no follower is live (first view, router unreachable, Redis down) reads fall
+back to printing the table from the router.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+from uuid import uuid4
+from sqlalchemy import select
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.redis import get_redis
+from app.models import Device
+from app.models.core import decrypt_device_secrets
+from app.services.routeros import RouterOSClient, parse_routeros_time, format_routeros_time
+from app.services.routeros_sessions import device_session, routeros_port
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_PATH = "/ip/hotspot/active"
+WANTED_KEY = "hotspot:active:wanted"
+# Seconds a router's hash may go without a confirmed follower before readers stop trusting it
+LIVE_TTL_FACTOR = 3
+RECONNECT_BACKOFF_SECONDS = (1, 5, 15, 30, 60)
+
+# Renew the leader key only if this worker still holds it
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+def active_key(device_id) -> str:
+    return f"hotspot:active:{device_id}"
+
+def live_key(device_id) -> str:
+    return f"hotspot:active:{device_id}:live"
+
+def leader_key(device_id) -> str:
+    return f"hotspot:active:{device_id}:leader"
+
+def _live_ttl() -> int:
+    return int(settings.HOTSPOT_ACTIVE_KEEPALIVE_SECONDS * LIVE_TTL_FACTOR) + 1
+
+def _restore(payload: str, now: float) -> Dict[str, str]:
+    """Stored session in /ip/hotspot/active/print shape, with uptime advanced to now."""
+    session = json.loads(payload)
+    seen = session.pop("_seen", now)
+    if session.get("uptime"):
+        session["uptime"] = format_routeros_time(parse_routeros_time(session["uptime"]) + int(now - seen))
+    return session
+
+async def active_sessions(device: Device) -> List[Dict[str, str]]:
+    """Active sessions of a (decrypted) device, from the live table when one is being followed."""
+    device_id = str(device.id)
+    now = time.time()
+    try:
+        redis = get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(WANTED_KEY, {device_id: now})
+            pipe.exists(live_key(device_id))
+            pipe.hvals(active_key(device_id))
+            _, live, payloads = await pipe.execute()
+        if live:
+            return [_restore(payload, now) for payload in payloads]
+    except Exception as e:
+        logger.debug(f"Live hotspot sessions unavailable for {device_id}: {e}")
+
+    async with device_session(device) as api:
+        return await api.get(ACTIVE_PATH)
+
+async def forget_session(device_id, session_id: str) -> None:
+    """Drop a kicked session right away rather than waiting for the router's event."""
+    try:
+        await get_redis().hdel(active_key(device_id), session_id)
+    except Exception as e:
+        logger.debug(f"Could not drop hotspot session {session_id}: {e}")
+
+class _Follower:
+    """Follows one router's active table into Redis until cancelled."""
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.sessions: Dict[str, Dict[str, str]] = {}
+
+    async def _load_device(self) -> Optional[Device]:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(Device).where(Device.id == self.device_id))
+            device = result.scalars().first()
+            if device is None:
+                return None
+            # Detach before decrypting so the plaintext can never be flushed
+            db.expunge(device)
+            return decrypt_device_secrets(device)
+
+    async def _apply(self, events: List[Dict[str, str]]) -> None:
+        redis = get_redis()
+        now = time.time()
+        changed, removed = {}, []
+        for event in events:
+            session_id = event.get(".id")
+            if not session_id:
+                continue
+            if event.get(".dead") in ("true", "yes"):
+                self.sessions.pop(session_id, None)
+                changed.pop(session_id, None)
+                removed.append(session_id)
+            else:
+                # Change events may carry only the properties that changed
+                session = {**self.sessions.get(session_id, {}), **event, "_seen": now}
+                self.sessions[session_id] = session
+                changed[session_id] = json.dumps(session)
+        async with redis.pipeline(transaction=True) as pipe:
+            if removed:
+                pipe.hdel(active_key(self.device_id), *removed)
+            if changed:
+                pipe.hset(active_key(self.device_id), mapping=changed)
+            await pipe.execute()
+
+    async def _publish_snapshot(self, rows: List[Dict[str, str]]) -> None:
+        now = time.time()
+        self.sessions = {row[".id"]: {**row, "_seen": now} for row in rows if row.get(".id")}
+        async with get_redis().pipeline(transaction=True) as pipe:
+            pipe.delete(active_key(self.device_id))
+            if self.sessions:
+                pipe.hset(active_key(self.device_id), mapping={k: json.dumps(v) for k, v in self.sessions.items()})
+            pipe.set(live_key(self.device_id), "1", ex=_live_ttl())
+            await pipe.execute()
+
+    async def _follow_once(self, device: Device) -> None:
+        client = RouterOSClient(device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', routeros_port(device))
+        await client.connect()
+        queue: asyncio.Queue = asyncio.Queue()
+        started = asyncio.Event()
+
+        async def pump():
+            async for event in client.listen(ACTIVE_PATH, settings.HOTSPOT_ACTIVE_KEEPALIVE_SECONDS, started):
+                queue.put_nowait(event)
+
+        listener = asyncio.create_task(pump())
+        try:
+            # Snapshot only once the listen is in place; events arriving meanwhile are replayed on top of it
+            waiter = asyncio.ensure_future(started.wait())
+            await asyncio.wait({listener, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+            if listener.done():
+                listener.result()
+                return
+            async with device_session(device) as api:
+                rows = await api.get(ACTIVE_PATH)
+            await self._publish_snapshot(rows)
+            logger.info(f"Following hotspot sessions of device {self.device_id} ({len(rows)} active)")
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, listener}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    listener.result()  # Re-raises why the listen ended
+                    return
+                events = [getter.result()]
+                while not queue.empty():
+                    events.append(queue.get_nowait())
+                await self._apply(events)
+        finally:
+            listener.cancel()
+            client.abort()
+
+    async def run(self) -> None:
+        failures = 0
+        while True:
+            started = time.monotonic()
+            try:
+                device = await self._load_device()
+                if device is None:
+                    return
+                await self._follow_once(device)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Hotspot session follower for device {self.device_id} failed: {e}")
+            try:
+                # Readers go back to the router until the follow is re-established
+                await get_redis().delete(live_key(self.device_id))
+            except Exception:
+                pass
+            # A follow that lasted a while earns a quick reconnect
+            if time.monotonic() - started > 60:
+                failures = 0
+            await asyncio.sleep(RECONNECT_BACKOFF_SECONDS[min(failures, len(RECONNECT_BACKOFF_SECONDS) - 1)])
+            failures += 1
+
+class HotspotActiveTracker:
+    """Starts and stops followers for the routers this worker leads."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._followers: Dict[str, asyncio.Task] = {}
+        self._token = f"{os.getpid()}:{uuid4().hex}"
+
+    async def _stop_follower(self, device_id: str) -> None:
+        task = self._followers.pop(device_id, None)
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        try:
+            # Only clean up while still the leader; otherwise the table belongs to the new one
+            redis = get_redis()
+            if await redis.get(leader_key(device_id)) == self._token:
+                await redis.delete(live_key(device_id), active_key(device_id), leader_key(device_id))
+        except Exception:
+            pass
+
+    async def reconcile(self) -> None:
+        """Follow wanted routers this worker can lead, renew its leases and drop the rest."""
+        redis = get_redis()
+        now = time.time()
+        await redis.zremrangebyscore(WANTED_KEY, "-inf", now - settings.HOTSPOT_ACTIVE_IDLE_SECONDS)
+        wanted = set(await redis.zrange(WANTED_KEY, 0, -1))
+        ttl = _live_ttl()
+
+        for device_id, task in list(self._followers.items()):
+            renewed = await redis.eval(_RENEW_SCRIPT, 1, leader_key(device_id), self._token, ttl)
+            if task.done() or device_id not in wanted or not renewed:
+                await self._stop_follower(device_id)
+            else:
+                # The follower is running, so its table stays trustworthy
+                await redis.expire(live_key(device_id), ttl)
+
+        for device_id in wanted - set(self._followers):
+            if await redis.set(leader_key(device_id), self._token, nx=True, ex=ttl):
+                self._followers[device_id] = asyncio.create_task(_Follower(device_id).run())
+
+    async def _run(self):
+        interval = max(1.0, settings.HOTSPOT_ACTIVE_KEEPALIVE_SECONDS / LIVE_TTL_FACTOR)
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning(f"Hotspot session tracker failed: {e}")
+            await asyncio.sleep(interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for device_id in list(self._followers):
+            await self._stop_follower(device_id)
+
+hotspot_active = HotspotActiveTracker()
@@ -0,0 +1,249 @@
+"""
+Local mirror of each router's hotspot user table.
+
+The hotspot pages used to download the full /ip/hotspot/user table over the
+VPN on every view. Instead the table is mirrored into hotspot_users and read
+from Postgres, with filtering, sorting and paging done in SQL.
+
+RouterOS has no change feed for hotspot users, so a sync still reads the
+table (restricted to the mirrored properties), but only rows whose values
+changed are written and vanished users are deleted. Devices are synced the
+first time their users are read and then kept fresh in the background every
+HOTSPOT_SYNC_INTERVAL_SECONDS, but only while someone is looking: each read
+stamps the device in hotspot:users:wanted, and devices unread for
+HOTSPOT_SYNC_IDLE_SECONDS drop out of the refresh (their next read serves
+the stale mirror with X-Data-Stale until it is refreshed). Writes made
+through the API (create, delete, batch generate) update the mirror
+immediately. Responses carry the sync time so the UI can show how fresh the
+data is.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import select, delete, func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.redis import get_redis
+from app.core.metrics import timed_job
+from app.models import Device, HotspotUserRecord, HotspotSyncState
+from app.models.core import decrypt_device_secrets
+from app.services.routeros import RouterOSError, parse_routeros_time
+from app.services.routeros_sessions import device_session
+
+logger = logging.getLogger(__name__)
+
+USERS_RESOURCE = "users"
+# Sorted set of device id -> last time its mirrored users were read
+WANTED_KEY = "hotspot:users:wanted"
+# Second key of pg_try_advisory_xact_lock(HOTSPOT_SYNC_LOCK_ID, hashtext(device_id))
+HOTSPOT_SYNC_LOCK_ID = 0x4E470006
+USER_PROPERTIES = [
+    ".id", "name", "password", "profile", "uptime", "bytes-in", "bytes-out",
+    "limit-uptime", "limit-bytes-total", "comment", "disabled",
+]
+# asyncpg allows 32767 bind parameters per statement
+UPSERT_CHUNK = 1000
+
+def _to_int(value, default=0):
+    try:
+        return int(value) if value not in (None, "") else default
+    except (TypeError, ValueError):
+        return default
+
+def user_row(device_id, user: Dict[str, str], now: datetime) -> dict:
+    """Mirror row for one /ip/hotspot/user entry."""
+    digest = hashlib.md5("\x1f".join(user.get(p) or "" for p in USER_PROPERTIES).encode()).hexdigest()
+    return {
+        "device_id": device_id,
+        "router_id": user.get(".id"),
+        "name": user.get("name") or "",
+        "password": user.get("password"),
+        "profile": user.get("profile"),
+        "uptime": user.get("uptime"),
+        "uptime_sec": parse_routeros_time(user.get("uptime")),
+        "bytes_in": _to_int(user.get("bytes-in")),
+        "bytes_out": _to_int(user.get("bytes-out")),
+        "limit_uptime": user.get("limit-uptime"),
+        "limit_bytes_total": _to_int(user.get("limit-bytes-total"), None),
+        "comment": user.get("comment"),
+        "disabled": user.get("disabled") == "true",
+        "row_hash": digest,
+        "synced_at": now,
+    }
+
+async def upsert_users(db: AsyncSession, device_id, users: Iterable[Dict[str, str]]) -> int:
+    """Write router user entries (keyed by .id) into the mirror; the caller commits."""
+    now = datetime.utcnow()
+    rows = [user_row(device_id, u, now) for u in users if u.get(".id")]
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        stmt = insert(HotspotUserRecord).values(rows[start:start + UPSERT_CHUNK])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_hotspot_users_device_router",
+            set_={c: stmt.excluded[c] for c in rows[0] if c not in ("device_id", "router_id")},
+        )
+        await db.execute(stmt)
+    return len(rows)
+
+async def remove_users(db: AsyncSession, device_id, router_ids: List[str]) -> None:
+    """Drop mirrored users by RouterOS .id; the caller commits."""
+    for start in range(0, len(router_ids), UPSERT_CHUNK):
+        await db.execute(delete(HotspotUserRecord).where(
+            HotspotUserRecord.device_id == device_id,
+            HotspotUserRecord.router_id.in_(router_ids[start:start + UPSERT_CHUNK]),
+        ))
+
+async def save_sync_state(db: AsyncSession, device_id, resource: str, **values) -> None:
+    """Upsert a device's sync bookkeeping for one resource; the caller commits."""
+    stmt = insert(HotspotSyncState).values(device_id=device_id, resource=resource, **values)
+    await db.execute(stmt.on_conflict_do_update(index_elements=["device_id", "resource"], set_=values))
+
+def is_due(state: Optional[HotspotSyncState], due_before: datetime) -> bool:
+    """Not synced or attempted since due_before; failing devices wait a full interval between attempts."""
+    return state is None or (
+        (state.last_synced_at is None or state.last_synced_at < due_before)
+        and (state.last_attempt_at is None or state.last_attempt_at < due_before)
+    )
+
+@timed_job("hotspot_user_sync")
+async def sync_device_users(db: AsyncSession, device: Device, due_before: Optional[datetime] = None) -> dict:
+    """
+    Refresh one device's mirror from the router. Raises RouterOSError if it
+    is unreachable. With due_before, skips devices another worker has synced
+    or attempted since then.
+    """
+    locked = await db.scalar(select(func.pg_try_advisory_xact_lock(HOTSPOT_SYNC_LOCK_ID, func.hashtext(str(device.id)))))
+    if not locked:
+        # Another worker is syncing this device right now
+        return {"status": "skipped"}
+    # Every worker builds the same due list, so re-check under the lock
+    if due_before is not None and not is_due(await get_sync_state(db, device.id), due_before):
+        await db.rollback()
+        return {"status": "skipped"}
+
+    now = datetime.utcnow()
+    try:
+        async with device_session(device) as api:
+            users = await api.get('/ip/hotspot/user', proplist=USER_PROPERTIES)
+    except RouterOSError as e:
+        await db.rollback()
+        await save_sync_state(db, device.id, USERS_RESOURCE, last_attempt_at=now, last_error=str(e)[:500])
+        await db.commit()
+        raise
+
+    result = await db.execute(
+        select(HotspotUserRecord.router_id, HotspotUserRecord.row_hash).where(HotspotUserRecord.device_id == device.id)
+    )
+    known = dict(result.all())
+    changed = [u for u in users if u.get(".id") and known.get(u[".id"]) != user_row(device.id, u, now)["row_hash"]]
+    seen = {u.get(".id") for u in users}
+    gone = [router_id for router_id in known if router_id not in seen]
+
+    await upsert_users(db, device.id, changed)
+    await remove_users(db, device.id, gone)
+    await save_sync_state(db, device.id, USERS_RESOURCE, last_synced_at=now, last_attempt_at=now, last_error=None, row_count=len(users))
+    await db.commit()
+    return {"status": "ok", "rows": len(users), "changed": len(changed), "removed": len(gone)}
+
+async def get_sync_state(db: AsyncSession, device_id, resource: str = USERS_RESOURCE) -> Optional[HotspotSyncState]:
+    result = await db.execute(select(HotspotSyncState).where(
+        HotspotSyncState.device_id == device_id, HotspotSyncState.resource == resource,
+    ))
+    return result.scalars().first()
+
+async def ensure_users_mirror(db: AsyncSession, device: Device, refresh: bool = False) -> Optional[HotspotSyncState]:
+    """
+    Sync state for reading the mirror. Syncs inline on first use (or when
+    refresh is requested); otherwise the background refresher keeps it current.
+    """
+    try:
+        await get_redis().zadd(WANTED_KEY, {str(device.id): time.time()})
+    except Exception as e:
+        logger.debug(f"Could not mark hotspot users of {device.id} as wanted: {e}")
+    state = await get_sync_state(db, device.id)
+    if refresh or state is None or state.last_synced_at is None:
+        await sync_device_users(db, device)
+        db.expire_all()
+        state = await get_sync_state(db, device.id)
+    return state
+
+def staleness_headers(state: Optional[HotspotSyncState], interval: Optional[int] = None) -> Dict[str, str]:
+    """X-Data-* headers describing how fresh synced data is; stale past two sync intervals or after a failed attempt."""
+    if state is None or state.last_synced_at is None:
+        return {"X-Data-Stale": "true"}
+    age = max(0, int((datetime.utcnow() - state.last_synced_at).total_seconds()))
+    stale = age > 2 * (interval or settings.HOTSPOT_SYNC_INTERVAL_SECONDS) or (
+        state.last_error is not None and state.last_attempt_at and state.last_attempt_at > state.last_synced_at
+    )
+    return {
+        "X-Data-Synced-At": state.last_synced_at.isoformat(),
+        "X-Data-Age-Seconds": str(age),
+        "X-Data-Stale": "true" if stale else "false",
+    }
+
+class HotspotMirrorRefresher:
+    """Background task re-syncing recently read devices once their data is older than the interval."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    async def _sync_one(self, device_id, due_before: datetime, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                async with AsyncSessionLocal() as db:
+                    device = (await db.execute(select(Device).where(Device.id == device_id))).scalars().first()
+                    if device is None:
+                        return
+                    # Detach before decrypting so the plaintext can never be flushed
+                    db.expunge(device)
+                    decrypt_device_secrets(device)
+                    await sync_device_users(db, device, due_before)
+            except Exception as e:
+                logger.warning(f"Hotspot user sync failed for device {device_id}: {e}")
+
+    async def refresh_due(self) -> int:
+        """Sync every recently read device that is due; failing devices wait a full interval between attempts."""
+        redis = get_redis()
+        await redis.zremrangebyscore(WANTED_KEY, "-inf", time.time() - settings.HOTSPOT_SYNC_IDLE_SECONDS)
+        wanted = [uuid.UUID(device_id) for device_id in await redis.zrange(WANTED_KEY, 0, -1)]
+        if not wanted:
+            return 0
+        due_before = datetime.utcnow() - timedelta(seconds=settings.HOTSPOT_SYNC_INTERVAL_SECONDS)
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(HotspotSyncState.device_id).where(
+                HotspotSyncState.resource == USERS_RESOURCE,
+                HotspotSyncState.device_id.in_(wanted),
+                or_(HotspotSyncState.last_synced_at.is_(None), HotspotSyncState.last_synced_at < due_before),
+                or_(HotspotSyncState.last_attempt_at.is_(None), HotspotSyncState.last_attempt_at < due_before),
+            ))
+            device_ids = result.scalars().all()
+        semaphore = asyncio.Semaphore(settings.HOTSPOT_SYNC_CONCURRENCY)
+        await asyncio.gather(*(self._sync_one(device_id, due_before, semaphore) for device_id in device_ids))
+        return len(device_ids)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(min(settings.HOTSPOT_SYNC_INTERVAL_SECONDS, 15))
+            try:
+                await self.refresh_due()
+            except Exception as e:
+                logger.warning(f"Hotspot mirror refresh failed: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+hotspot_mirror = HotspotMirrorRefresher()
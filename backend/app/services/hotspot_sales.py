@@ -0,0 +1,341 @@
+"""
+Record used hotspot vouchers as sales.
+
+A voucher counts as sold once it has uptime. Sales are derived from the
+hotspot user mirror rather than a second full download: mirror rows are only
+rewritten when their values change, so their synced_at doubles as a
+high-watermark and each run only looks at vouchers that changed since the
+previous one. Usernames already recorded are loaded in one query and new
+sales go in as a bulk INSERT ... ON CONFLICT DO NOTHING against the unique
+(device_id, username) index. Every inserted sale is also added to the
+hotspot_sales_daily rollup in the same transaction, which long-range
+revenue reports read instead of scanning hotspot_sales.
+
+Syncs run in the background, not in report requests: every device using
+the hotspot is synced about every HOTSPOT_SALES_SYNC_INTERVAL_SECONDS, each
+run delayed by a random jitter so routers aren't all hit at once, and a
+Redis lock per device keeps workers from syncing the same router together.
+The last successful sync is recorded in hotspot_sync_state.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+from uuid import uuid4
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.metrics import timed_job
+from app.core.redis import get_redis
+from app.models import Device, VoucherSale, HotspotUserRecord, HotspotSyncState, HotspotSalesDaily
+from app.models.core import decrypt_device_secrets
+from app.services.hotspot_mirror import (
+    HOTSPOT_SYNC_LOCK_ID, UPSERT_CHUNK, USERS_RESOURCE, get_sync_state, save_sync_state, staleness_headers,
+    sync_device_users,
+)
+
+logger = logging.getLogger(__name__)
+
+SALES_RESOURCE = "sales"
+# Held while a worker syncs a device; expires on its own if the worker dies
+SALES_LOCK_KEY = "hotspot:sales:lock:{}"
+SALES_LOCK_TTL_SECONDS = 300
+
+# Release the lock only if this worker still holds it
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def profile_price(device: Device, profile: str) -> Tuple[float, str]:
+    """Price and currency of a profile: the device's pricing table, else trailing digits of the name."""
+    hs_settings = device.voucher_template or {}
+    profile_pricing = hs_settings.get('profile_pricing', {})
+    default_currency = hs_settings.get('default_currency', 'TZS')
+    if profile in profile_pricing:
+        return profile_pricing[profile]['price'], profile_pricing[profile]['currency']
+    match = re.search(r'(\d+)$', profile or '')
+    if match:
+        return float(match.group(1)), default_currency
+    return 0, default_currency
+
+async def add_to_daily_rollup(db: AsyncSession, sales: Iterable[dict]) -> None:
+    """Fold newly inserted sales (column dicts) into hotspot_sales_daily; the caller commits."""
+    buckets: Dict[tuple, list] = {}
+    for sale in sales:
+        key = (sale["created_at"].date(), sale["device_id"], sale["site_id"], sale["profile"], sale["currency"] or 'TZS')
+        bucket = buckets.setdefault(key, [0, 0])
+        bucket[0] += 1
+        bucket[1] += int(sale["price"] or 0)
+    if not buckets:
+        return
+    # Sorted so concurrent writers lock rollup rows in the same order
+    rows = [
+        {"day": day, "device_id": device_id, "site_id": site_id, "profile": profile, "currency": currency,
+         "sale_count": count, "revenue": revenue}
+        for (day, device_id, site_id, profile, currency), (count, revenue) in sorted(buckets.items(), key=lambda item: str(item[0]))
+    ]
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        stmt = insert(HotspotSalesDaily).values(rows[start:start + UPSERT_CHUNK])
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["day", "device_id", "site_id", "profile", "currency"],
+            set_={
+                "sale_count": HotspotSalesDaily.sale_count + stmt.excluded.sale_count,
+                "revenue": HotspotSalesDaily.revenue + stmt.excluded.revenue,
+            },
+        ))
+
+@timed_job("hotspot_sales_sync")
+async def sync_device_sales(db: AsyncSession, device: Device, refresh_users: bool = True) -> dict:
+    """
+    Record vouchers of a (decrypted) device that became used since the last
+    run. Refreshes the user mirror first unless refresh_users is False;
+    raises RouterOSError if that fails.
+    """
+    if refresh_users:
+        await sync_device_users(db, device)
+
+    # Same per-device lock as the mirror sync, so no sync commits rows behind the watermark
+    locked = await db.scalar(select(func.pg_try_advisory_xact_lock(HOTSPOT_SYNC_LOCK_ID, func.hashtext(str(device.id)))))
+    if not locked:
+        return {"status": "skipped", "examined": 0, "recorded": 0}
+
+    state = await get_sync_state(db, device.id, SALES_RESOURCE)
+    watermark = state.watermark if state else None
+    query = select(
+        HotspotUserRecord.name, HotspotUserRecord.profile, HotspotUserRecord.comment, HotspotUserRecord.uptime,
+        HotspotUserRecord.uptime_sec, HotspotUserRecord.bytes_in, HotspotUserRecord.bytes_out, HotspotUserRecord.synced_at,
+    ).where(HotspotUserRecord.device_id == device.id, HotspotUserRecord.uptime_sec > 0)
+    if watermark is not None:
+        query = query.where(HotspotUserRecord.synced_at > watermark)
+    used = (await db.execute(query)).all()
+
+    recorded = set()
+    names = list({u.name for u in used})
+    for start in range(0, len(names), UPSERT_CHUNK):
+        result = await db.execute(select(VoucherSale.username).where(
+            VoucherSale.device_id == device.id, VoucherSale.username.in_(names[start:start + UPSERT_CHUNK]),
+        ))
+        recorded.update(result.scalars().all())
+
+    # Sales are dated when the sync first sees the voucher used
+    now = datetime.utcnow()
+    sales = {}
+    for u in used:
+        if u.name in recorded or u.name in sales:
+            continue
+        price, currency = profile_price(device, u.profile)
+        sales[u.name] = {
+            "device_id": device.id,
+            "site_id": device.site_id,
+            "username": u.name,
+            "profile": u.profile or 'default',
+            "comment": u.comment or '',
+            "uptime": u.uptime,
+            "uptime_sec": u.uptime_sec,
+            "bytes_total": (u.bytes_in or 0) + (u.bytes_out or 0),
+            "price": price,
+            "currency": currency,
+            "created_at": now,
+        }
+
+    inserted = []
+    rows = list(sales.values())
+    for start in range(0, len(rows), UPSERT_CHUNK):
+        stmt = (
+            insert(VoucherSale)
+            .values(rows[start:start + UPSERT_CHUNK])
+            .on_conflict_do_nothing(index_elements=["device_id", "username"])
+            .returning(VoucherSale.username)
+        )
+        inserted.extend(sales[name] for name in (await db.execute(stmt)).scalars().all())
+    await add_to_daily_rollup(db, inserted)
+
+    new_watermark = max((u.synced_at for u in used), default=watermark)
+    await save_sync_state(db, device.id, SALES_RESOURCE, last_synced_at=now, last_attempt_at=now, last_error=None, watermark=new_watermark)
+    await db.commit()
+    if inserted:
+        logger.info(f"Synced {len(inserted)} new hotspot sales for device {device.name}")
+    return {"status": "ok", "examined": len(used), "recorded": len(inserted)}
+
+def report_range(period: Optional[str], start_date: Optional[str], end_date: Optional[str]):
+    """
+    Resolve a report's period preset (day, week, month, year) or YYYY-MM-DD bounds.
+    Returns (start_date, start, end_exclusive); unparseable dates are ignored.
+    """
+    now = datetime.utcnow()
+    if period == 'day':
+        start_date = now.strftime('%Y-%m-%d')
+    elif period == 'week':
+        start_date = (now - timedelta(days=7)).strftime('%Y-%m-%d')
+    elif period == 'month':
+        start_date = now.replace(day=1).strftime('%Y-%m-%d')
+    elif period == 'year':
+        start_date = now.replace(month=1, day=1).strftime('%Y-%m-%d')
+
+    start = end = None
+    if start_date:
+        try:
+            start = datetime.strptime(start_date, '%Y-%m-%d')
+        except ValueError:
+            pass
+    if end_date:
+        try:
+            # End date inclusive (until end of day)
+            end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+        except ValueError:
+            pass
+    return start_date, start, end
+
+def sales_in_range(start: Optional[datetime], end: Optional[datetime]) -> list:
+    conditions = []
+    if start is not None:
+        conditions.append(VoucherSale.created_at >= start)
+    if end is not None:
+        conditions.append(VoucherSale.created_at < end)
+    return conditions
+
+def rollup_in_range(start: Optional[datetime], end: Optional[datetime]) -> list:
+    """report_range() bounds for hotspot_sales_daily; they always fall on day boundaries."""
+    conditions = []
+    if start is not None:
+        conditions.append(HotspotSalesDaily.day >= start.date())
+    if end is not None:
+        conditions.append(HotspotSalesDaily.day < end.date())
+    return conditions
+
+async def revenue_breakdown(db: AsyncSession, conditions: list, *keys) -> Dict[tuple, dict]:
+    """Sales count and revenue per currency from the daily rollup, grouped by `keys`."""
+    currency = HotspotSalesDaily.currency
+    result = await db.execute(
+        select(*keys, currency, func.sum(HotspotSalesDaily.sale_count), func.sum(HotspotSalesDaily.revenue))
+        .where(*conditions)
+        .group_by(*keys, currency)
+    )
+    breakdown: Dict[tuple, dict] = {}
+    for *key, curr, count, revenue in result.all():
+        entry = breakdown.setdefault(tuple(key), {"count": 0, "revenue": {}})
+        entry["count"] += int(count)
+        entry["revenue"][curr] = entry["revenue"].get(curr, 0) + int(revenue)
+    return breakdown
+
+def sales_staleness_headers(state: Optional[HotspotSyncState]) -> Dict[str, str]:
+    return staleness_headers(state, settings.HOTSPOT_SALES_SYNC_INTERVAL_SECONDS)
+
+def _sales_due_before() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=settings.HOTSPOT_SALES_SYNC_INTERVAL_SECONDS)
+
+class HotspotSalesScheduler:
+    """Background task syncing sales of every hotspot device on a jittered interval."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._running: set = set()
+        self._pending: set = set()
+        self._token = f"{os.getpid()}:{uuid4().hex}"
+
+    async def due_devices(self) -> list:
+        """Devices using the hotspot whose last sales sync attempt is older than the interval."""
+        due_before = _sales_due_before()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(
+                HotspotSyncState.device_id, HotspotSyncState.resource, HotspotSyncState.last_attempt_at,
+            ).where(HotspotSyncState.resource.in_([USERS_RESOURCE, SALES_RESOURCE])))
+            rows = result.all()
+        attempts = {r.device_id: r.last_attempt_at for r in rows if r.resource == SALES_RESOURCE}
+        devices = {r.device_id for r in rows}
+        return [
+            device_id for device_id in devices
+            if device_id not in self._running and (attempts.get(device_id) or datetime.min) < due_before
+        ]
+
+    async def sync(self, device_id) -> Optional[dict]:
+        """Sync one device's sales if still due, unless another worker holds its lock."""
+        key = SALES_LOCK_KEY.format(device_id)
+        redis = None
+        try:
+            redis = get_redis()
+            if not await redis.set(key, self._token, nx=True, ex=SALES_LOCK_TTL_SECONDS):
+                return None
+        except Exception as e:
+            # The advisory lock inside the sync still keeps runs apart
+            logger.debug(f"Sales sync lock unavailable for {device_id}: {e}")
+            redis = None
+        try:
+            async with AsyncSessionLocal() as db:
+                # Every worker builds the same due list; skip if another one synced it meanwhile
+                state = await get_sync_state(db, device_id, SALES_RESOURCE)
+                if state is not None and state.last_attempt_at and state.last_attempt_at >= _sales_due_before():
+                    return None
+                device = (await db.execute(select(Device).where(Device.id == device_id))).scalars().first()
+                if device is None:
+                    return None
+                # Detach before decrypting so the plaintext can never be flushed
+                db.expunge(device)
+                decrypt_device_secrets(device)
+                # The mirror refresher usually has fresh users already
+                users = await get_sync_state(db, device_id)
+                fresh_after = datetime.utcnow() - timedelta(seconds=settings.HOTSPOT_SYNC_INTERVAL_SECONDS)
+                refresh = users is None or users.last_synced_at is None or users.last_synced_at < fresh_after
+                try:
+                    return await sync_device_sales(db, device, refresh_users=refresh)
+                except Exception as e:
+                    await db.rollback()
+                    await save_sync_state(db, device_id, SALES_RESOURCE, last_attempt_at=datetime.utcnow(), last_error=str(e)[:500])
+                    await db.commit()
+                    raise
+        finally:
+            if redis is not None:
+                try:
+                    await redis.eval(_RELEASE_SCRIPT, 1, key, self._token)
+                except Exception:
+                    pass
+
+    async def _sync_later(self, device_id, semaphore: asyncio.Semaphore):
+        self._running.add(device_id)
+        try:
+            await asyncio.sleep(random.uniform(0, settings.HOTSPOT_SALES_SYNC_JITTER_SECONDS))
+            async with semaphore:
+                await self.sync(device_id)
+        except Exception as e:
+            logger.warning(f"Hotspot sales sync failed for device {device_id}: {e}")
+        finally:
+            self._running.discard(device_id)
+
+    async def _run(self):
+        semaphore = asyncio.Semaphore(settings.HOTSPOT_SYNC_CONCURRENCY)
+        while True:
+            try:
+                for device_id in await self.due_devices():
+                    task = asyncio.create_task(self._sync_later(device_id, semaphore))
+                    self._pending.add(task)
+                    task.add_done_callback(self._pending.discard)
+            except Exception as e:
+                logger.warning(f"Hotspot sales scheduling failed: {e}")
+            await asyncio.sleep(15)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Delayed syncs must not outlive the engine
+        pending = list(self._pending)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+hotspot_sales_scheduler = HotspotSalesScheduler()
@@ -0,0 +1,90 @@
+"""
+Re-encrypt device secrets under the current ENCRYPTION_KEY.
+
+Rotating keys is a two step process: make the new key ENCRYPTION_KEY and
+move the old one to ENCRYPTION_PREVIOUS_KEYS, then run this job (through
+POST /admin/encryption/reencrypt or `python -m app.services.key_rotation`).
+Once it reports nothing left to rotate the old key can be dropped. Legacy
+plaintext secrets are encrypted on the way.
+
+Updates go through the Core table, bypassing the ORM encryption hook, and
+only touch rows whose ciphertext changes. Plaintexts stay the same, so
+cached device snapshots remain valid.
+"""
+import asyncio
+import logging
+import sys
+from sqlalchemy import select, update, func, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.metrics import timed_job
+from app.models import Device
+from app.utils.encryption import get_fernet, rotate_value
+
+logger = logging.getLogger(__name__)
+
+# Same key space as the rule/anomaly/correlation/migration locks
+REENCRYPT_LOCK_ID = 0x4E470005
+SECRET_COLUMNS = ("ssh_password", "wg_private_key")
+BATCH_SIZE = 500
+
+@timed_job("secret_reencryption")
+async def reencrypt_device_secrets(db: AsyncSession, batch_size: int = BATCH_SIZE) -> dict:
+    """Rotate every device secret to the current key; returns counts."""
+    if get_fernet() is None:
+        return {"status": "disabled", "scanned": 0, "rotated": 0}
+    locked = await db.scalar(select(func.pg_try_advisory_xact_lock(REENCRYPT_LOCK_ID)))
+    if not locked:
+        return {"status": "skipped", "scanned": 0, "rotated": 0}
+
+    table = Device.__table__
+    statement = (
+        update(table)
+        .where(table.c.id == bindparam("device_id"))
+        .values({name: bindparam(f"new_{name}") for name in SECRET_COLUMNS})
+    )
+    scanned = rotated = 0
+    last_id = None
+    while True:
+        # Keyset pagination keeps each batch an index range scan
+        query = select(table.c.id, *(table.c[name] for name in SECRET_COLUMNS)).order_by(table.c.id).limit(batch_size)
+        if last_id is not None:
+            query = query.where(table.c.id > last_id)
+        rows = (await db.execute(query)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        scanned += len(rows)
+
+        changes = []
+        for row in rows:
+            values = {name: getattr(row, name) for name in SECRET_COLUMNS}
+            new_values = {name: rotate_value(value) for name, value in values.items()}
+            if any(v is not None for v in new_values.values()):
+                changes.append({
+                    "device_id": row.id,
+                    **{f"new_{name}": new_values[name] or values[name] for name in SECRET_COLUMNS},
+                })
+        if changes:
+            await db.execute(statement, changes)
+            rotated += len(changes)
+
+    await db.commit()
+    logger.info(f"Re-encrypted secrets of {rotated} of {scanned} devices")
+    return {"status": "ok", "scanned": scanned, "rotated": rotated}
+
+async def _main() -> int:
+    from app.core.database import AsyncSessionLocal, engine
+    try:
+        async with AsyncSessionLocal() as db:
+            result = await reencrypt_device_secrets(db)
+        logger.info(f"Re-encryption finished: {result}")
+    except Exception as e:
+        logger.error(f"Re-encryption failed: {e}")
+        return 1
+    finally:
+        await engine.dispose()
+    return 0
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(asyncio.run(_main()))
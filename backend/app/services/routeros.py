@@ -0,0 +1,354 @@
+"""
+Native asyncio client for the MikroTik RouterOS API (port 8728).
+
+Implements the wire protocol directly: length-prefixed words, sentences
+terminated by an empty word, and replies made of !re data sentences ended by
+!done, with !trap carrying command errors and !fatal closing the connection.
+Login uses the plain /login of RouterOS 6.43+ and falls back to the legacy
+MD5 challenge when the router answers with one.
+
+Nothing here blocks the event loop, so a slow or unreachable router only
+delays the requests that talk to it. Every command is timed per host in the
+RouterOS metrics. listen() follows a menu's changes as they happen.
+"""
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterator, Dict, List, Optional
+from app.core.config import settings
+from app.core.metrics import observe_routeros, ROUTEROS_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8728
+# .tag values used on a listening connection
+LISTEN_TAG = "listen"
+PROBE_TAG = "probe"
+
+class RouterOSError(Exception):
+    """Connection or protocol failure talking to a router."""
+
+class RouterOSTrapError(RouterOSError):
+    """The router rejected a command (!trap)."""
+
+    def __init__(self, message: str, category: Optional[str] = None):
+        super().__init__(message)
+        self.category = category
+
+class RouterOSAuthError(RouterOSError):
+    """Login was refused."""
+
+class RouterOSConnectionLost(RouterOSError):
+    """The router closed or reset the connection."""
+
+def encode_length(length: int) -> bytes:
+    if length < 0x80:
+        return bytes([length])
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, "big")
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, "big")
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, "big")
+    return b"\xF0" + length.to_bytes(4, "big")
+
+def encode_sentence(words: List[str]) -> bytes:
+    parts = []
+    for word in words:
+        data = word.encode("utf-8")
+        parts.append(encode_length(len(data)))
+        parts.append(data)
+    parts.append(b"\x00")
+    return b"".join(parts)
+
+def parse_attributes(words: List[str]) -> Dict[str, str]:
+    """Turn reply words like '=name=foo' into {'name': 'foo'}; keys keep their leading dot (.id)."""
+    attributes = {}
+    for word in words:
+        if word.startswith("="):
+            key, _, value = word[1:].partition("=")
+            attributes[key] = value
+    return attributes
+
+def parse_routeros_time(time_str: str) -> int:
+    """Converts RouterOS time (1d2h3m4s or HH:MM:SS) to seconds."""
+    if not time_str or time_str in ("0s", "00:00:00", ""):
+        return 0
+    
+    # Handle HH:MM:SS format
+    if ":" in time_str:
+        try:
+            parts = [p for p in time_str.split(':') if p.strip()]
+            if len(parts) == 3: # HH:MM:SS
+                h, m, s = map(int, parts)
+                return h * 3600 + m * 60 + s
+            elif len(parts) == 2: # MM:SS
+                m, s = map(int, parts)
+                return m * 60 + s
+        except (ValueError, TypeError):
+            pass # Fall through to regex-like parser
+            
+    # Handle 1d2h3m4s format
+    total_seconds = 0
+    current_val = ""
+    multipliers = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+    
+    for char in time_str:
+        if char.isdigit():
+            current_val += char
+        elif char in multipliers:
+            if current_val:
+                total_seconds += int(current_val) * multipliers[char]
+                current_val = ""
+                
+    return total_seconds
+
+def format_routeros_time(seconds: int) -> str:
+    """Converts seconds back to RouterOS time string."""
+    if seconds <= 0:
+        return "0s"
+    
+    periods = [
+        ('d', 86400),
+        ('h', 3600),
+        ('m', 60),
+        ('s', 1)
+    ]
+    
+    result = ""
+    for suffix, count in periods:
+        if seconds >= count:
+            val = seconds // count
+            result += f"{val}{suffix}"
+            seconds %= count
+            
+    return result or "0s"
+
+class RouterOSClient:
+    """
+    One authenticated API connection. Commands are serialized on the
+    connection, so a client may be shared between tasks.
+    """
+
+    def __init__(self, host: str, username: str, password: str, port: int = DEFAULT_PORT,
+                 timeout: Optional[float] = None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout or settings.ROUTEROS_TIMEOUT_SECONDS
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+        # Set by the session manager when handing out an idle connection
+        self.reused = False
+        self._counted = False
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self) -> "RouterOSClient":
+        """Open the connection and log in; reconnects if already connected."""
+        await self.close()
+        with observe_routeros(self.host):
+            try:
+                self._reader, self._writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port), self.timeout
+                )
+            except asyncio.TimeoutError:
+                raise RouterOSError(f"Connection to {self.host}:{self.port} timed out")
+            except OSError as e:
+                raise RouterOSError(f"Could not connect to {self.host}:{self.port}: {e}")
+            try:
+                await self._login()
+            except BaseException:
+                await self.close()
+                raise
+        ROUTEROS_CONNECTIONS.inc()
+        self._counted = True
+        return self
+
+    async def _login(self) -> None:
+        try:
+            _, done = await self._talk(["/login", f"=name={self.username}", f"=password={self.password}"])
+            if "ret" in done:
+                # Pre-6.43 routers answer with an MD5 challenge instead of logging in
+                challenge = bytes.fromhex(done["ret"])
+                response = hashlib.md5(b"\x00" + self.password.encode("utf-8") + challenge).hexdigest()
+                await self._talk(["/login", f"=name={self.username}", f"=response=00{response}"])
+        except RouterOSTrapError as e:
+            raise RouterOSAuthError(f"Authentication failed: {e}")
+
+    def abort(self) -> Optional[asyncio.StreamWriter]:
+        """Close the connection without waiting; safe to call from sync code."""
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+        if self._counted:
+            self._counted = False
+            ROUTEROS_CONNECTIONS.dec()
+        return writer
+
+    async def close(self) -> None:
+        writer = self.abort()
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def __aenter__(self) -> "RouterOSClient":
+        return await self.connect()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def _read_length(self) -> int:
+        first = (await self._reader.readexactly(1))[0]
+        if first < 0x80:
+            return first
+        if first < 0xC0:
+            return int.from_bytes(bytes([first & 0x3F]) + await self._reader.readexactly(1), "big")
+        if first < 0xE0:
+            return int.from_bytes(bytes([first & 0x1F]) + await self._reader.readexactly(2), "big")
+        if first < 0xF0:
+            return int.from_bytes(bytes([first & 0x0F]) + await self._reader.readexactly(3), "big")
+        if first == 0xF0:
+            return int.from_bytes(await self._reader.readexactly(4), "big")
+        raise RouterOSError(f"Malformed word length from {self.host}")
+
+    async def _read_sentence(self) -> List[str]:
+        words = []
+        while True:
+            length = await self._read_length()
+            if length == 0:
+                return words
+            words.append((await self._reader.readexactly(length)).decode("utf-8", errors="replace"))
+
+    async def _talk(self, words: List[str]):
+        """Send one command; return (!re attribute dicts, !done attributes)."""
+        if not self.connected:
+            raise RouterOSError(f"Not connected to {self.host}")
+        try:
+            self._writer.write(encode_sentence(words))
+            await asyncio.wait_for(self._writer.drain(), self.timeout)
+            rows, trap = [], None
+            while True:
+                sentence = await asyncio.wait_for(self._read_sentence(), self.timeout)
+                if not sentence:
+                    continue
+                reply, attributes = sentence[0], parse_attributes(sentence[1:])
+                if reply == "!re":
+                    rows.append(attributes)
+                elif reply == "!trap":
+                    # Keep reading: the command still ends with !done
+                    trap = trap or attributes
+                elif reply == "!fatal":
+                    await self.close()
+                    raise RouterOSConnectionLost(f"Router closed the connection: {' '.join(sentence[1:])}")
+                elif reply == "!done":
+                    if trap is not None:
+                        raise RouterOSTrapError(trap.get("message", "Command failed"), trap.get("category"))
+                    return rows, attributes
+                # !empty (RouterOS 7.18+) carries no data
+        except asyncio.TimeoutError:
+            # The reply may still arrive later; the connection can't be trusted any more
+            await self.close()
+            raise RouterOSError(f"Router {self.host} timed out")
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            await self.close()
+            raise RouterOSConnectionLost(f"Connection to {self.host} lost: {e}")
+        except asyncio.CancelledError:
+            # Abandoned mid-reply: the rest of it would desync the next command
+            self.abort()
+            raise
+
+    async def talk(self, words: List[str]):
+        async with self._lock:
+            with observe_routeros(self.host):
+                reused, self.reused = self.reused, False
+                try:
+                    return await self._talk(words)
+                except RouterOSConnectionLost:
+                    if not reused:
+                        raise
+                    # A pooled connection the router dropped while it sat idle: retry once on a fresh one
+                    logger.debug(f"Reconnecting stale RouterOS session to {self.host}")
+                    await self.connect()
+                    return await self._talk(words)
+
+    async def get(self, path: str, proplist: Optional[List[str]] = None, **query) -> List[Dict[str, str]]:
+        """Run <path>/print, optionally limited to some properties and filtered by exact-match queries."""
+        words = [f"{path}/print"]
+        if proplist:
+            words.append(f"=.proplist={','.join(proplist)}")
+        rows, _ = await self.talk([*words, *(f"?{k}={v}" for k, v in query.items())])
+        return rows
+
+    async def add(self, path: str, **params) -> Optional[str]:
+        """Run <path>/add; returns the new item's .id."""
+        _, done = await self.talk([f"{path}/add", *(f"={k}={v}" for k, v in params.items() if v is not None)])
+        return done.get("ret")
+
+    async def set(self, path: str, item_id: str, **params) -> None:
+        await self.talk([f"{path}/set", f"=.id={item_id}", *(f"={k}={v}" for k, v in params.items())])
+
+    async def remove(self, path: str, item_id: str) -> None:
+        await self.talk([f"{path}/remove", f"=.id={item_id}"])
+
+    async def listen(self, path: str, keepalive: float = 30,
+                     started: Optional[asyncio.Event] = None) -> AsyncIterator[Dict[str, str]]:
+        """
+        Run <path>/listen and yield an attribute dict per change until the
+        connection drops; removed items arrive as {'.id': ..., '.dead': 'true'}.
+        The connection is dedicated to the listen while it runs. A quiet
+        connection is probed with a tagged command every `keepalive` seconds,
+        and treated as lost if the probe goes unanswered. `started` is set once
+        the router has been sent the listen.
+        """
+        async with self._lock:
+            if not self.connected:
+                raise RouterOSError(f"Not connected to {self.host}")
+            read = None
+            try:
+                self._writer.write(encode_sentence([f"{path}/listen", f".tag={LISTEN_TAG}"]))
+                await asyncio.wait_for(self._writer.drain(), self.timeout)
+                if started is not None:
+                    started.set()
+                probing = False
+                while True:
+                    # Keep one read pending across timeouts so a sentence is never cut in half
+                    read = read or asyncio.ensure_future(self._read_sentence())
+                    done, _ = await asyncio.wait({read}, timeout=keepalive)
+                    if not done:
+                        if probing:
+                            raise RouterOSConnectionLost(f"Router {self.host} stopped answering")
+                        self._writer.write(encode_sentence(["/system/identity/print", f".tag={PROBE_TAG}"]))
+                        await asyncio.wait_for(self._writer.drain(), self.timeout)
+                        probing = True
+                        continue
+                    sentence, read, probing = read.result(), None, False
+                    if not sentence:
+                        continue
+                    reply = sentence[0]
+                    if reply == "!fatal":
+                        raise RouterOSConnectionLost(f"Router closed the connection: {' '.join(sentence[1:])}")
+                    if f".tag={LISTEN_TAG}" not in sentence[1:]:
+                        continue
+                    attributes = parse_attributes(sentence[1:])
+                    if reply == "!re":
+                        yield attributes
+                    elif reply == "!trap":
+                        raise RouterOSTrapError(attributes.get("message", "Listen failed"), attributes.get("category"))
+                    elif reply == "!done":
+                        return
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                raise RouterOSConnectionLost(f"Connection to {self.host} lost: {e}")
+            except asyncio.TimeoutError:
+                raise RouterOSError(f"Router {self.host} timed out")
+            finally:
+                if read is not None:
+                    read.cancel()
+                # A listen can't be resumed mid-stream; the connection is done either way
+                self.abort()
@@ -0,0 +1,167 @@
+"""
+Process-wide pool of authenticated RouterOS API sessions, keyed by device.
+
+Opening the hotspot page fires several calls at the same router within a
+second; instead of a TCP connect and login for each, requests check out an
+idle session for the device and return it afterwards. At most
+ROUTEROS_MAX_SESSIONS_PER_DEVICE sessions run against one router at a time
+(further requests wait for one to be returned), and sessions idle longer
+than ROUTEROS_SESSION_IDLE_SECONDS are closed by a background reaper.
+
+Pools remember a fingerprint of the address and credentials they logged in
+with; a device whose credentials changed gets a fresh pool. The manager is
+also registered as a cache, so invalidate_device() evicts a device's sessions
+in every worker.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+from app.core.cache import register_cache
+from app.core.config import settings
+from app.services.routeros import RouterOSClient, RouterOSError
+
+logger = logging.getLogger(__name__)
+
+ROUTEROS_SESSIONS = "routeros_sessions"
+
+def _fingerprint(host: str, port: int, username: str, password: str) -> str:
+    return hashlib.sha256(f"{host}\0{port}\0{username}\0{password}".encode()).hexdigest()
+
+class _DevicePool:
+    def __init__(self, fingerprint: str, limit: int):
+        self.fingerprint = fingerprint
+        self.semaphore = asyncio.Semaphore(limit)
+        self.idle: List[Tuple[RouterOSClient, float]] = []
+        self.active = 0
+        self.retired = False
+
+    def close_idle(self) -> None:
+        for client, _ in self.idle:
+            client.abort()
+        self.idle.clear()
+
+class RouterOSSessionManager:
+    def __init__(self, max_per_device: int, idle_timeout: float):
+        self.max_per_device = max_per_device
+        self.idle_timeout = idle_timeout
+        self._pools: Dict[str, _DevicePool] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _pool(self, key: str, fingerprint: str) -> _DevicePool:
+        pool = self._pools.get(key)
+        if pool is not None and pool.fingerprint != fingerprint:
+            # Address or credentials changed; sessions still in use close when returned
+            self._retire(key)
+            pool = None
+        if pool is None:
+            pool = self._pools[key] = _DevicePool(fingerprint, self.max_per_device)
+        return pool
+
+    def _retire(self, key: str) -> None:
+        pool = self._pools.pop(key, None)
+        if pool is not None:
+            pool.retired = True
+            pool.close_idle()
+
+    def _take_idle(self, pool: _DevicePool) -> Optional[RouterOSClient]:
+        now = time.monotonic()
+        while pool.idle:
+            # Most recently used first; the oldest ones age out
+            client, returned_at = pool.idle.pop()
+            if client.connected and now - returned_at < self.idle_timeout:
+                client.reused = True
+                return client
+            client.abort()
+        return None
+
+    @asynccontextmanager
+    async def session(self, key: str, host: str, username: str, password: str, port: int):
+        """Check out an authenticated client for a device; returned to the pool on exit."""
+        pool = self._pool(key, _fingerprint(host, port, username, password))
+        try:
+            await asyncio.wait_for(pool.semaphore.acquire(), settings.ROUTEROS_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise RouterOSError(f"Router {host} timed out waiting for a free API session")
+        pool.active += 1
+        client = None
+        try:
+            client = self._take_idle(pool)
+            if client is None:
+                new_client = RouterOSClient(host, username, password, port)
+                await new_client.connect()
+                client = new_client
+            yield client
+        finally:
+            pool.active -= 1
+            pool.semaphore.release()
+            if client is not None:
+                if client.connected and not pool.retired:
+                    client.reused = False
+                    pool.idle.append((client, time.monotonic()))
+                else:
+                    client.abort()
+
+    def reap(self) -> None:
+        """Close sessions idle past the timeout and forget unused pools."""
+        cutoff = time.monotonic() - self.idle_timeout
+        for key, pool in list(self._pools.items()):
+            keep = []
+            for client, returned_at in pool.idle:
+                if returned_at < cutoff or not client.connected:
+                    client.abort()
+                else:
+                    keep.append((client, returned_at))
+            pool.idle = keep
+            if not pool.idle and not pool.active:
+                del self._pools[key]
+
+    # Cache interface for app.core.cache.invalidate()
+    def pop(self, key: str) -> None:
+        self._retire(key)
+
+    def clear(self) -> None:
+        for key in list(self._pools):
+            self._retire(key)
+
+    def __len__(self) -> int:
+        return sum(len(pool.idle) + pool.active for pool in self._pools.values())
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 2, 1))
+            try:
+                self.reap()
+            except Exception as e:
+                logger.warning(f"RouterOS session reaper failed: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.clear()
+
+routeros_sessions = register_cache(
+    ROUTEROS_SESSIONS,
+    RouterOSSessionManager(settings.ROUTEROS_MAX_SESSIONS_PER_DEVICE, settings.ROUTEROS_SESSION_IDLE_SECONDS),
+)
+
+def routeros_port(device) -> int:
+    # Heuristic: If port is 22 (SSH), use 8728 (API) for RouterOS API connections
+    port = int(getattr(device, 'ssh_port', 8728) or 8728)
+    return 8728 if port == 22 else port
+
+def device_session(device):
+    """Pooled API session for a (decrypted) device; use as `async with device_session(device) as api`."""
+    return routeros_sessions.session(
+        str(device.id), device.ip_address, device.ssh_username or 'admin', device.ssh_password or 'admin', routeros_port(device)
+    )
@@ -0,0 +1,165 @@
+"""
+Threshold rule evaluation inside the database.
+
+One evaluation tick checks every enabled AlertRule against the recent metrics
+of every device in a single grouped query, then opens and resolves alerts in
+bulk. This replaces the diagnoser's per-device HTTP polling.
+"""
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, case, or_, and_, false, literal
+from sqlalchemy.dialects.postgresql import aggregate_order_by, ARRAY
+from sqlalchemy.types import Boolean, Float
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.events import publish_event, ALERTS_CHANGED_CHANNEL
+from app.models import AlertRule, Metric, Device, Site, RuleOperator
+from app.services.alerts import upsert_open_alerts, resolve_open_alerts
+from app.core.metrics import timed_job
+
+logger = logging.getLogger(__name__)
+
+# pg_try_advisory_xact_lock key so concurrent ticks (several workers or agents) don't overlap
+RULE_EVAL_LOCK_ID = 0x4E470001
+
+def breach_condition(value, operator, threshold):
+    """SQL boolean expression comparing a value against a rule's operator/threshold."""
+    return case(
+        (operator == RuleOperator.GT.value, value > threshold),
+        (operator == RuleOperator.GTE.value, value >= threshold),
+        (operator == RuleOperator.LT.value, value < threshold),
+        (operator == RuleOperator.LTE.value, value <= threshold),
+        (operator == RuleOperator.EQ.value, value == threshold),
+        (operator == RuleOperator.NE.value, value != threshold),
+        else_=false(),
+    )
+
+def clear_condition(value, operator, threshold, hysteresis):
+    """SQL boolean: value is back past the threshold by at least the hysteresis band."""
+    band = func.coalesce(hysteresis, 0)
+    return case(
+        (operator == RuleOperator.GT.value, value <= threshold - band),
+        (operator == RuleOperator.GTE.value, value < threshold - band),
+        (operator == RuleOperator.LT.value, value >= threshold + band),
+        (operator == RuleOperator.LTE.value, value > threshold + band),
+        else_=~breach_condition(value, operator, threshold),
+    )
+
+def _seconds_before(now: datetime, seconds):
+    return literal(now) - func.make_interval(0, 0, 0, 0, 0, 0, seconds)
+
+def evaluation_query(now: datetime):
+    """
+    Build the fleet-wide evaluation query: one row per (device, rule) with
+    the latest value and whether the rule is firing or clear. Clearing
+    honours the rule's hysteresis band, matching the streaming evaluator.
+
+    A rule fires when the latest consecutive_samples samples breach and every
+    sample in the last duration_seconds breaches, with history reaching back
+    at least that far.
+    Devices with no sample inside RULE_EVAL_LOOKBACK_SECONDS are skipped.
+    """
+    lookback = settings.RULE_EVAL_LOOKBACK_SECONDS
+    duration = func.coalesce(AlertRule.duration_seconds, 0)
+    breach = breach_condition(Metric.value, AlertRule.operator, AlertRule.threshold)
+    duration_start = _seconds_before(now, duration)
+
+    latest_value = func.array_agg(
+        aggregate_order_by(Metric.value, Metric.time.desc()), type_=ARRAY(Float)
+    )[1]
+    breaches = func.array_agg(aggregate_order_by(breach, Metric.time.desc()), type_=ARRAY(Boolean))
+    latest_breach = breaches[1]
+    # The newest consecutive_samples samples must all breach
+    samples = func.greatest(func.coalesce(AlertRule.consecutive_samples, 1), 1)
+    consecutive = and_(
+        func.cardinality(breaches) >= samples,
+        ~literal(False).op("=")(func.any_(breaches[1:samples])),
+    )
+    latest_clear = func.array_agg(
+        aggregate_order_by(
+            clear_condition(Metric.value, AlertRule.operator, AlertRule.threshold, AlertRule.hysteresis),
+            Metric.time.desc(),
+        ),
+        type_=ARRAY(Boolean),
+    )[1]
+    sustained = func.coalesce(
+        func.bool_and(breach).filter(Metric.time >= duration_start), True
+    )
+    covered = or_(duration == 0, func.min(Metric.time) <= duration_start)
+
+    return (
+        select(
+            Metric.device_id,
+            AlertRule.id.label("rule_id"),
+            AlertRule.name.label("rule_name"),
+            AlertRule.metric_type,
+            AlertRule.operator,
+            AlertRule.threshold,
+            AlertRule.severity,
+            duration.label("duration_seconds"),
+            latest_value.label("latest_value"),
+            latest_clear.label("cleared"),
+            and_(latest_breach, consecutive, sustained, covered).label("firing"),
+        )
+        .select_from(Metric)
+        .join(AlertRule, AlertRule.metric_type == Metric.metric_type)
+        .join(Device, Device.id == Metric.device_id)
+        .join(Site, Site.id == Device.site_id)
+        .where(
+            AlertRule.is_enabled == True,
+            Device.is_active == True,
+            or_(AlertRule.organization_id.is_(None), AlertRule.organization_id == Site.organization_id),
+            Metric.time >= _seconds_before(now, duration + lookback),
+        )
+        .group_by(Metric.device_id, AlertRule.id)
+        .having(func.max(Metric.time) >= now - timedelta(seconds=lookback))
+    )
+
+def alert_message(row) -> str:
+    msg = f"{row.rule_name}: {row.metric_type} is {row.latest_value:g} ({row.operator} {row.threshold:g})"
+    if row.duration_seconds:
+        msg += f" for {row.duration_seconds}s"
+    return msg
+
+@timed_job("rule_evaluation")
+async def evaluate_rules(db: AsyncSession) -> dict:
+    """Run one evaluation tick across the whole fleet and commit the result."""
+    locked = await db.scalar(select(func.pg_try_advisory_xact_lock(RULE_EVAL_LOCK_ID)))
+    if not locked:
+        return {"status": "skipped", "evaluated": 0, "opened": 0, "firing": 0, "resolved": 0}
+
+    rows = (await db.execute(evaluation_query(datetime.utcnow()))).all()
+
+    to_open = []
+    to_resolve = []
+    for row in rows:
+        if row.firing:
+            to_open.append({
+                "device_id": row.device_id,
+                "rule_name": row.rule_name,
+                "severity": row.severity,
+                "message": alert_message(row),
+            })
+        elif row.cleared:
+            to_resolve.append((row.device_id, row.rule_name))
+
+    upserted = await upsert_open_alerts(db, to_open)
+    resolved = await resolve_open_alerts(db, to_resolve)
+    await db.commit()
+
+    opened = sum(1 for a in upserted if a.occurrence_count == 1)
+    if opened or resolved:
+        await publish_event(ALERTS_CHANGED_CHANNEL, {
+            "action": "rule_evaluation",
+            "opened": opened,
+            "resolved": resolved,
+        })
+        logger.info(f"Rule evaluation: {len(rows)} checks, {opened} opened, {resolved} resolved")
+
+    return {
+        "status": "success",
+        "evaluated": len(rows),
+        "opened": opened,
+        "firing": len(to_open),
+        "resolved": resolved,
+    }
@@ -0,0 +1,238 @@
+"""
+Incremental rule evaluation on the metric ingest path.
+
+Every ingested sample is checked against the enabled rules for its metric
+type using a small per-(device, rule) state: consecutive breach count, EWMA
+of the samples and whether the alert is currently firing. Work per sample is
+O(1) and the database is only touched when a rule actually fires or clears,
+so alerts open and resolve as soon as the crossing sample arrives instead of
+on the next batch tick.
+
+Samples of one device reach whichever worker accepted the request, so the
+state lives in Redis (one hash per device and rule) and is updated by a Lua
+script, atomically across workers and restarts. Each hash expires after
+RULE_STATE_TTL_SECONDS without samples. If Redis is unreachable the sample is
+only stored (logged once per outage); the batch evaluator in rule_engine
+remains the backstop.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.events import publish_event, ALERTS_CHANGED_CHANNEL
+from app.core.redis import get_redis
+from app.models import AlertRule
+from app.services.alerts import upsert_open_alerts, resolve_open_alerts
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY_PREFIX = "rule_engine:stream_state"
+
+FIRE = "fire"
+CLEAR = "clear"
+
+@dataclass(frozen=True)
+class RuleSpec:
+    """Immutable snapshot of an AlertRule, safe to share across sessions."""
+    id: str
+    organization_id: Optional[str]
+    name: str
+    metric_type: str
+    operator: str
+    threshold: float
+    severity: str
+    duration_seconds: int
+    consecutive_samples: int
+    hysteresis: float
+    ewma_alpha: float
+
+    @classmethod
+    def from_model(cls, rule: AlertRule) -> "RuleSpec":
+        return cls(
+            id=str(rule.id),
+            organization_id=str(rule.organization_id) if rule.organization_id else None,
+            name=rule.name,
+            metric_type=rule.metric_type,
+            operator=rule.operator,
+            threshold=rule.threshold,
+            severity=rule.severity,
+            duration_seconds=rule.duration_seconds or 0,
+            consecutive_samples=max(rule.consecutive_samples or 1, 1),
+            hysteresis=rule.hysteresis or 0.0,
+            ewma_alpha=rule.ewma_alpha or 1.0,
+        )
+
+# Folds one sample into the state of every rule (one hash per device and
+# rule in KEYS) and returns "fire", "clear" or "" per rule. ARGV holds the
+# value, timestamp and TTL, then operator, threshold, ewma_alpha,
+# consecutive_samples, duration_seconds and hysteresis for each rule.
+_UPDATE_SCRIPT = """
+local value, ts, ttl = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+
+local function breach(op, v, t)
+    if op == '>' then return v > t end
+    if op == '>=' then return v >= t end
+    if op == '<' then return v < t end
+    if op == '<=' then return v <= t end
+    if op == '==' then return v == t end
+    if op == '!=' then return v ~= t end
+    return false
+end
+
+-- Back past the threshold by at least the hysteresis band
+local function clear(op, v, t, h)
+    if op == '>' then return v <= t - h end
+    if op == '>=' then return v < t - h end
+    if op == '<' then return v >= t + h end
+    if op == '<=' then return v > t + h end
+    return not breach(op, v, t)
+end
+
+local out = {}
+for i, key in ipairs(KEYS) do
+    local n = 3 + (i - 1) * 6
+    local op, threshold, alpha = ARGV[n + 1], tonumber(ARGV[n + 2]), tonumber(ARGV[n + 3])
+    local needed, duration, hysteresis = tonumber(ARGV[n + 4]), tonumber(ARGV[n + 5]), tonumber(ARGV[n + 6])
+    local state = redis.call('HMGET', key, 'breaches', 'breach_started', 'ewma', 'firing', 'last_ts')
+    local breaches, started, ewma = tonumber(state[1]) or 0, tonumber(state[2]), tonumber(state[3])
+    local firing, last_ts = state[4] == '1', tonumber(state[5]) or 0
+    out[i] = ''
+    -- Late samples are left to the batch evaluator
+    if ts >= last_ts then
+        if ewma then ewma = alpha * value + (1 - alpha) * ewma else ewma = value end
+        if breach(op, ewma, threshold) then
+            if breaches == 0 then started = ts end
+            breaches = breaches + 1
+            if not firing and breaches >= needed and ts - started >= duration then
+                firing = true
+                out[i] = 'fire'
+            end
+        else
+            breaches, started = 0, nil
+            if firing and clear(op, ewma, threshold, hysteresis) then
+                firing = false
+                out[i] = 'clear'
+            end
+        end
+        redis.call('HSET', key,
+            'breaches', breaches,
+            'breach_started', started and string.format('%.17g', started) or '',
+            'ewma', string.format('%.17g', ewma),
+            'firing', firing and '1' or '0',
+            'last_ts', string.format('%.17g', ts))
+        redis.call('EXPIRE', key, ttl)
+    end
+end
+return out
+"""
+
+def state_key(device_id, rule_id: str) -> str:
+    return f"{STATE_KEY_PREFIX}:{device_id}:{rule_id}"
+
+def stream_alert_message(rule: RuleSpec, value: float) -> str:
+    return f"{rule.name}: {rule.metric_type} is {value:g} ({rule.operator} {rule.threshold:g})"
+
+class StreamEvaluator:
+    def __init__(self):
+        self._rules: Dict[str, List[RuleSpec]] = {}
+        self._rules_loaded_at = 0.0
+        self._rules_lock = asyncio.Lock()
+        self._update_script = None
+        self._redis_down = False
+
+    def invalidate_rules(self):
+        """Force a rule reload on the next sample (call after rule CRUD)."""
+        self._rules_loaded_at = 0.0
+
+    async def _rules_for(self, db: AsyncSession, metric_type: str) -> List[RuleSpec]:
+        if time.monotonic() - self._rules_loaded_at > settings.RULE_CACHE_TTL_SECONDS:
+            async with self._rules_lock:
+                if time.monotonic() - self._rules_loaded_at > settings.RULE_CACHE_TTL_SECONDS:
+                    result = await db.execute(select(AlertRule).where(AlertRule.is_enabled == True))
+                    rules: Dict[str, List[RuleSpec]] = {}
+                    for rule in result.scalars().all():
+                        rules.setdefault(rule.metric_type, []).append(RuleSpec.from_model(rule))
+                    self._rules = rules
+                    self._rules_loaded_at = time.monotonic()
+        return self._rules.get(metric_type, [])
+
+    async def process(
+        self,
+        db: AsyncSession,
+        device_id,
+        organization_id,
+        metric_type: str,
+        value: float,
+        sample_time: datetime,
+    ) -> dict:
+        """
+        Evaluate one committed sample and apply any fire/clear transitions.
+        Returns counts of alerts opened and resolved.
+        """
+        org = str(organization_id) if organization_id else None
+        rules = [r for r in await self._rules_for(db, metric_type) if not r.organization_id or r.organization_id == org]
+        if not rules:
+            return {"opened": 0, "resolved": 0}
+
+        if sample_time is None:
+            ts = time.time()
+        elif sample_time.tzinfo is None:
+            ts = sample_time.replace(tzinfo=timezone.utc).timestamp()  # Metrics are naive UTC
+        else:
+            ts = sample_time.timestamp()
+        args = [value, ts, settings.RULE_STATE_TTL_SECONDS]
+        for rule in rules:
+            args += [rule.operator, rule.threshold, rule.ewma_alpha, rule.consecutive_samples, rule.duration_seconds, rule.hysteresis]
+        if self._update_script is None:
+            # Sent by SHA (EVALSHA) after the first call
+            self._update_script = get_redis().register_script(_UPDATE_SCRIPT)
+        try:
+            transitions = await self._update_script(
+                keys=[state_key(device_id, r.id) for r in rules], args=args, client=get_redis(),
+            )
+        except (RedisError, OSError) as e:
+            if not self._redis_down:
+                logger.warning(f"Streaming rule evaluation paused, Redis unavailable: {e}")
+            self._redis_down = True
+            return {"opened": 0, "resolved": 0}
+        if self._redis_down:
+            logger.info("Streaming rule evaluation resumed")
+            self._redis_down = False
+
+        to_open = []
+        to_resolve = []
+        for rule, transition in zip(rules, transitions):
+            if transition == FIRE:
+                to_open.append({
+                    "device_id": device_id,
+                    "rule_name": rule.name,
+                    "severity": rule.severity,
+                    "message": stream_alert_message(rule, value),
+                })
+            elif transition == CLEAR:
+                to_resolve.append((device_id, rule.name))
+
+        if not to_open and not to_resolve:
+            return {"opened": 0, "resolved": 0}
+
+        upserted = await upsert_open_alerts(db, to_open)
+        resolved = await resolve_open_alerts(db, to_resolve)
+        await db.commit()
+
+        opened = sum(1 for a in upserted if a.occurrence_count == 1)
+        if opened or resolved:
+            await publish_event(ALERTS_CHANGED_CHANNEL, {
+                "action": "stream_evaluation",
+                "device_id": str(device_id),
+                "opened": opened,
+                "resolved": resolved,
+            })
+        return {"opened": opened, "resolved": resolved}
+
+stream_evaluator = StreamEvaluator()
@@ -1,20 +1,64 @@
 """
 Encryption utilities for sensitive database fields.
 Uses Fernet symmetric encryption for encrypting/decrypting sensitive data.
+
+Keys rotate through MultiFernet: ENCRYPTION_KEY encrypts, and keys listed in
+ENCRYPTION_PREVIOUS_KEYS are still accepted for decryption until
+rotate_value() (see app.services.key_rotation) has re-encrypted every secret.
+Decrypted values are memoized in a bounded LRU keyed by the ciphertext's
+digest, so hot device lookups don't pay for an HMAC check and AES decrypt
+each time.
 """
-from cryptography.fernet import Fernet
+from collections import OrderedDict
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 from app.core.config import settings
 import base64
+import hashlib
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
-# Cache the Fernet instance
+# Cache the Fernet instances
 _fernet_instance = None
+_primary_fernet = None
+
+class _DecryptCache:
+    """Thread-safe LRU of ciphertext digest -> plaintext."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: bytes, value: str) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+_decrypt_cache = _DecryptCache(settings.DECRYPT_CACHE_SIZE)
+
+def _load_key(key: str) -> Fernet:
+    return Fernet(key.strip().encode())
 
 def get_fernet():
-    """Get or create Fernet instance for encryption/decryption."""
-    global _fernet_instance
+    """Get or create the MultiFernet (current key first, then retired keys)."""
+    global _fernet_instance, _primary_fernet
     if _fernet_instance is None:
         encryption_key = settings.ENCRYPTION_KEY
         if not encryption_key:
@@ -22,15 +66,30 @@ def get_fernet():
             return None
         
         try:
-            # Ensure key is bytes
-            if isinstance(encryption_key, str):
-                encryption_key = encryption_key.encode()
-            _fernet_instance = Fernet(encryption_key)
+            primary = _load_key(encryption_key)
         except Exception as e:
             logger.error(f"Failed to initialize Fernet encryption: {e}")
             return None
+
+        # A malformed retired key only costs decryption of values still under it
+        previous = []
+        retired = [k for k in settings.ENCRYPTION_PREVIOUS_KEYS.split(",") if k.strip()]
+        for position, key in enumerate(retired, start=1):
+            try:
+                previous.append(_load_key(key))
+            except Exception as e:
+                logger.error(f"Skipping invalid key #{position} in ENCRYPTION_PREVIOUS_KEYS: {e}")
+        _fernet_instance = MultiFernet([primary, *previous])
+        _primary_fernet = primary
     return _fernet_instance
 
+def reset_encryption() -> None:
+    """Drop the cached keys and decrypted values, e.g. after the key settings change."""
+    global _fernet_instance, _primary_fernet
+    _fernet_instance = None
+    _primary_fernet = None
+    _decrypt_cache.clear()
+
 def encrypt_value(value: str) -> str:
     """
     Encrypt a string value.
@@ -66,15 +125,49 @@ def decrypt_value(value: str) -> str:
     if fernet is None:
         # Encryption not available - assume plaintext
         return value
+
+    digest = hashlib.sha256(value.encode()).digest()
+    cached = _decrypt_cache.get(digest)
+    if cached is not None:
+        return cached
     
     try:
         # Try to decrypt
-        decrypted = fernet.decrypt(value.encode())
-        return decrypted.decode()
+        decrypted = fernet.decrypt(value.encode()).decode()
     except Exception as e:
         # If decryption fails, assume it's plaintext (for backward compatibility during migration)
         logger.debug(f"Decryption failed (assuming plaintext): {e}")
-        return value
+        decrypted = value
+    _decrypt_cache.set(digest, decrypted)
+    return decrypted
+
+def rotate_value(value: str):
+    """
+    Return the value encrypted under the current key, or None if it already is.
+
+    Tokens from a retired key are re-encrypted and legacy plaintext values are
+    encrypted. Tokens no configured key can open are left alone (None) rather
+    than being encrypted a second time.
+    """
+    if not value:
+        return None
+    fernet = get_fernet()
+    if fernet is None:
+        return None
+
+    token = value.encode()
+    try:
+        _primary_fernet.decrypt(token)
+        return None
+    except InvalidToken:
+        pass
+    try:
+        return fernet.rotate(token).decode()
+    except InvalidToken:
+        if value.startswith("gAAAAA"):
+            logger.warning("Found an encrypted value that no configured key can decrypt; leaving it as is")
+            return None
+        return encrypt_value(value)
 
 def is_encrypted(value: str) -> bool:
     """
@@ -1,8 +1,8 @@
 import asyncio
-from app.database import AsyncSessionLocal
+from app.core.database import AsyncSessionLocal
 from app.models import User, UserRole
 from app.auth.security import get_password_hash
-from sqlalchemy import select
+from sqlalchemy import select, or_
 
 async def seed_user():
     async with AsyncSessionLocal() as db:
@@ -44,22 +44,34 @@ async def seed_user():
         else:
             print("Admin user verified.")
 
-        # Seed API Key
+        # Seed API Key (stored hashed, like keys created through the API)
         from app.models import APIKey
-        result = await db.execute(select(APIKey).where(APIKey.key == "agent-secret-key-123"))
+        from app.auth.security import hash_api_key
+        agent_key = "agent-secret-key-123"
+        result = await db.execute(select(APIKey).where(
+            or_(APIKey.key_hash == hash_api_key(agent_key), APIKey.key == agent_key)
+        ))
         api_key = result.scalars().first()
         
         if not api_key:
             print("Creating default API Key...")
             new_key = APIKey(
-                key="agent-secret-key-123",
+                key_hash=hash_api_key(agent_key),
+                key_prefix=agent_key[:10],
                 description="Default Agent Key",
                 is_active=True,
                 organization_id=org.id
             )
             db.add(new_key)
             await db.commit()
-            print("API Key created: agent-secret-key-123")
+            print(f"API Key created: {agent_key}")
+        elif api_key.key_hash is None:
+            # Seeded by an older version with only the plaintext column set
+            print("Hashing default API Key...")
+            api_key.key_hash = hash_api_key(agent_key)
+            api_key.key_prefix = agent_key[:10]
+            api_key.key = None
+            await db.commit()
         else:
             print("API Key already exists.")
             
@@ -193,7 +193,9 @@ const PasswordChangeForm = () => {
         e.preventDefault();
         setLoading(true);
         try {
-            await api.post('/auth/change-password', { old_password: oldPassword, new_password: newPassword });
+            const res = await api.post('/auth/change-password', { old_password: oldPassword, new_password: newPassword });
+            // Older tokens are revoked by the change
+            localStorage.setItem('token', res.data.access_token);
             alert("Password updated successfully");
             setOldPassword('');
             setNewPassword('');
@@ -18,6 +18,10 @@ export default function Hotspot() {
     const [logs, setLogs] = useState([]);
     const [reportData, setReportData] = useState(null);
     const [reportPage, setReportPage] = useState(1);
+    // Sales rows are paged by the server: the rows shown, the cursor that starts each visited page and the next one
+    const [reportRows, setReportRows] = useState([]);
+    const [reportCursors, setReportCursors] = useState([null]);
+    const [reportNextCursor, setReportNextCursor] = useState(null);
     const [healthStatus, setHealthStatus] = useState('unknown');
     const [loading, setLoading] = useState(false);
     const [showProfileModal, setShowProfileModal] = useState(false);
@@ -32,11 +36,7 @@ export default function Hotspot() {
     const [reportStartDate, setReportStartDate] = useState('');
     const [reportEndDate, setReportEndDate] = useState('');
 
-    const filteredReports = reportData?.data?.filter(r =>
-        (r.username || '').toLowerCase().includes(reportSearch.toLowerCase()) ||
-        (r.profile || '').toLowerCase().includes(reportSearch.toLowerCase()) ||
-        (r.comment || '').toLowerCase().includes(reportSearch.toLowerCase())
-    ) || [];
+    const REPORT_PAGE_SIZE = 30;
 
     // Generation State
     const [batchForm, setBatchForm] = useState({ qty: 10, prefix: 'user', profile: 'default', time_limit: '1h', data_limit: '', length: 10, random_mode: false, format: 'alphanumeric' });
@@ -55,12 +55,41 @@ export default function Hotspot() {
         fetchDevices();
     }, []);
 
+    // Search runs on the server, so restart paging from the newest matching sale
+    useEffect(() => {
+        if (activeTab !== 'reports' || !selectedDevice || !reportData) return;
+        const timer = setTimeout(() => {
+            fetchReportSales(null, 1).catch(error => console.error("Report search failed", error));
+        }, 300);
+        return () => clearTimeout(timer);
+    }, [reportSearch]);
+
     useEffect(() => {
         if (selectedDevice) {
             fetchData();
         }
     }, [selectedDevice, activeTab, reportPeriod, reportStartDate, reportEndDate]);
 
+    const reportParams = () => {
+        const params = new URLSearchParams();
+        if (reportPeriod) params.append('period', reportPeriod);
+        if (reportStartDate) params.append('start_date', reportStartDate);
+        if (reportEndDate) params.append('end_date', reportEndDate);
+        return params;
+    };
+
+    const fetchReportSales = async (cursor, page) => {
+        const params = reportParams();
+        params.append('limit', REPORT_PAGE_SIZE);
+        if (cursor) params.append('cursor', cursor);
+        if (reportSearch) params.append('search', reportSearch);
+        const res = await api.get(`/hotspot/${selectedDevice}/reports/sales?${params.toString()}`);
+        setReportRows(res.data);
+        setReportNextCursor(res.headers['x-next-cursor'] || null);
+        setReportCursors(cursors => [...cursors.slice(0, page - 1), cursor]);
+        setReportPage(page);
+    };
+
     const fetchDevices = async () => {
         try {
             const res = await api.get('/inventory/devices');
@@ -151,16 +180,23 @@ export default function Hotspot() {
                 setLogs(res.data);
                 setHealthStatus('online');
             } else if (activeTab === 'reports') {
-                const params = new URLSearchParams();
-                if (reportPeriod) params.append('period', reportPeriod);
-                if (reportStartDate) params.append('start_date', reportStartDate);
-                if (reportEndDate) params.append('end_date', reportEndDate);
+                const params = reportParams();
+                params.append('limit', REPORT_PAGE_SIZE);
 
                 const [reportRes, templateRes] = await Promise.all([
                     api.get(`/hotspot/${selectedDevice}/reports?${params.toString()}`),
                     api.get(`/hotspot/${selectedDevice}/voucher-template`)
                 ]);
                 setReportData(reportRes.data);
+                if (reportSearch) {
+                    await fetchReportSales(null, 1);
+                } else {
+                    // The report already carries the first page of sales
+                    setReportRows(reportRes.data.data || []);
+                    setReportNextCursor(reportRes.data.next_cursor || null);
+                    setReportCursors([null]);
+                    setReportPage(1);
+                }
                 if (templateRes.data) setTemplate(templateRes.data);
                 setHealthStatus('online');
             } else if (activeTab === 'profiles') {
@@ -1182,15 +1218,15 @@ export default function Hotspot() {
                                     <div className="flex items-center gap-2">
                                         <button
                                             disabled={reportPage === 1}
-                                            onClick={() => setReportPage(p => p - 1)}
+                                            onClick={() => fetchReportSales(reportCursors[reportPage - 2], reportPage - 1)}
                                             className="p-2 rounded-xl bg-white border border-gray-200 hover:bg-gray-50 disabled:opacity-30 shadow-sm"
                                         >
                                             <Plus size={16} className="rotate-45" />
                                         </button>
-                                        <span className="text-[10px] font-black text-gray-400 uppercase">Page {reportPage} / {Math.max(1, Math.ceil(filteredReports.length / 30))}</span>
+                                        <span className="text-[10px] font-black text-gray-400 uppercase">Page {reportPage}</span>
                                         <button
-                                            disabled={reportPage * 30 >= filteredReports.length}
-                                            onClick={() => setReportPage(p => p + 1)}
+                                            disabled={!reportNextCursor}
+                                            onClick={() => fetchReportSales(reportNextCursor, reportPage + 1)}
                                             className="p-2 rounded-xl bg-white border border-gray-200 hover:bg-gray-50 disabled:opacity-30 shadow-sm"
                                         >
                                             <Plus size={16} />
@@ -1198,7 +1234,7 @@ export default function Hotspot() {
                                     </div>
                                 </div>
                                 <ResponsiveTable
-                                    data={filteredReports.slice((reportPage - 1) * 30, reportPage * 30)}
+                                    data={reportRows}
                                     columns={[
                                         {
                                             header: 'Code',